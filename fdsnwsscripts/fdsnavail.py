@@ -25,7 +25,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys
-from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import scan_files
+from fdsnwsscripts.seiscomp.mseedlite import ns2datetime
+from fdsnwsscripts.seiscomp import sds
+from fdsnwsscripts.seiscomp.isotime import parse_time
 import os
 from collections import namedtuple
 from datetime import datetime
@@ -55,10 +58,7 @@ def str2date(dstr: str) -> Union[datetime, None]:
     if dstr is None or not len(dstr):
         return None
 
-    dateparts = dstr.replace('-', ' ').replace('T', ' ')
-    dateparts = dateparts.replace(':', ' ').replace('.', ' ')
-    dateparts = dateparts.replace('Z', '').split()
-    return datetime(*map(int, dateparts))
+    return parse_time(dstr)
 
 
 def line2filter(line: str) -> str:
@@ -118,20 +118,27 @@ class Availability:
     Availability information about streams
     """
     def __init__(self, stream: Stream = None, starttime: datetime = None, endtime: datetime = None,
-                 postfile: str = None):
+                 postfile: str = None, postdata: str = None, routing: str = None):
         # Dictionary to save extents
         self.__dict: Dict[Stream, list] = dict()
+        # Lines routed to each data centre and data centres that could not be queried
+        self.routed: Dict[str, List[str]] = dict()
+        self.failed: List[str] = list()
 
         # GEOFON Routing Service
-        routing = 'https://geofon.gfz-potsdam.de/eidaws/routing/1/query'
+        if routing is None:
+            routing = 'https://geofon.gfz-potsdam.de/eidaws/routing/1/query'
 
         if postfile is not None:
+            with open(postfile, 'r') as fin:
+                postdata = fin.read()
+
+        if postdata is not None:
             if (stream is not None) or (starttime is not None) or (endtime is not None):
                 raise Exception('Using post_file is incompatible with the rest of the parameters')
-            with open(postfile, 'r') as fin:
-                # Query routes in post format for the availability web service
-                routes = requests.post(routing, 'format=post\nservice=availability\n%s' % (fin.read(),))
-                # print(routes.content)
+            # Query routes in post format for the availability web service
+            routes = requests.post(routing, 'format=post\nservice=availability\n%s' % (postdata,))
+            # print(routes.content)
         else:
             if stream is None:
                 return
@@ -144,7 +151,9 @@ class Availability:
             # Query routes
             routes = requests.get(auxurl)
 
+        routes.raise_for_status()
         dc = None
+        lines = self.routed
         # Read each route
         for line in routes.content.decode().splitlines():
             # Read the data centre if we don't have one
@@ -157,12 +166,17 @@ class Availability:
                 dc = None
                 continue
 
-            # Read normal line and query to the availability DC
+            lines.setdefault(dc, []).append(line)
+
+        # Query all lines routed to a DC in a single POST request
+        for dc in lines:
             # Load the dict from the response
-            # print("%s?format=json&mergegaps=1.0&%s" % (dc, line2filter(line)))
-            resp = requests.get("%s?format=json&mergegaps=1.0&%s" % (dc, line2filter(line)))
+            resp = requests.post(dc, 'format=json\nmergegaps=1.0\n%s\n' % '\n'.join(lines[dc]))
+            if resp.status_code == 204:
+                continue
             if resp.status_code != 200:
-                print('Error retrieving %s from %s' % (line, dc))
+                print('Error retrieving %d lines from %s' % (len(lines[dc]), dc))
+                self.failed.append(dc)
                 continue
             # Read each stream from the availability
             for ds in resp.json()['datasources']:
@@ -240,7 +254,7 @@ class Availability:
         if newts[0] >= newts[1]:
             raise Exception('%s >= %s' % (newts[0], newts[1]))
         # key = Stream(net, sta, loc, cha, qua, sr)
-        tol = timedelta(seconds=1.0/streamid.sr)
+        tol = timedelta(seconds=1.0/streamid.sr) if streamid.sr else timedelta(0)
 
         # First chunk added
         if streamid not in self.__dict:
@@ -328,105 +342,62 @@ class Availability:
         return dumps(self.json(), default=datetime.isoformat)
 
 
-def mseed2avail(directory: str) -> Availability:
+def mseed2avail(directory: str, jobs: int = 1) -> Availability:
     """Scan all the files with extension ".mseed" in the directory passed as input parameter.
 
     :param directory: Directory where the files should be scanned
     :type directory: str
+    :param jobs: Number of processes decoding files in parallel
+    :type jobs: int
     :returns: Availability information from the mseed files
     :rtype: Availability
     """
     scanresult = Availability()
-    for file in os.scandir(directory):
-        if not file.name.endswith('.mseed'):
-            continue
+    paths = sorted(file.path for file in os.scandir(directory) if file.name.endswith('.mseed'))
 
-        with open(file.path, 'rb') as fin:
-            for rec in Input(fin):
-                streamid = Stream(rec.net, rec.sta, rec.loc, rec.cha, rec.rectype, rec.fsamp)
-                # print("%s.%s.%s.%s %s %s" % (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time))
-                scanresult.addchunk(streamid, [rec.begin_time, rec.end_time])
+    for summary in scan_files(paths, jobs):
+        for (key, segments) in summary.streams.items():
+            streamid = Stream(*key)
+            for (start, end) in segments:
+                scanresult.addchunk(streamid, [ns2datetime(start), ns2datetime(end)])
 
     return scanresult
 
 
-# FIXME This is based on scan_sds. Check if we could merge them at some moment (fsdnws_fetch.py)
-def sds2avail(directory: str) -> Availability:
-    """Scan all the files with extension ".mseed" in the directory passed as input parameter
+def sds2avail(directory: str, starttime: datetime = None, endtime: datetime = None, network: str = None,
+              station: str = None, jobs: int = 1) -> Availability:
+    """Scan the day files of an SDS structure
 
     :param directory: Directory where the root of the SDS is located
     :type directory: str
+    :param starttime: Skip day files before this time
+    :type starttime: datetime
+    :param endtime: Skip day files after this time
+    :type endtime: datetime
+    :param network: Comma-separated network codes or patterns to scan
+    :type network: str
+    :param station: Comma-separated station codes or patterns to scan
+    :type station: str
+    :param jobs: Number of threads listing stations and of processes decoding day files in parallel
+    :type jobs: int
     :returns: Availability information from the SDS structure
     :rtype: Availability
 """
     scanresult = Availability()
-
-    def scan_cha(d: str):
-        aux, realcha = os.path.split(d)
-        realcha = realcha[:-2]
-        aux, realsta = os.path.split(aux)
-        aux, realnet = os.path.split(aux)
-        aux, realyear = os.path.split(aux)
-        for f in os.scandir(d):
-            try:
-                (net, sta, loc, cha, ext, yr, doy) = f.name.split('.')
-                # Check that the filename components are coherent with the directory ones
-                if (realyear != yr) or (realnet != net) or (realsta != sta) or (realcha != cha):
-                    raise ValueError
-            except ValueError:
-                print("invalid SDS file: " + f.name)
-                continue
-
-            with open(f.path, 'rb') as fin:
-                for rec in Input(fin):
-                    # Check that the record header components are coherent with the rest of the information
-                    if (realnet != rec.net) or (realsta != rec.sta) or (realcha != rec.cha):
-                        print('Skipping file with incoherent headers! (%s)' % f.name)
-                        continue
-                    streamid = Stream(rec.net, rec.sta, rec.loc, rec.cha, rec.rectype, rec.fsamp)
-                    # print("%s.%s.%s.%s %s %s" % (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time))
-                    scanresult.addchunk(streamid, [rec.begin_time, rec.end_time])
-
-                # First approach was to take the first and last record, but the gaps in the middle would be missing!
-                # # Check first record
-                # rec = Record(fd)
-                # filestart = rec.begin_time
-                # # Check last record
-                # fd.seek(-rec.size, 2)
-                # rec = Record(fd)
-                # fileend = rec.end_time
-                # streamid = Stream(rec.net, rec.sta, rec.loc, rec.cha, rec.rectype, rec.fsamp)
-                # print("%s.%s.%s.%s %s %s" % (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time))
-                # scanresult.addchunk(streamid, [filestart, fileend])
-
-    def scan_sta(d: str):
-        for cha in os.scandir(d):
-            if not cha.is_dir():
-                continue
-            if not cha.name.endswith('.D'):
-                continue
-            scan_cha(cha.path)
-
-    def scan_net(d: str):
-        for sta in os.scandir(d):
-            if not sta.is_dir():
-                continue
-            scan_sta(sta.path)
-
-    def scan_year(d: str):
-        for net in os.scandir(d):
-            if not net.is_dir():
+    files = [f for sta_files in sds.scan(directory, lambda files: files, starttime, endtime,
+                                         sds.pattern_filter(network, station), jobs)
+             for f in sta_files]
+
+    for (f, summary) in zip(files, scan_files([f.path for f in files], jobs)):
+        for (key, segments) in sorted(summary.streams.items()):
+            # Check that the record header components are coherent with the rest of the information
+            if (f.net != key[0]) or (f.sta != key[1]) or (f.cha != key[3]):
+                print('Skipping file with incoherent headers! (%s)' % f.path)
                 continue
-            scan_net(net.path)
 
-    for year in os.scandir(directory):
-        if not year.is_dir():
-            continue
-        try:
-            int(year.name)
-        except ValueError:
-            continue
-        scan_year(year.path)
+            streamid = Stream(*key)
+            for (start, end) in segments:
+                scanresult.addchunk(streamid, [ns2datetime(start), ns2datetime(end)])
 
     return scanresult
 
@@ -471,9 +442,10 @@ def query(args):
 
 def __scan__(args) -> Availability:
     if args.structure == 'sds':
-        return sds2avail(args.directory)
+        return sds2avail(args.directory, str2date(args.starttime), str2date(args.endtime), args.network,
+                         args.station, getattr(args, 'jobs', None) or 1)
     if args.structure == 'files':
-        return mseed2avail(args.directory)
+        return mseed2avail(args.directory, getattr(args, 'jobs', None) or 1)
 
     print('Other types of structure than SDS, or "*.mseed" files in a directory are still not supported')
     sys.exit(-2)
@@ -542,6 +514,11 @@ def main():
     parser_scan.add_argument("-d", "--directory", type=str, default=None, help="Root directory of the data holdings")
     parser_scan.add_argument("--structure", type=str, default='files', help="Organization of the data holdings",
                              choices=['files', 'sds'])
+    parser_scan.add_argument("-N", "--network", type=str, default=None, help="Network code")
+    parser_scan.add_argument("-S", "--station", type=str, default=None, help="Station code")
+    parser_scan.add_argument("-s", "--starttime", type=str, default=None, help="start time")
+    parser_scan.add_argument("-e", "--endtime", type=str, default=None, help="end time")
+    parser_scan.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel jobs scanning the data holdings")
     parser_scan.add_argument("-o", "--output-file", type=str, default=None,
                              help="file where the result of the scan is written")
     parser_scan.add_argument("-f", "--output-format", type=str, default='post', choices=['post', 'json'],
@@ -563,6 +540,8 @@ def main():
     parser_compare.add_argument("-d", "--directory", type=str, default=None, help="Root directory of the data holdings")
     parser_compare.add_argument("--structure", type=str, default='files', help="Organization of the data holdings",
                                 choices=['sds', 'files'])
+    parser_compare.add_argument("-j", "--jobs", type=int, default=4,
+                                help="Number of parallel jobs scanning the data holdings")
     parser_compare.add_argument("-o", "--output-file", type=str, default=None,
                                 help="file where the result of the comparison is written")
     parser_compare.add_argument("-f", "--output-format", type=str, default='post', choices=['post', 'json'],
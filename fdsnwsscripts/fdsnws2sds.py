@@ -31,14 +31,43 @@ import sys
 import os
 import optparse
 import datetime
-import random
+import math
+import socket
+import sqlite3
 import subprocess
-import dateutil.parser
+import threading
+import requests
 
-from fdsnwsscripts.seiscomp import mseedlite, logs
+try:
+    # Python 2.x
+    import Queue
+    import urllib2
+    import urlparse
+
+except ImportError:
+    # Python 3.x
+    import queue as Queue
+    import urllib.request as urllib2
+    import urllib.parse as urlparse
+
+from fdsnwsscripts import fdsnws_fetch, fdsnavail
+from fdsnwsscripts.seiscomp import mseedlite, msindex, sds, logs
+from fdsnwsscripts.seiscomp.isotime import parse_time
 
 VERSION = "2019.259"
 
+# maximum number of records waiting to be written to the archive
+WRITE_QUEUE_SIZE = 10000
+
+# rough size of a compressed sample, used to estimate the size of requests
+BYTES_PER_SAMPLE = 1.5
+
+# smallest time window requested per stream
+MIN_WINDOW = datetime.timedelta(minutes=1)
+
+# channel lists of previous runs, kept in the output directory
+EPOCH_CACHE_FILE = ".fdsnws2sds.epochs.sqlite"
+
 
 class Error(Exception):
     pass
@@ -49,6 +78,267 @@ class Timespan(object):
         self.start = start
         self.current = start
         self.end = end
+        self.epochs = [(start, end)]
+        self.pending = []
+        self.rate = 0.0
+        self.node = None
+        self.observed = None
+        self.window = None
+
+    def set_segments(self, segments):
+        """Download only the given list of (start, end) intervals."""
+        self.pending = list(segments)
+        self.start = self.end
+        return self.next_segment()
+
+    def next_segment(self):
+        """Continue with the next pending interval; False if there is none."""
+        if not self.pending:
+            return False
+
+        (self.start, self.end) = self.pending.pop(0)
+        self.current = self.start
+        return True
+
+    def bytes_per_second(self):
+        """Observed data rate, or an estimate based on the sample rate."""
+        if self.observed is not None:
+            return self.observed
+
+        return self.rate * BYTES_PER_SAMPLE
+
+    def observe(self, nbytes):
+        """Update the data rate after nbytes were received for [start, current]."""
+        seconds = (self.current - self.start).total_seconds()
+
+        if seconds > 0:
+            bps = nbytes / seconds
+            self.observed = bps if self.observed is None else (self.observed + bps) / 2
+
+    def adapt_window(self, target_bytes, max_window):
+        """Choose a window that is expected to return target_bytes of data."""
+        bps = self.bytes_per_second()
+
+        if bps > 0:
+            self.window = max(MIN_WINDOW, min(max_window, datetime.timedelta(seconds=target_bytes / bps)))
+
+        else:
+            self.window = max_window
+
+    def grow_window(self, max_window):
+        """Double the window after a request without data."""
+        self.window = min(max_window, self.window * 2)
+
+    def expected_bytes(self):
+        """Estimated size of the next request of this stream."""
+        seconds = (min(self.end, self.start + self.window) - self.start).total_seconds()
+        return max(seconds, 0) * self.bytes_per_second()
+
+
+def rate_class(rate):
+    """Streams with the same order of magnitude of sample rate are similar."""
+    return int(math.floor(math.log10(rate))) if rate > 0 else None
+
+
+class Planner(object):
+    """Deterministic batch planner.
+
+    Streams are grouped by the node they are routed to and nodes are
+    served round-robin, so a batch does not wait for the slowest node.
+    Within a node, groups of streams with similar sample rate take turns.
+    A batch is filled in a fixed order, continuing after the last stream
+    of the previous batch of the group, until its expected size reaches
+    max_bytes or the number of lines reaches max_lines.
+    """
+
+    def __init__(self, max_lines, max_bytes):
+        self.__max_lines = max_lines
+        self.__max_bytes = max_bytes
+        self.__last_node = None
+        self.__last_class = {}
+        self.__last_stream = {}
+
+    @staticmethod
+    def __next(keys, last):
+        for k in keys:
+            if last is None or k > last:
+                return k
+
+        return keys[0]
+
+    def next_batch(self, idle, max_streams):
+        """Select a list of (nslc, ts) for the next batch among the idle streams."""
+        groups = {}
+
+        for (nslc, ts) in idle:
+            groups.setdefault(ts.node or '', {}).setdefault(rate_class(ts.rate), []).append((nslc, ts))
+
+        if not groups:
+            return []
+
+        # None sorts before all sample rate classes
+        key = lambda c: (c is not None, c)
+
+        node = self.__next(sorted(groups), self.__last_node)
+        classes = sorted(groups[node], key=key)
+        last = self.__last_class.get(node)
+        cls = next((c for c in classes if last is not None and key(c) > key(last)), classes[0])
+        self.__last_node = node
+        self.__last_class[node] = cls
+
+        streams = sorted(groups[node][cls])
+        last = self.__last_stream.get((node, cls))
+        i = next((i for (i, (nslc, ts)) in enumerate(streams) if last is not None and nslc > last), 0)
+        ts_used = []
+        size = 0
+
+        for (nslc, ts) in streams[i:] + streams[:i]:
+            if len(ts_used) >= min(self.__max_lines, max_streams):
+                break
+
+            n = ts.expected_bytes()
+
+            if ts_used and size + n > self.__max_bytes:
+                break
+
+            ts_used.append((nslc, ts))
+            size += n
+
+        self.__last_stream[(node, cls)] = ts_used[-1][0]
+        return ts_used
+
+
+class EpochCache(object):
+    """Channel lists of previous runs, keyed by the request parameters."""
+
+    def __init__(self, path):
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS epochs (
+                query TEXT PRIMARY KEY,
+                fetched TEXT,
+                lines TEXT)
+        """)
+
+    def get(self, query):
+        """Return (time fetched, list of lines), or None."""
+        row = self.__db.execute("SELECT fetched, lines FROM epochs WHERE query = ?",
+                                (query,)).fetchone()
+
+        if row is None:
+            return None
+
+        return (parse_time(row[0]), row[1].splitlines())
+
+    def put(self, query, fetched, lines):
+        self.__db.execute("INSERT OR REPLACE INTO epochs VALUES (?, ?, ?)",
+                          (query, fetched.isoformat(), "\n".join(lines)))
+        self.__db.commit()
+
+    def close(self):
+        self.__db.close()
+
+
+class Batch(object):
+    """A single fdsnws_fetch request over a disjoint set of streams."""
+
+    def __init__(self, ts_used, proc):
+        self.ts_used = ts_used
+        self.streams = set(nslc for (nslc, ts) in ts_used)
+        self.proc = proc
+        self.nbytes = {}
+
+
+class SDSWriter(object):
+    """Appends records to day files, keeping the last file open.
+
+    If index is True, the record index files of the day files written are
+    updated when the writer is closed.
+    """
+
+    def __init__(self, root, state=None, index=False):
+        self.__root = root
+        self.__state = state
+        self.__path = None
+        self.__fd = None
+        self.__index = {} if index else None
+        self.__entries = None
+        self.__offset = 0
+        self.touched = set()
+
+    def write(self, rec):
+        sds_dir = "%s/%d/%s/%s/%s.D" \
+                  % (self.__root, rec.begin_time.year, rec.net, rec.sta, rec.cha)
+
+        sds_file = "%s.%s.%s.%s.D.%s" \
+                  % (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time.strftime('%Y.%j'))
+
+        path = sds_dir + '/' + sds_file
+
+        if path != self.__path:
+            self.__close_file()
+
+            if not os.path.exists(sds_dir):
+                os.makedirs(sds_dir)
+
+            self.__fd = open(path, 'ab')
+            self.__path = path
+            self.touched.add(path)
+
+            if self.__index is not None:
+                self.__offset = self.__fd.seek(0, 2)
+
+                if path not in self.__index:
+                    index = msindex.load(path) if self.__offset > 0 else None
+                    if index is None and self.__offset > 0:
+                        index = msindex.build(path)
+
+                    self.__index[path] = index.entries if index is not None else []
+
+                self.__entries = self.__index[path]
+
+            if self.__state is not None:
+                self.__state.add_file(rec.net, rec.sta, rec.loc, rec.cha,
+                                      rec.begin_time.year, int(rec.begin_time.strftime('%j')))
+
+        self.__fd.write(rec.raw)
+
+        if self.__entries is not None:
+            self.__entries.append(((rec.net, rec.sta, rec.loc, rec.cha), rec.begin_ns, rec.end_ns,
+                                   self.__offset, rec.size))
+            self.__offset += rec.size
+
+        if self.__state is not None:
+            self.__state.set_endtime((rec.net, rec.sta, rec.loc, rec.cha), rec.end_time)
+
+    def __close_file(self):
+        if self.__fd is not None:
+            self.__fd.close()
+            self.__fd = None
+            self.__path = None
+            self.__entries = None
+
+    def close(self):
+        self.__close_file()
+
+        if self.__index is not None:
+            for (path, entries) in sorted(self.__index.items()):
+                msindex.save(path, msindex.Index(entries))
+
+            self.__index.clear()
+
+
+def read_batch(batch, queue):
+    """Feed the records of a batch to the writer, followed by None."""
+    try:
+        for rec in mseedlite.Input(batch.proc.stdout):
+            queue.put((batch, rec))
+
+    except mseedlite.MSeedError as e:
+        logs.error(str(e))
+
+    finally:
+        queue.put((batch, None))
 
 
 def exec_fetch(param, data, verbose, no_check):
@@ -75,61 +365,319 @@ def exec_fetch(param, data, verbose, no_check):
     return proc
 
 
-def scan_sds(d, timespan, nets):
-    def scan_cha(d):
+def fetch_channels(param, verbose, no_check):
+    """Run fdsnws_fetch and return the lines of the channel list."""
+    proc = exec_fetch(param, None, verbose, no_check)
+    lines = []
+
+    for line in proc.stdout:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+
+        line = line.rstrip('\n')
+
+        if line and not line.startswith('#'):
+            lines.append(line)
+
+    proc.stdout.close()
+    proc.wait()
+
+    if proc.returncode != 0:
+        raise Error("error running fdsnws_fetch")
+
+    return lines
+
+
+def get_channels(param, cache, query, ttl, verbose, no_check):
+    """Return the channel list, using the cache if not older than ttl.
+
+    An expired cache entry is updated with the epochs that changed since
+    it was fetched (updatedafter); if that fails, the full list is
+    downloaded.
+    """
+    now = datetime.datetime.utcnow()
+    cached = cache.get(query) if cache is not None else None
+
+    if cached is not None:
+        (fetched, lines) = cached
+
+        if now - fetched < ttl:
+            logs.info("using cached channel list from %s" % fetched.isoformat())
+            return lines
+
+        logs.info("updating cached channel list from %s" % fetched.isoformat())
+
+        try:
+            updated = fetch_channels(param + ["-q", "updatedafter=" + fetched.isoformat()],
+                                     verbose, no_check)
+
+            # an updated epoch replaces the cached epoch with the same start time
+            epochs = {}
+
+            for line in lines + updated:
+                fields = line.split('|')
+                epochs[tuple(fields[:4]) + (fields[15],)] = line
+
+            lines = [epochs[k] for k in sorted(epochs)]
+            cache.put(query, now, lines)
+            return lines
+
+        except (OSError, Error) as e:
+            logs.warning("%s, downloading full channel list" % str(e))
+
+    lines = fetch_channels(param, verbose, no_check)
+
+    if cache is not None:
+        cache.put(query, now, lines)
+
+    return lines
+
+
+def update_timespan(timespan, nslc, endtime):
+    """Resume stream nslc after data ending at endtime."""
+    try:
+        ts = timespan[nslc]
+
+    except KeyError:
+        return
+
+    if ts.start < endtime < ts.end:
+        ts.start = endtime
+        ts.current = endtime
+
+    elif endtime >= ts.end:
+        del timespan[nslc]
+
+
+def load_state(state, timespan, nets):
+    """Initialize timespans from the SDS index instead of scanning."""
+    for nslc in list(timespan):
+        endtime = state.endtime(nslc)
+
+        if endtime is not None:
+            update_timespan(timespan, nslc, endtime)
+
+    nets.update(state.networks())
+
+
+def scan_sds(d, timespan, nets, state=None, jobs=1):
+    """Scan the SDS archive; rebuild the index if state is not None.
+
+    Without an index, only the networks, stations and time window of the
+    requested streams are scanned.
+    """
+    def scan_sta(files):
         last_file = {}
 
-        for f in os.listdir(d):
-            try:
-                (net, sta, loc, cha, ext, year, doy) = f.split('.')
-                nets.add((net, int(year)))
+        for f in files:
+            nslc = (f.net, f.sta, f.loc, f.cha)
 
-            except ValueError:
-                logs.error("invalid SDS file:" + p, True)
+            if state is None and nslc not in timespan:
                 continue
 
-            if (net, sta, loc, cha) not in timespan:
-                continue
+            if nslc not in last_file or f.doy > last_file[nslc].doy:
+                last_file[nslc] = f
 
-            try:
-                if doy > last_file[loc][0]:
-                    last_file[loc] = (doy, f)
+        endtimes = []
 
-            except KeyError:
-                last_file[loc] = (doy, f)
-
-        for (loc, (doy, f)) in last_file.items():
-            with open(d + '/' + f, 'rb') as fd:
-                nslc = tuple(f.split('.')[:4])
-                rec = mseedlite.Record(fd)
+        for (nslc, f) in sorted(last_file.items()):
+            with open(f.path, 'rb') as fd:
+                rec = mseedlite.Record(fd, headers_only=True)
                 fd.seek(-rec.size, 2)
-                rec = mseedlite.Record(fd)
-                ts = timespan[nslc]
+                rec = mseedlite.Record(fd, headers_only=True)
+                endtimes.append((nslc, rec.end_time))
 
-                if ts.start < rec.end_time < ts.end:
-                    ts.start = rec.end_time
-                    ts.current = rec.end_time
+        return (files, endtimes)
 
-                elif rec.end_time >= ts.end:
-                    del timespan[nslc]
+    if state is not None:
+        state.clear()
+        starttime = None
+        endtime = None
+        select = None
 
-    def scan_sta(d):
-        for cha in os.listdir(d):
-            if not cha.endswith('.D'):
-                continue
+    elif timespan:
+        starttime = min(ts.start for ts in timespan.values())
+        endtime = max(ts.end for ts in timespan.values())
+        networks = set(net for (net, sta, loc, cha) in timespan)
+        stations = set((net, sta) for (net, sta, loc, cha) in timespan)
+        select = lambda net, sta: net in networks if sta is None \
+            else (net, sta) in stations
+
+    else:
+        return
+
+    for (files, endtimes) in sds.scan(d, scan_sta, starttime, endtime, select, jobs):
+        for f in files:
+            nets.add((f.net, f.year))
+
+            if state is not None:
+                state.add_file(f.net, f.sta, f.loc, f.cha, f.year, f.doy)
+
+        for (nslc, endtime) in endtimes:
+            if state is not None:
+                state.set_endtime(nslc, endtime)
+
+            update_timespan(timespan, nslc, endtime)
+
+    if state is not None:
+        state.finish()
+
+
+def fill_gaps(d, timespan, nets, state=None, jobs=1):
+    """Restrict the timespans to the intervals missing in the SDS archive.
+
+    The coverage of each day file is computed from the record headers, in
+    a pool of jobs processes, and cached in the index (if state is not
+    None) as long as the file does not change. Gaps between channel epochs
+    are not requested.
+    """
+    if not timespan:
+        return
+
+    starttime = min(t for ts in timespan.values() for (t, _) in ts.epochs)
+    endtime = max(t for ts in timespan.values() for (_, t) in ts.epochs)
+    networks = set(net for (net, sta, loc, cha) in timespan)
+    stations = set((net, sta) for (net, sta, loc, cha) in timespan)
+    select = lambda net, sta: net in networks if sta is None \
+        else (net, sta) in stations
+
+    files = []
+
+    for sta_files in sds.scan(d, lambda files: files, starttime, endtime, select, jobs):
+        for f in sta_files:
+            if (f.net, f.sta, f.loc, f.cha) in timespan:
+                st = os.stat(f.path)
+                files.append((f, st.st_size, st.st_mtime_ns))
+
+    result = {}
+    todo = []
+
+    for (f, size, mtime) in files:
+        cached = state.coverage(f.path, size, mtime) if state is not None else None
+
+        if cached is not None:
+            result[f.path] = cached
+
+        else:
+            todo.append((f, size, mtime))
+
+    computed = [sds.summary_coverage(summary)
+                for summary in mseedlite.scan_files([f.path for (f, size, mtime) in todo], jobs)]
+
+    for ((f, size, mtime), (period, segments)) in zip(todo, computed):
+        result[f.path] = (period, segments)
+
+        if state is not None:
+            state.set_coverage(f.path, size, mtime, period, segments)
+
+    period = {}
+    covered = {}
+
+    for (f, size, mtime) in files:
+        nslc = (f.net, f.sta, f.loc, f.cha)
+        (p, segments) = result[f.path]
+        period[nslc] = max(p, period.get(nslc, 0.0))
+        covered.setdefault(nslc, []).extend(segments)
+        nets.add((f.net, f.year))
+
+    for nslc in list(timespan):
+        ts = timespan[nslc]
+        min_gap = datetime.timedelta(seconds=period.get(nslc, 0.0))
+        gaps = sds.missing(ts.epochs, covered.get(nslc, []), min_gap)
+
+        if gaps:
+            logs.info("%s.%s.%s.%s: %d missing intervals" % (nslc + (len(gaps),)))
+
+        if not ts.set_segments(gaps):
+            del timespan[nslc]
+
+
+def use_availability(url, timespan):
+    """Restrict the timespans to the intervals where data is available.
+
+    The availability of all streams is requested in bulk, one POST request
+    per data centre. Streams without a working availability service are
+    not restricted.
+    """
+    postdata = ""
+
+    for ((net, sta, loc, cha), ts) in sorted(timespan.items()):
+        for (start, end) in [(ts.start, ts.end)] + ts.pending:
+            postdata += "%s %s %s %s %sZ %sZ\n" \
+                        % (net, sta, loc or '--', cha, start.isoformat(), end.isoformat())
+
+    routing_url = fdsnws_fetch.RoutingURL(urlparse.urlparse(url), {})
+    avail = fdsnavail.Availability(postdata=postdata, routing=routing_url.post())
+    available = {}
+    known = set()
+
+    for (dc, lines) in avail.routed.items():
+        if dc not in avail.failed:
+            for line in lines:
+                (net, sta, loc, cha) = line.split()[:4]
+                known.add((net, sta, '' if loc == '--' else loc, cha))
+
+    for (stream, (start, end)) in avail:
+        available.setdefault((stream.net, stream.sta, stream.loc, stream.cha), []).append((start, end))
+
+    for nslc in list(timespan):
+        if nslc not in known:
+            continue
+
+        ts = timespan[nslc]
+        windows = [(ts.start, ts.end)] + ts.pending
+
+        # the parts of the windows that are not unavailable
+        segments = sds.missing(windows, sds.missing(windows, available.get(nslc, [])))
+
+        if not ts.set_segments(segments):
+            del timespan[nslc]
+
+
+def get_routes(url, timespan, timeout, retry_count, retry_wait, verbose):
+    """Return a dict mapping each stream to the URL of the node serving it.
+
+    Streams that are split between several nodes are assigned to the
+    first one.
+    """
+    routing_url = fdsnws_fetch.RoutingURL(urlparse.urlparse(url), {'service': 'dataselect'})
+    postdata = "".join("%s=%s\n" % (p, v) for (p, v) in routing_url.post_params())
+
+    for ((net, sta, loc, cha), ts) in sorted(timespan.items()):
+        postdata += "%s %s %s %s %sZ %sZ\n" \
+                    % (net, sta, loc or '--', cha, ts.start.isoformat(), ts.end.isoformat())
+
+    fd = fdsnws_fetch.retry(urllib2.urlopen, routing_url.post(), postdata.encode('utf-8'),
+                            timeout, retry_count, retry_wait, verbose)
+
+    routes = {}
+    node = None
+
+    try:
+        for line in fd:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+
+            line = line.strip()
+
+            if not line:
+                node = None
+
+            elif node is None:
+                node = line
 
-            scan_cha(d + '/' + cha)
+            else:
+                (net, sta, loc, cha) = line.split()[:4]
 
-    def scan_net(d):
-        for sta in os.listdir(d):
-            scan_sta(d + '/' + sta)
+                if loc == '--':
+                    loc = ''
 
-    def scan_year(d):
-        for net in os.listdir(d):
-            scan_net(d + '/' + net)
+                routes.setdefault((net, sta, loc, cha), node)
 
-    for year in os.listdir(d):
-        scan_year(d + "/" + year)
+    finally:
+        fd.close()
+
+    return routes
 
 
 def get_citation(nets, param, verbose):
@@ -161,7 +709,7 @@ def get_citation(nets, param, verbose):
 
             (code, desc, start) = line.split('|')[:3]
 
-            year = dateutil.parser.parse(start).year
+            year = parse_time(start).year
 
         except (ValueError, UnicodeDecodeError) as e:
             logs.error("error parsing text format: %s" % str(e))
@@ -193,6 +741,7 @@ def main():
     param1 = ["-y", "station", "-q", "format=text", "-q", "level=channel"]
     param2 = ["-y", "dataselect", "-z"]
     times = {"starttime": datetime.datetime(1900, 1, 1), "endtime": datetime.datetime(2100, 1, 1)}
+    query = []
     nets = set()
 
     def add_param0(option, opt_str, value, parser):
@@ -203,11 +752,17 @@ def main():
         param1.append(opt_str)
         param1.append(value)
 
+        # parameters that select the channel list
+        if option.dest in ('url', 'network', 'station', 'location', 'channel',
+                           'starttime', 'endtime'):
+            query.append("%s=%s" % (option.dest, value))
+
     def add_param2(option, opt_str, value, parser):
         param2.append(opt_str)
         param2.append(value)
 
     def add_param(option, opt_str, value, parser):
+        setattr(parser.values, option.dest, value)
         add_param0(option, opt_str, value, parser)
         add_param1(option, opt_str, value, parser)
         add_param2(option, opt_str, value, parser)
@@ -216,16 +771,11 @@ def main():
         add_param1(option, opt_str, value, parser)
 
         try:
-            t = dateutil.parser.parse(value)
+            times[option.dest] = parse_time(value)
 
         except ValueError as e:
             raise optparse.OptionValueError("option '%s': invalid time value: '%s'" % (opt_str, value))
 
-        if t.tzinfo is not None:
-            t = t.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
-
-        times[option.dest] = t
-
     parser = optparse.OptionParser(
             usage="Usage: %prog [-h|--help] [OPTIONS] -o directory",
             version="%prog " + VERSION)
@@ -237,7 +787,12 @@ def main():
             retry_wait=60,
             threads=5,
             max_lines=1000,
-            max_timespan=1440)
+            max_timespan=1440,
+            max_bytes=100000000,
+            cache_ttl=24,
+            target_bytes=10000000,
+            batches=2,
+            jobs=4)
 
     parser.add_option("-v", "--verbose", action="store_true", default=False,
                       help="verbose mode")
@@ -303,6 +858,40 @@ def main():
     parser.add_option("-m", "--max-timespan", type="int",
                       help="max timespan per request in minutes (default %default)")
 
+    parser.add_option("-B", "--max-bytes", type="int",
+                      help="max expected size of a request in bytes (default %default)")
+
+    parser.add_option("-T", "--target-bytes", type="int",
+                      help="target size of data per stream and request in bytes (default %default)")
+
+    parser.add_option("-b", "--batches", type="int",
+                      help="number of requests running concurrently (default %default)")
+
+    parser.add_option("--rescan", action="store_true", default=False,
+                      help="rebuild the index of the SDS directory")
+
+    parser.add_option("--no-index", action="store_true", default=False,
+                      help="scan the SDS directory without using an index")
+
+    parser.add_option("--fill-gaps", action="store_true", default=False,
+                      help="download data missing anywhere in the SDS directory, "
+                           "not only after its end")
+
+    parser.add_option("--use-availability", action="store_true", default=False,
+                      help="request only data reported by the availability service")
+
+    parser.add_option("--compact", action="store_true", default=False,
+                      help="sort the day files written and remove duplicate records")
+
+    parser.add_option("--record-index", action="store_true", default=False,
+                      help="keep a record index file next to each day file written")
+
+    parser.add_option("-j", "--jobs", type="int",
+                      help="number of threads and processes scanning the SDS directory (default %default)")
+
+    parser.add_option("--cache-ttl", type="float",
+                      help="hours to use the cached channel list, 0 to disable the cache (default %default)")
+
     parser.add_option("-z", "--no-citation", action="store_true", default=False,
                       help="suppress network citation info")
 
@@ -311,7 +900,8 @@ def main():
 
     (options, args) = parser.parse_args()
 
-    if args or not options.output_dir:
+    if args or not options.output_dir or options.batches < 1 or \
+            options.max_lines < 1:
         parser.print_usage(sys.stderr)
         return 1
 
@@ -343,40 +933,50 @@ def main():
     logs.debug = log_silent
 
     try:
+        if not os.path.exists(options.output_dir):
+            os.makedirs(options.output_dir)
+
+        if options.cache_ttl > 0:
+            cache = EpochCache(os.path.join(options.output_dir, EPOCH_CACHE_FILE))
+
+        else:
+            cache = None
+
         try:
-            proc = exec_fetch(param1, None, options.verbose, options.no_check)
+            lines = get_channels(param1, cache, " ".join(sorted(query)),
+                                 datetime.timedelta(hours=options.cache_ttl),
+                                 options.verbose, options.no_check)
 
         except OSError as e:
             logs.error(str(e))
             logs.error("error running fdsnws_fetch")
             return 1
 
-        timespan = {}
+        finally:
+            if cache is not None:
+                cache.close()
 
-        for line in proc.stdout:
-            if isinstance(line, bytes):
-                line = line.decode('utf-8')
-
-            if not line or line.startswith('#'):
-                continue
+        timespan = {}
 
-            starttime = max(dateutil.parser.parse(line.split('|')[15]), times['starttime'])
+        for line in lines:
+            fields = line.rstrip().split('|')
+            starttime = max(parse_time(fields[15]), times['starttime'])
 
             try:
-                endtime = min(dateutil.parser.parse(line.split('|')[16]), times['endtime'])
+                endtime = min(parse_time(fields[16]), times['endtime'])
 
             except ValueError:
-                # dateutil.parser.parse('') now causes ValueError instead of current time
+                # open epoch
                 endtime = min(datetime.datetime.now(), times['endtime'])
 
-            if starttime.tzinfo is not None:
-                starttime = starttime.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+            try:
+                rate = float(fields[14])
 
-            if endtime.tzinfo is not None:
-                endtime = endtime.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+            except ValueError:
+                rate = 0.0
 
             try:
-                ts = timespan[tuple(line.split('|')[:4])]
+                ts = timespan[tuple(fields[:4])]
 
                 if ts.start > starttime:
                     ts.start = starttime
@@ -385,96 +985,189 @@ def main():
                 if ts.end < endtime:
                     ts.end = endtime
 
+                ts.epochs.append((starttime, endtime))
+
             except KeyError:
-                timespan[tuple(line.split('|')[:4])] = Timespan(starttime, endtime)
+                ts = timespan[tuple(fields[:4])] = Timespan(starttime, endtime)
 
-        proc.stdout.close()
-        proc.wait()
+            ts.rate = max(ts.rate, rate)
 
-        if proc.returncode != 0:
-            logs.error("error running fdsnws_fetch")
-            return 1
+        if options.no_index:
+            state = None
 
-        if os.path.exists(options.output_dir):
-            scan_sds(options.output_dir, timespan, nets)
+            if not options.fill_gaps:
+                logs.info("scanning %s" % options.output_dir)
+                scan_sds(options.output_dir, timespan, nets, None, options.jobs)
 
-        while len(timespan) > 0:
-            postdata = ""
+        else:
+            state = sds.State(os.path.join(options.output_dir, sds.STATE_FILE))
+
+            if options.fill_gaps:
+                # the end times in the index are not used, but the index
+                # must still be valid when it is marked as clean again
+                if options.rescan or not state.is_valid():
+                    logs.info("scanning %s" % options.output_dir)
+                    scan_sds(options.output_dir, dict(timespan), nets, state, options.jobs)
 
-            ts_used = random.sample(list(timespan.items()), min(len(timespan), options.max_lines))
+            elif state.is_valid() and not options.rescan:
+                load_state(state, timespan, nets)
 
-            for ((net, sta, loc, cha), ts) in ts_used:
-                te = min(ts.end, ts.start + datetime.timedelta(minutes=options.max_timespan))
+            else:
+                logs.info("scanning %s" % options.output_dir)
+                scan_sds(options.output_dir, timespan, nets, state, options.jobs)
 
-                if loc == '':
-                    loc = '--'
+            state.begin()
 
-                postdata += "%s %s %s %s %sZ %sZ\n" \
-                            % (net, sta, loc, cha, ts.start.isoformat(), te.isoformat())
+        if options.fill_gaps:
+            logs.info("computing coverage of %s" % options.output_dir)
+            fill_gaps(options.output_dir, timespan, nets, state, options.jobs)
 
-            if not isinstance(postdata, bytes):
-                postdata = postdata.encode('utf-8')
+        if options.use_availability and timespan:
+            logs.info("getting availability from %s" % options.url)
 
             try:
-                proc = exec_fetch(param2, postdata, options.verbose, options.no_check)
+                use_availability(options.url, timespan)
 
-            except OSError as e:
-                logs.error(str(e))
-                logs.error("error running fdsnws_fetch")
-                return 1
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logs.warning("getting availability failed: %s" % str(e))
 
-            got_data = False
+        if timespan:
+            logs.info("getting routes from %s" % options.url)
 
             try:
-                for rec in mseedlite.Input(proc.stdout):
-                    try:
-                        ts = timespan[(rec.net, rec.sta, rec.loc, rec.cha)]
+                routes = get_routes(options.url, timespan, options.timeout, options.retries,
+                                    options.retry_wait, options.verbose)
 
-                    except KeyError:
-                        logs.warning("unexpected data: %s.%s.%s.%s" % (rec.net, rec.sta, rec.loc, rec.cha))
-                        continue
+                for (nslc, ts) in timespan.items():
+                    ts.node = routes.get(nslc)
 
-                    if rec.end_time <= ts.current:
-                        continue
+            except (urllib2.URLError, socket.error) as e:
+                logs.warning("getting routes from %s failed: %s" % (options.url, str(e)))
+
+        max_window = datetime.timedelta(minutes=options.max_timespan)
 
-                    sds_dir = "%s/%d/%s/%s/%s.D" \
-                              % (options.output_dir, rec.begin_time.year, rec.net, rec.sta, rec.cha)
+        for ts in timespan.values():
+            ts.adapt_window(options.target_bytes, max_window)
 
-                    sds_file = "%s.%s.%s.%s.D.%s" \
-                              % (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time.strftime('%Y.%j'))
+        planner = Planner(options.max_lines, options.max_bytes)
+        queue = Queue.Queue(WRITE_QUEUE_SIZE)
+        writer = SDSWriter(options.output_dir, state, options.record_index)
+        running = []
+        busy = set()
 
-                    if not os.path.exists(sds_dir):
-                        os.makedirs(sds_dir)
+        try:
+            while timespan or running:
+                # keep up to options.batches requests in flight, each one
+                # covering streams that no other running batch is using
+                while len(running) < options.batches:
+                    idle = [(nslc, ts) for (nslc, ts) in timespan.items() if nslc not in busy]
 
-                    with open(sds_dir + '/' + sds_file, 'ab') as fd:
-                        fd.write(rec.header + rec.data)
+                    if not idle:
+                        break
 
-                    ts.current = rec.end_time
-                    nets.add((rec.net, rec.begin_time.year))
-                    got_data = True
+                    # split the streams between batches if there are few
+                    ts_used = planner.next_batch(idle, -(-len(timespan) // options.batches))
+                    postdata = ""
 
-            except mseedlite.MSeedError as e:
-                logs.error(str(e))
+                    for ((net, sta, loc, cha), ts) in ts_used:
+                        te = min(ts.end, ts.start + ts.window)
 
-            proc.stdout.close()
-            proc.wait()
+                        if loc == '':
+                            loc = '--'
 
-            if proc.returncode != 0:
-                logs.error("error running fdsnws_fetch")
-                return 1
+                        postdata += "%s %s %s %s %sZ %sZ\n" \
+                                    % (net, sta, loc, cha, ts.start.isoformat(), te.isoformat())
 
-            for ((net, sta, loc, cha), ts) in ts_used:
-                if not got_data:
-                    # no progress, skip to next segment
-                    ts.start += datetime.timedelta(minutes=options.max_timespan)
+                    if not isinstance(postdata, bytes):
+                        postdata = postdata.encode('utf-8')
 
-                else:
-                    # continue from current position
-                    ts.start = ts.current
+                    try:
+                        proc = exec_fetch(param2, postdata, options.verbose, options.no_check)
+
+                    except OSError as e:
+                        logs.error(str(e))
+                        logs.error("error running fdsnws_fetch")
+                        return 1
+
+                    batch = Batch(ts_used, proc)
+                    busy.update(batch.streams)
+                    running.append(batch)
+
+                    thr = threading.Thread(target=read_batch, args=(batch, queue))
+                    thr.daemon = True
+                    thr.start()
 
-                if ts.start >= ts.end:
-                    # timespan completed
-                    del timespan[(net, sta, loc, cha)]
+                (batch, rec) = queue.get()
+
+                if rec is not None:
+                    nslc = (rec.net, rec.sta, rec.loc, rec.cha)
+
+                    if nslc not in batch.streams:
+                        logs.warning("unexpected data: %s.%s.%s.%s" % nslc)
+                        continue
+
+                    ts = timespan[nslc]
+
+                    if rec.end_time <= ts.current or rec.begin_time >= ts.end:
+                        continue
+
+                    writer.write(rec)
+                    ts.current = rec.end_time
+                    nets.add((rec.net, rec.begin_time.year))
+                    batch.nbytes[nslc] = batch.nbytes.get(nslc, 0) + rec.size
+                    continue
+
+                # all records of the batch have been written
+                running.remove(batch)
+                busy.difference_update(batch.streams)
+                batch.proc.stdout.close()
+                batch.proc.wait()
+
+                if state is not None:
+                    state.commit()
+
+                if batch.proc.returncode != 0:
+                    logs.error("error running fdsnws_fetch")
+                    return 1
+
+                for (nslc, ts) in batch.ts_used:
+                    if nslc not in batch.nbytes:
+                        # no data, skip the window and try a larger one
+                        ts.start += ts.window
+                        ts.current = max(ts.current, ts.start)
+                        ts.grow_window(max_window)
+
+                    else:
+                        # continue from current position
+                        ts.observe(batch.nbytes[nslc])
+                        ts.adapt_window(options.target_bytes, max_window)
+                        ts.start = ts.current
+
+                    if ts.start >= ts.end and not ts.next_segment():
+                        # timespan completed
+                        del timespan[nslc]
+
+        finally:
+            writer.close()
+
+            if state is not None:
+                state.finish()
+                state.close()
+
+            for batch in running:
+                batch.proc.kill()
+                batch.proc.wait()
+
+        if options.compact:
+            logs.info("compacting %d day files" % len(writer.touched))
+
+            for path in sorted(writer.touched):
+                try:
+                    if sds.compact(path) and options.record_index:
+                        msindex.update(path)
+
+                except mseedlite.MSeedError as e:
+                    logs.error(str(e))
 
         if nets and not options.no_citation:
             logs.info("retrieving network citation info")
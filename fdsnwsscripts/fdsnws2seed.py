@@ -33,8 +33,8 @@ import optparse
 import subprocess
 import tempfile
 import shutil
-import dateutil.parser
 from fdsnwsscripts.seiscomp import fdsnxml, mseedlite, fseed, logs
+from fdsnwsscripts.seiscomp.isotime import parse_time
 
 VERSION = "2019.259"
 ORGANIZATION = "EIDA"
@@ -93,7 +93,7 @@ def get_citation(nets, param, verbose):
 
             (code, desc, start) = line.split('|')[:3]
 
-            year = dateutil.parser.parse(start).year
+            year = parse_time(start).year
 
         except (ValueError, UnicodeDecodeError) as e:
             logs.error("error parsing text format: %s" % str(e))
@@ -330,7 +330,8 @@ def main():
             return 1
 
         try:
-            for rec in mseedlite.Input(proc.stdout):
+            # fseed merges records only if they are sorted by channel and time
+            for rec in mseedlite.sort_records(mseedlite.Input(proc.stdout), unique=True):
                 try:
                     seed_volume.add_data(rec)
 
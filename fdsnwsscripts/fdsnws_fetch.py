@@ -1,28 +1,27 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""fdsnws_fetch
-
-This program is free software: you can redistribute it and/or modify
-it under the terms of the GNU Lesser General Public License as published
-by the Free Software Foundation, either version 3 of the License, or
-any later version.
-
-This program is distributed in the hope that it will be useful,
-but WITHOUT ANY WARRANTY; without even the implied warranty of
-MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-GNU Lesser General Public License for more details.
-
-You should have received a copy of the GNU General Public License
-along with this program.  If not, see <http://www.gnu.org/licenses/>.
-
-   :Copyright:
-       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
-   :License:
-       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
-   :Platform:
-       Linux
-"""
+# fdsnws_fetch
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    :Copyright:
+#        2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+#    :License:
+#        LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+#    :Platform:
+#        Linux
 
 """
 A command-line FDSN Web Service client using EIDA routing and authentication.
@@ -75,6 +74,14 @@ specified on the command line.
 .. code-block:: bash
 
     $ %(prog)s -p request.txt -y station -q level=channel -v -o station.xml
+
+Waveforms that are already available in a local SDS archive can be taken from
+there; only the windows that are not covered by the archive are requested
+from the data centres.
+
+.. code-block:: bash
+
+    $ %(prog)s -p request.txt --local-sds /data/sds -v -o data.mseed
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
@@ -92,7 +99,6 @@ import io
 import os
 import fnmatch
 import subprocess
-import dateutil.parser
 
 try:
     # Python 3.2 and earlier
@@ -115,6 +121,9 @@ except ImportError:
     import urllib.parse as urlparse
     import urllib.parse as urllib
 
+from fdsnwsscripts.seiscomp.isotime import parse_time
+from fdsnwsscripts.seiscomp import mseedlite, msframe, msindex, sds
+
 VERSION = "2022.017"
 
 GET_PARAMS = set(('net', 'network',
@@ -136,11 +145,6 @@ STATIONXML_RESOURCE_METADATA_ELEMENTS = (
     '{http://www.fdsn.org/xml/station/1}Module',
     '{http://www.fdsn.org/xml/station/1}ModuleURI')
 
-FIXED_DATA_HEADER_SIZE = 48
-DATA_ONLY_BLOCKETTE_SIZE = 8
-
-DATA_ONLY_BLOCKETTE_NUMBER = 1000
-MINIMUM_RECORD_LENGTH = 256
 
 DEFAULT_TOKEN_LOCATION = os.environ.get("HOME", "") + "/.eidatoken"
 
@@ -707,111 +711,18 @@ def fetch(url, cred, authdata, postlines, xc, tc, dest, nets, chans,
                             # 4096 byte record, which would not be completed
                             # in the same write operation
                             while True:
+                                try:
+                                    rec = msframe.read(fd)
 
-                                # read fixed header
-                                buf = fd.read(FIXED_DATA_HEADER_SIZE)
-                                if not buf:
-                                    break
-
-                                record = buf
-                                curr_size = len(buf)
-
-                                # get offset of data (value before last,
-                                # 2 bytes, unsigned short)
-                                data_offset_idx = FIXED_DATA_HEADER_SIZE - 4
-                                data_offset, = struct.unpack(
-                                    b'!H',
-                                    buf[data_offset_idx:data_offset_idx+2])
-
-                                if data_offset >= FIXED_DATA_HEADER_SIZE:
-                                    remaining_header_size = data_offset - \
-                                        FIXED_DATA_HEADER_SIZE
-
-                                elif data_offset == 0 :
-                                    # This means that blockettes can follow,
-                                    # but no data samples. Use minimum record
-                                    # size to read following blockettes. This
-                                    # can still fail if blockette 1000 is after
-                                    # position 256
-                                    remaining_header_size = \
-                                        MINIMUM_RECORD_LENGTH - \
-                                            FIXED_DATA_HEADER_SIZE
-
-                                else:
-                                    # Full header size cannot be smaller than
-                                    # fixed header size. This is an error.
-                                    msg("record %s: data offset smaller than "\
-                                        "fixed header length: %s, bailing "\
-                                        "out" % (record_idx, data_offset))
-                                    break
-
-                                buf = fd.read(remaining_header_size)
-                                if not buf:
-                                    msg("remaining header corrupt in record "\
-                                        "%s" % record_idx)
-                                    break
-
-                                record += buf
-                                curr_size += len(buf)
-
-                                # scan variable header for blockette 1000
-                                blockette_start = 0
-                                b1000_found = False
-
-                                while (blockette_start < remaining_header_size):
-
-                                    # 2 bytes, unsigned short
-                                    blockette_id, = struct.unpack(
-                                        b'!H',
-                                        buf[blockette_start:blockette_start+2])
-
-                                    # get start of next blockette (second
-                                    # value, 2 bytes, unsigned short)
-                                    next_blockette_start, = struct.unpack(
-                                        b'!H',
-                                        buf[blockette_start+2:blockette_start+4])
-
-                                    if blockette_id == \
-                                        DATA_ONLY_BLOCKETTE_NUMBER:
-
-                                        b1000_found = True
-                                        break
-
-                                    elif next_blockette_start == 0:
-                                        # no blockettes follow
-                                        msg("record %s: no blockettes follow "\
-                                            "after blockette %s at pos %s" % (
-                                            record_idx, blockette_id,
-                                            blockette_start))
-                                        break
-
-                                    else:
-                                        blockette_start = next_blockette_start - FIXED_DATA_HEADER_SIZE
-
-                                # blockette 1000 not found
-                                if not b1000_found:
-                                    msg("record %s: blockette 1000 not found,"\
-                                        " stop reading" % record_idx)
+                                except msframe.FrameError as e:
+                                    msg("record %s: %s, stop reading"
+                                        % (record_idx, str(e)))
                                     break
 
-                                # get record size (1 byte, unsigned char)
-                                record_size_exponent_idx = blockette_start + 6
-                                record_size_exponent, = struct.unpack(
-                                    b'!B',
-                                    buf[record_size_exponent_idx:\
-                                    record_size_exponent_idx+1])
-
-                                remaining_record_size = \
-                                    2**record_size_exponent - curr_size
-
-                                # read remainder of record (data section)
-                                buf = fd.read(remaining_record_size)
-                                if not buf:
-                                    msg("cannot read data section of record "\
-                                        "%s" % record_idx)
+                                if rec is None:
                                     break
 
-                                record += buf
+                                (frame, record) = rec
 
                                 # collect network IDs
                                 try:
@@ -824,7 +735,7 @@ def fetch(url, cred, authdata, postlines, xc, tc, dest, nets, chans,
                                     msg("invalid miniseed record")
                                     break
 
-                                year, = struct.unpack(b'!H', record[20:22])
+                                year, = struct.unpack(frame.order + 'H', record[20:22])
 
                                 with lock:
                                     nets.add((net, year))
@@ -1067,6 +978,36 @@ def route(url, cred, authdata, postdata, dest, chans_to_check, timeout,
     return nets
 
 
+def fetch_local(root, qp, postdata, dest, nets, verbose):
+    """Copy the data available in a local SDS archive to dest.
+
+    The request is given by postdata or, if postdata is None, by the
+    query parameters. Returns the POST lines that must still be requested
+    from the data centres.
+    """
+    if not postdata:
+        if 'starttime' not in qp or 'endtime' not in qp:
+            msg("local SDS archive requires start and end time", verbose)
+            return postdata
+
+        postdata = ""
+
+        for n in qp.get('network', '*').split(','):
+            for s in qp.get('station', '*').split(','):
+                for l in qp.get('location', '*').split(','):
+                    for c in qp.get('channel', '*').split(','):
+                        postdata += "%s %s %s %s %s %s\n" \
+                                    % (n, s, l, c, qp['starttime'], qp['endtime'])
+
+    msg("reading local SDS archive %s" % root, verbose)
+
+    try:
+        return sds.extract(root, postdata, dest, nets)
+
+    except (OSError, mseedlite.MSeedError) as e:
+        raise Error("error reading %s: %s" % (root, str(e)))
+
+
 def get_citation(nets, options):
     postdata = ""
     for (net, year) in nets:
@@ -1094,7 +1035,7 @@ def get_citation(nets, options):
             if code.startswith('#'):
                 continue
 
-            year = dateutil.parser.parse(start).year
+            year = parse_time(start).year
 
         except (ValueError, UnicodeDecodeError) as e:
             msg("error parsing text format: %s" % str(e))
@@ -1230,6 +1171,12 @@ def main():
     parser.add_option("-Z", "--no-check", action="store_true", default=False,
                       help="suppress checking received routes and data")
 
+    parser.add_option("--record-index", action="store_true", default=False,
+                      help="write a record index file next to the output file")
+
+    parser.add_option("--local-sds", type="string", metavar="DIR",
+                      help="take available waveforms from a local SDS archive")
+
     (options, args) = parser.parse_args()
 
     if options.help:
@@ -1349,9 +1296,24 @@ def main():
 
                 postdata = parser.postdata
 
+        dest = open(options.output_file, 'wb')
+        nets = set()
+        remote = True
+
+        if options.local_sds and qp.get('service', 'dataselect') == 'dataselect':
+            postdata = fetch_local(options.local_sds, qp, postdata, dest, nets,
+                                   options.verbose)
+
+            if postdata is not None:
+                remote = any(line.strip() and '=' not in line
+                             for line in postdata.splitlines())
+
         if not options.no_check:
             if postdata:
                 for line in postdata.splitlines():
+                    if '=' in line or not line.strip():
+                        continue
+
                     nslc = line.split()[:4]
                     if nslc[2] == '--': nslc[2] = ''
                     chans_to_check.add('.'.join(nslc))
@@ -1369,12 +1331,23 @@ def main():
                                 if l == '--': l = ''
                                 chans_to_check.add('.'.join((n, s, l, c)))
 
-        url = RoutingURL(urlparse.urlparse(options.url), qp)
-        dest = open(options.output_file, 'wb')
+        if remote:
+            url = RoutingURL(urlparse.urlparse(options.url), qp)
+            nets |= route(url, cred, authdata, postdata, dest, chans_to_check,
+                          options.timeout, options.retries, options.retry_wait,
+                          options.threads, options.verbose)
+
+        else:
+            msg("all data found in local SDS archive", options.verbose)
+
+        dest.close()
+
+        if options.record_index and os.path.isfile(options.output_file):
+            try:
+                msindex.update(options.output_file)
 
-        nets = route(url, cred, authdata, postdata, dest, chans_to_check,
-                     options.timeout, options.retries, options.retry_wait,
-                     options.threads, options.verbose)
+            except mseedlite.MSeedError as e:
+                msg("cannot index %s: %s" % (options.output_file, str(e)))
 
         if nets and not options.no_citation:
               msg("retrieving network citation info", options.verbose)
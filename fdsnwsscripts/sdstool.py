@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""sdstool
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+import sys
+import argparse
+from fdsnwsscripts.seiscomp import mseedlite, msindex, sds, steim
+from fdsnwsscripts.fdsnavail import str2date
+
+VERSION = "2024.001"
+
+
+def compact(args):
+    def compact_sta(files):
+        changed = 0
+
+        for f in files:
+            try:
+                if sds.compact(f.path, args.merge):
+                    changed += 1
+
+            except mseedlite.MSeedError as e:
+                print('Error compacting %s: %s' % (f.path, e), file=sys.stderr)
+
+        return (len(files), changed)
+
+    result = sds.scan(args.directory, compact_sta, str2date(args.starttime), str2date(args.endtime),
+                      sds.pattern_filter(args.network, args.station), args.jobs)
+
+    print('%d of %d day files rewritten' % (sum(c for (n, c) in result), sum(n for (n, c) in result)))
+
+
+def repack(args):
+    rec_len_exp = args.record_length.bit_length() - 1
+    encoding = {None: None, 'steim1': steim.STEIM1, 'steim2': steim.STEIM2}[args.encoding]
+
+    def repack_sta(files):
+        changed = 0
+
+        for f in files:
+            try:
+                if sds.repack(f.path, rec_len_exp, encoding):
+                    changed += 1
+
+            except mseedlite.MSeedError as e:
+                print('Error repacking %s: %s' % (f.path, e), file=sys.stderr)
+
+        return (len(files), changed)
+
+    result = sds.scan(args.directory, repack_sta, str2date(args.starttime), str2date(args.endtime),
+                      sds.pattern_filter(args.network, args.station), args.jobs)
+
+    print('%d of %d day files rewritten' % (sum(c for (n, c) in result), sum(n for (n, c) in result)))
+
+
+def index(args):
+    def index_sta(files):
+        changed = 0
+
+        for f in files:
+            try:
+                if args.force or msindex.load(f.path) is None:
+                    msindex.save(f.path, msindex.build(f.path))
+                    changed += 1
+
+            except (mseedlite.MSeedError, OSError) as e:
+                print('Error indexing %s: %s' % (f.path, e), file=sys.stderr)
+
+        return (len(files), changed)
+
+    result = sds.scan(args.directory, index_sta, str2date(args.starttime), str2date(args.endtime),
+                      sds.pattern_filter(args.network, args.station), args.jobs)
+
+    print('%d of %d day files indexed' % (sum(c for (n, c) in result), sum(n for (n, c) in result)))
+
+
+def record_length(s):
+    n = int(s)
+    if n < 256 or n > 4096 or n & (n - 1):
+        raise argparse.ArgumentTypeError("record length must be a power of 2 from 256 to 4096")
+
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-V", "--version", action='version', version="%(prog)s " + VERSION)
+
+    subparserhelp = """Commands:"""
+    subparsers = parser.add_subparsers(help=subparserhelp)
+
+    # create the parser for the "compact" command
+    parser_compact = subparsers.add_parser('compact', help='Sort the day files of an SDS archive by time and remove duplicate records')
+    parser_compact.add_argument("-d", "--directory", type=str, required=True, help="Root directory of the SDS archive")
+    parser_compact.add_argument("-N", "--network", type=str, default=None, help="Network code")
+    parser_compact.add_argument("-S", "--station", type=str, default=None, help="Station code")
+    parser_compact.add_argument("-s", "--starttime", type=str, default=None, help="start time")
+    parser_compact.add_argument("-e", "--endtime", type=str, default=None, help="end time")
+    parser_compact.add_argument("--merge", action='store_true', default=False,
+                                help="merge contiguous Steim records into 4096-byte records")
+    parser_compact.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel jobs processing the SDS")
+    parser_compact.set_defaults(func=compact)
+
+    # create the parser for the "repack" command
+    parser_repack = subparsers.add_parser('repack', help='Re-encode contiguous Steim records of an SDS archive into full records')
+    parser_repack.add_argument("-d", "--directory", type=str, required=True, help="Root directory of the SDS archive")
+    parser_repack.add_argument("-N", "--network", type=str, default=None, help="Network code")
+    parser_repack.add_argument("-S", "--station", type=str, default=None, help="Station code")
+    parser_repack.add_argument("-s", "--starttime", type=str, default=None, help="start time")
+    parser_repack.add_argument("-e", "--endtime", type=str, default=None, help="end time")
+    parser_repack.add_argument("-r", "--record-length", type=record_length, default=4096,
+                               help="length of the records written (default 4096)")
+    parser_repack.add_argument("--encoding", choices=['steim1', 'steim2'], default=None,
+                               help="encoding of the records written (default: keep the original encoding)")
+    parser_repack.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel jobs processing the SDS")
+    parser_repack.set_defaults(func=repack)
+
+    # create the parser for the "index" command
+    parser_index = subparsers.add_parser('index', help='Write record index files for the day files of an SDS archive')
+    parser_index.add_argument("-d", "--directory", type=str, required=True, help="Root directory of the SDS archive")
+    parser_index.add_argument("-N", "--network", type=str, default=None, help="Network code")
+    parser_index.add_argument("-S", "--station", type=str, default=None, help="Station code")
+    parser_index.add_argument("-s", "--starttime", type=str, default=None, help="start time")
+    parser_index.add_argument("-e", "--endtime", type=str, default=None, help="end time")
+    parser_index.add_argument("-f", "--force", action='store_true', default=False,
+                              help="rebuild index files that are up to date")
+    parser_index.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel jobs processing the SDS")
+    parser_index.set_defaults(func=index)
+    args = parser.parse_args()
+
+    if not hasattr(args, 'func'):
+        parser.print_usage(sys.stderr)
+        return 1
+
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
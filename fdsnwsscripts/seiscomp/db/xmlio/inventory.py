@@ -20,7 +20,7 @@ from fdsnwsscripts.seiscomp.db import DBError
 try:
     from xml.etree import cElementTree as ET  # Python 2.5?
 except ImportError:
-    import cElementTree as ET
+    from xml.etree import ElementTree as ET
 
 _root_tag = "{http://geofon.gfz-potsdam.de/ns/Inventory/1.0/}inventory"
 
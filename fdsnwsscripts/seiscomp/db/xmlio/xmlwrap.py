@@ -22,7 +22,9 @@ def Property(func):
 try:
 	import xml.etree.cElementTree as ET  # Python 2.5?
 except ImportError:
-	import cElementTree as ET
+	import xml.etree.ElementTree as ET
+
+from fdsnwsscripts.seiscomp.isotime import parse_time
 
 try:
 	from decimal import Decimal   # Python 2.4
@@ -101,52 +103,14 @@ def _StationGroupType_fromxml(val):
 	else:
 		return 1
 
-_rx_datetime = re.compile("([0-9]{4})-([0-9]{2})-([0-9]{2})T" \
-	"([0-9]{2}):([0-9]{2}):([0-9]{2})(\.([0-9]*))?" \
-	"(Z|([+-])([0-9]{2}):([0-9]{2}))?$")
-
-_rx_date = re.compile("([0-9]*)-([0-9]*)-([0-9]*)" \
-	"(Z|([+-])([0-9]{2}):([0-9]{2}))?$")
-
 def _datetime_fromxml(val = ""):
 	if val is None or val == "":
 		return None
-		
-	m = _rx_datetime.match(val)
-	if m is None:
-		m = _rx_date.match(val)
-		if m is None:
-			raise ValueError("invalid datetime: " + val)
-
-		(year, month, mday, tz, plusminus, tzhours, tzminutes) = m.groups()
 
-		try:
-			# ignore time zone
-			obj = datetime.datetime(int(year), int(month), int(mday), 0, 0, 0)
-		except ValueError:
-			raise ValueError("invalid datetime: " + val)
-	else:
-		(year, month, mday, hour, min, sec, sfdot, sfract,
-			tz, plusminus, tzhours, tzminutes) = m.groups()
-
-		if sfract is None:
-			sfract = "0"
-		
-		try:
-			obj = datetime.datetime(int(year), int(month), int(mday),
-				int(hour), int(min), int(sec), int((sfract + "000000")[:6]))
-			if tz is not None and tz != "Z":
-				delta = datetime.timedelta(hours = int(tzhours),
-					minutes=int(tzminutes))
-				if plusminus == "-":
-					obj -= delta
-				else:
-					obj += delta
-				
-		except ValueError:
-			raise ValueError("invalid datetime: " + val)
-
-	return obj
+	try:
+		return parse_time(val)
+	except ValueError:
+		raise ValueError("invalid datetime: " + val)
 
 def _datetime_toxml(val):
 	if isinstance(val, datetime.datetime):
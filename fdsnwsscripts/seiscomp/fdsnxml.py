@@ -11,10 +11,16 @@ import uuid
 import json
 import math
 import datetime
-import dateutil.parser
 import fdsnwsscripts.seiscomp.db.generic.inventory
 from fdsnwsscripts.seiscomp import logs
-from xml.etree import cElementTree as ET
+from fdsnwsscripts.seiscomp.isotime import parse_time
+
+try:
+    # Python 3.8 and earlier
+    from xml.etree import cElementTree as ET
+
+except ImportError:
+    from xml.etree import ElementTree as ET
 
 try:
     import scipy.signal
@@ -571,10 +577,10 @@ class Inventory(fdsnwsscripts.seiscomp.db.generic.inventory.Inventory):
     def __process_channel(self, tree, sta, locs):
         code = tree.attrib['code']
         locationCode = tree.attrib['locationCode']
-        start = dateutil.parser.parse(tree.attrib['startDate']).replace(tzinfo=None)
+        start = parse_time(tree.attrib['startDate'])
 
         try:
-            end = dateutil.parser.parse(tree.attrib['endDate']).replace(tzinfo=None)
+            end = parse_time(tree.attrib['endDate'])
 
             if end > datetime.datetime(2100, 1, 1):
                 end = None
@@ -731,11 +737,11 @@ class Inventory(fdsnwsscripts.seiscomp.db.generic.inventory.Inventory):
 
     def __process_station(self, tree, net):
         code = tree.attrib['code']
-        start = dateutil.parser.parse(tree.attrib['startDate']).replace(tzinfo=None)
+        start = parse_time(tree.attrib['startDate'])
         sta = net.insert_station(code, start, publicID=_uuid())
 
         try:
-            sta.end = dateutil.parser.parse(tree.attrib['endDate']).replace(tzinfo=None)
+            sta.end = parse_time(tree.attrib['endDate'])
 
             if sta.end > datetime.datetime(2100, 1, 1):
                 sta.end = None
@@ -777,11 +783,11 @@ class Inventory(fdsnwsscripts.seiscomp.db.generic.inventory.Inventory):
 
     def __process_network(self, tree):
         code = tree.attrib['code']
-        start = dateutil.parser.parse(tree.attrib['startDate']).replace(tzinfo=None)
+        start = parse_time(tree.attrib['startDate'])
         net = self.insert_network(code, start, publicID=_uuid())
 
         try:
-            net.end = dateutil.parser.parse(tree.attrib['endDate']).replace(tzinfo=None)
+            net.end = parse_time(tree.attrib['endDate'])
 
             if net.end > datetime.datetime(2100, 1, 1):
                 net.end = None
@@ -18,10 +18,13 @@ try: str = unicode
 except NameError: pass
 
 import sys
+import io
+import bisect
+import os
 import re
 import json
+import mmap
 import datetime
-import fdsnwsscripts.seiscomp.mseedlite as mseed
 from tempfile import TemporaryFile
 from shutil import copyfileobj
 from fdsnwsscripts.seiscomp import logs
@@ -2637,7 +2640,8 @@ class _TimeSeries(object):
         b.output(f)
 
 class _Timespan(object):
-    def __init__(self):
+    def __init__(self, index):
+        self.__index = index
         self.__start_time = None
         self.__end_time = None
         self.__recno = 0
@@ -2647,6 +2651,7 @@ class _Timespan(object):
         if len(self.__series) == 0:
             self.__start_time = start_time
             self.__end_time = end_time
+            self.__index.add(self, start_time, end_time)
         else:
             self.extend(start_time, end_time)
 
@@ -2659,12 +2664,18 @@ class _Timespan(object):
             self.__start_time - _min_ts_gap <= end_time <= self.__end_time + _min_ts_gap
 
     def extend(self, start_time, end_time):
+        old_start_time = self.__start_time
+        old_end_time = self.__end_time
+
         if start_time < self.__start_time:
             self.__start_time = start_time
 
         if end_time > self.__end_time:
             self.__end_time = end_time
 
+        if self.__start_time != old_start_time or self.__end_time != old_end_time:
+            self.__index.update(self, old_start_time, self.__start_time, self.__end_time)
+
     def get_span_data(self):
         return (self.__start_time, self.__end_time, self.__recno)
 
@@ -2682,21 +2693,83 @@ class _Timespan(object):
 
         f.flush()
 
+class _SpanIndex(object):
+    """Timespans in the order of creation and sorted by start time.
+
+    find() returns the first timespan created that overlaps a record, like
+    testing each timespan with _Timespan.overlap(), but only looks at the
+    timespans around the record. The running maximum of the end times is
+    truncated at the first timespan that changed and recomputed lazily.
+    """
+    def __init__(self):
+        self.__spans = []
+        self.__number = {}
+        self.__starts = []
+        self.__ends = []
+        self.__sorted = []
+        self.__maxend = []
+
+    def __iter__(self):
+        return iter(self.__spans)
+
+    def __insert(self, span, start_time, end_time):
+        i = bisect.bisect_right(self.__starts, start_time)
+        self.__starts.insert(i, start_time)
+        self.__ends.insert(i, end_time)
+        self.__sorted.insert(i, span)
+        del self.__maxend[i:]
+
+    def add(self, span, start_time, end_time):
+        self.__number[span] = len(self.__spans)
+        self.__spans.append(span)
+        self.__insert(span, start_time, end_time)
+
+    def update(self, span, old_start_time, start_time, end_time):
+        i = bisect.bisect_left(self.__starts, old_start_time)
+        while self.__sorted[i] is not span:
+            i += 1
+
+        if start_time == old_start_time:
+            self.__ends[i] = end_time
+            del self.__maxend[i:]
+            return
+
+        del self.__starts[i]
+        del self.__ends[i]
+        del self.__sorted[i]
+        self.__insert(span, start_time, end_time)
+
+    def __candidates(self, t):
+        lo = bisect.bisect_left(self.__maxend, t - _min_ts_gap)
+        hi = bisect.bisect_right(self.__starts, t + _min_ts_gap)
+        return [i for i in range(lo, hi) if self.__ends[i] + _min_ts_gap >= t]
+
+    def find(self, start_time, end_time):
+        m = self.__maxend[-1] if self.__maxend else None
+        for end in self.__ends[len(self.__maxend):]:
+            if m is None or end > m:
+                m = end
+
+            self.__maxend.append(m)
+
+        found = self.__candidates(start_time) + self.__candidates(end_time)
+        if not found:
+            return None
+
+        return min((self.__sorted[i] for i in found), key=self.__number.get)
+
 class _WaveformData(object):
     def __init__(self):
         self.__fd = TemporaryFile()
         self.__recno = 0
         self.__cur_rec = None
         self.__cur_series = None
-        self.__span = []
+        self.__span = _SpanIndex()
 
     def __get_time_series(self, rec):
-        for s in self.__span:
-            if s.overlap(rec.begin_time, rec.end_time):
-                break
-        else:
-            s = _Timespan()
-            self.__span.append(s)
+        s = self.__span.find(rec.begin_time, rec.end_time)
+        if s is None:
+            s = _Timespan(self.__span)
 
         return s.new_time_series(rec.net, rec.sta, rec.loc, rec.cha,
             rec.begin_time, rec.end_time, self.__recno)
@@ -2746,7 +2819,7 @@ class _WaveformData(object):
                 contiguous = False
 
             if contiguous and self.__cur_rec.size + rec.nframes * 64 <= (1 << _RECLEN_EXP):
-                self.__cur_rec.merge(rec)
+                self.__cur_rec.merge(rec, _RECLEN_EXP)
 
             else:
                 self.__recno += 1
@@ -2767,7 +2840,7 @@ class _WaveformData(object):
             self.__cur_rec = rec
 
     def get_series_data(self):
-        return sum([ s.get_series_data() for s in self.__span ], [])
+        return [ d for s in self.__span for d in s.get_series_data() ]
 
     def output_vol(self, f):
         b = _Blockette12()
@@ -2786,17 +2859,77 @@ class _WaveformData(object):
             self.__cur_rec = None
             self.__cur_series = None
 
-        self.__fd.seek(0)
-        #copyfileobj(self.__fd, fd)
+        # the records are already in their final form, only the sequence
+        # numbers depend on data_start
+        self.__fd.flush()
+        size = self.__fd.seek(0, 2)
 
-        i = 0
-        for rec in mseed.Input(self.__fd):
-            rec.recno = data_start + i
-            rec.write(fd, _RECLEN_EXP)
-            i += 1
+        if size > 0:
+            buf = mmap.mmap(self.__fd.fileno(), size)
+
+            try:
+                recno = data_start
+                for pos in range(0, size, 1 << _RECLEN_EXP):
+                    buf[pos:pos + 6] = (b"%06d" % recno)[:6]
+                    recno += 1
 
+            finally:
+                buf.close()
+
+        _copy_file(self.__fd, fd, size)
         self.__fd.close()
 
+def _copy_file(src, dest, size):
+    """Copy size bytes from the start of src to dest, in the kernel if possible."""
+    try:
+        dest_fileno = dest.fileno()
+        dest.flush()
+        dest_pos = dest.tell()
+
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        # not a real file or not seekable (eg., a pipe)
+        dest_fileno = None
+
+    if dest_fileno is not None:
+        offset = 0
+
+        for func in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if func is None:
+                continue
+
+            try:
+                while offset < size:
+                    if func is os.sendfile:
+                        n = os.sendfile(dest_fileno, src.fileno(), offset, size - offset)
+                    else:
+                        n = func(src.fileno(), dest_fileno, size - offset, offset)
+
+                    if n == 0:
+                        break
+
+                    offset += n
+
+            except OSError:
+                continue
+
+            if offset == size:
+                dest.seek(dest_pos + size, 0)
+                return
+
+        # fall back to copying the rest in user space
+        os.lseek(dest_fileno, dest_pos + offset, os.SEEK_SET)
+        dest.seek(dest_pos + offset, 0)
+        src.seek(offset, 0)
+
+    else:
+        src.seek(0, 0)
+
+    copyfileobj(src, dest)
+
+class _NullFile(object):
+    def write(self, data):
+        pass
+
 class _RecordBuilder(object):
     def __init__(self, type, fd):
         self.__recno = 1
@@ -2840,6 +2973,37 @@ class _RecordBuilder(object):
         if len(self.__buf) > (1 << _RECLEN_EXP) - 8:
             self.flush()
 
+class _EpochIndex(object):
+    """Stream epochs of a channel sorted by start time, for finding the
+    epochs overlapping a time window in the order of the inventory.
+    """
+    def __init__(self, strm_tp):
+        self.size = len(strm_tp)
+        epochs = sorted(enumerate(strm_tp.values()),
+            key=lambda e: (e[1].start or datetime.datetime.min, e[0]))
+        self.__order = [n for (n, strmcfg) in epochs]
+        self.__epochs = [strmcfg for (n, strmcfg) in epochs]
+        self.__starts = [strmcfg.start or datetime.datetime.min for strmcfg in self.__epochs]
+
+        # running maximum of the end times, for the lower bound of a window
+        self.__maxend = []
+        m = None
+        for strmcfg in self.__epochs:
+            end = strmcfg.end or datetime.datetime.max
+            if m is None or end > m:
+                m = end
+
+            self.__maxend.append(m)
+
+    def select(self, start_time, end_time):
+        lo = 0 if start_time is None else bisect.bisect_left(self.__maxend, start_time)
+        hi = len(self.__epochs) if end_time is None else bisect.bisect_right(self.__starts, end_time)
+        found = [i for i in range(lo, hi)
+            if _cmptime(start_time, self.__epochs[i].end) <= 0 and \
+                _cmptime(end_time, self.__epochs[i].start) >= 0]
+
+        return [self.__epochs[i] for i in sorted(found, key=self.__order.__getitem__)]
+
 class SEEDVolume(object):
     def __init__(self, inventory, organization, label, resp_dict=True):
         self.__inventory = inventory
@@ -2852,6 +3016,7 @@ class SEEDVolume(object):
         self.__comment_dict = _CommentDict()
         self.__gen_dict = _GenericAbbreviationDict(inventory)
         self.__station = {}
+        self.__epochs = {}
         self.__waveform_data = None
 
         if resp_dict:
@@ -2890,18 +3055,15 @@ class SEEDVolume(object):
 
                                             strm_tp = loccfg.stream.get(chan_id)
                                             if strm_tp is not None:
-                                                for strmcfg in strm_tp.values():
-                                                    if _cmptime(start_time, strmcfg.end) <= 0 and \
-                                                        _cmptime(end_time, strmcfg.start) >= 0:
-
-                                                        if _cmptime(start_time, self.__vol_start_time) < 0:
-                                                            self.__vol_start_time = start_time
+                                                for strmcfg in self.__select_epochs(strm_tp, start_time, end_time):
+                                                    if _cmptime(start_time, self.__vol_start_time) < 0:
+                                                        self.__vol_start_time = start_time
 
-                                                        if _cmptime(end_time, self.__vol_end_time) > 0:
-                                                            self.__vol_end_time = end_time
+                                                    if _cmptime(end_time, self.__vol_end_time) > 0:
+                                                        self.__vol_end_time = end_time
 
-                                                        sta.add_chan(strmcfg)
-                                                        found = True
+                                                    sta.add_chan(strmcfg)
+                                                    found = True
 
         if not found:
             if strict:
@@ -2911,6 +3073,14 @@ class SEEDVolume(object):
                 logs.warning("cannot find %s %s %s %s %s %s" %
                     (net_code, stat_code, loc_id, chan_id, start_time, end_time))
 
+    def __select_epochs(self, strm_tp, start_time, end_time):
+        index = self.__epochs.get(id(strm_tp))
+        if index is None or index[0] is not strm_tp or index[1].size != len(strm_tp):
+            index = (strm_tp, _EpochIndex(strm_tp))
+            self.__epochs[id(strm_tp)] = index
+
+        return index[1].select(start_time, end_time)
+
     def add_data(self, rec):
         if self.__waveform_data is None:
             self.__waveform_data = _WaveformData()
@@ -2986,13 +3156,14 @@ class SEEDVolume(object):
             sta.output(rb, self.__vol_start_time, self.__vol_end_time)
 
         if self.__waveform_data is not None:
+            # the index is written to a null file first to find out
+            # where the data records start
             index_start = rb.get_recno()
-            rb.reset("T", fd)
+            rb.reset("T", _NullFile())
             self.__waveform_data.output_index(rb, 0)
 
             data_start = rb.get_recno()
             rb.reset("T", fd, index_start)
-            fd.seek((1 << _RECLEN_EXP) * (index_start - 1), 0)
             self.__waveform_data.output_index(rb, data_start)
             self.__waveform_data.output_data(fd, data_start)
 
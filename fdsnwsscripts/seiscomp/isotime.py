@@ -0,0 +1,86 @@
+"""Fast parsing of ISO 8601 time strings.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import functools
+import dateutil.parser
+import dateutil.tz
+
+# number of distinct strings remembered by parse_time()
+_CACHE_SIZE = 4096
+
+_fromisoformat = getattr(datetime.datetime, 'fromisoformat', None)
+
+
+def _parse_fixed(s):
+    """Parse YYYY-MM-DD[Thh:mm:ss[.f...]][Z], or return None."""
+    if s.endswith('Z'):
+        s = s[:-1]
+
+    if len(s) == 10 and s[4] == '-' and s[7] == '-':
+        return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+    if len(s) < 19 or s[4] != '-' or s[7] != '-' or s[10] not in 'T ' or \
+            s[13] != ':' or s[16] != ':':
+        return None
+
+    if len(s) == 19:
+        micro = 0
+
+    elif s[19] == '.' and len(s) > 20 and s[20:].isdigit():
+        micro = int(s[20:26].ljust(6, '0'))
+
+    else:
+        return None
+
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                             int(s[11:13]), int(s[14:16]), int(s[17:19]), micro)
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE)
+def parse_time(s):
+    """Parse a time string and return it as naive UTC datetime.
+
+    The shapes used by FDSN web services and StationXML are parsed by
+    datetime.fromisoformat() or a fixed-format parser; anything else is
+    passed to dateutil. Results are cached, because the same strings tend
+    to be repeated many times. Raises ValueError if s is not a valid time.
+    """
+    t = None
+
+    if _fromisoformat is not None:
+        try:
+            t = _fromisoformat(s)
+
+        except ValueError:
+            pass
+
+    if t is None:
+        try:
+            t = _parse_fixed(s)
+
+        except ValueError:
+            pass
+
+    if t is None:
+        t = dateutil.parser.parse(s)
+
+    if t.tzinfo is not None:
+        t = t.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+
+    return t
@@ -17,21 +17,59 @@ any later version.
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from typing import Tuple
+from typing import List, Tuple
+from collections import namedtuple
 from collections.abc import Iterable
+import copy
 import datetime
+import heapq
+import mmap
+import os
 import struct
 import sys
-from io import BytesIO
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from fdsnwsscripts.seiscomp import msframe, steim
 
-_FIXHEAD_LEN = 48
-_BLKHEAD_LEN = 4
-_BLK1000_LEN = 4
-_BLK1001_LEN = 4
-_MAX_RECLEN = 4096
+try:
+    import numpy
+
+except ImportError:
+    numpy = None
+
+_FIXHEAD_LEN = msframe.FIXHEAD_LEN
+_MAX_RECLEN = msframe.MAX_RECLEN
+
+# length of records without blockette 1000 and of skipped non-data records
+_DEFAULT_RECLEN = 4096
+
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+# fixed header, by byte order
+_FIXHEAD = {'>': struct.Struct(">6s2c12s2H3Bx2H2h4Bl2H"),
+            '<': struct.Struct("<6s2c12s2H3Bx2H2h4Bl2H")}
+_FIXHEAD_IN = {'>': struct.Struct(">6scx5s2s3s2s2H3Bx2H2h4Bl2H"),
+               '<': struct.Struct("<6scx5s2s3s2s2H3Bx2H2h4Bl2H")}
+_X0_XN = struct.Struct(">ll")
+_ZEROS = memoryview(bytes(1 << 16))
+
+# bytes of records sorted in memory by sort_records before spilling to disk
+_SORT_RUN_SIZE = 64 << 20
+
+# buffer reused by Record.write, one per thread
+_write_buf = threading.local()
 
 _doy = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365)
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_NS_PER_DAY = 86400 * 10**9
+
+# days from the epoch to January 1st, by year
+_year_days = {y: datetime.date(y, 1, 1).toordinal() - _EPOCH_ORDINAL
+              for y in range(1900, 2101)}
+
 
 def _is_leap(y: int) -> bool:
     """True if y is a leap year."""
@@ -66,6 +104,45 @@ def _mdy2dy(month: int, day: int, year: int) -> int:
     return _ldoy(year, month) + day
 
 
+def _btime2ns(year: int, doy: int, hour: int, minute: int, second: int, micros: int) -> int:
+    """Nanoseconds since the epoch of a SEED BTIME."""
+    if not (0 < year < 10000 and 0 < doy <= 365 + _is_leap(year) and
+            hour < 24 and minute < 60 and second < 60):
+        raise ValueError("%04d,%03d,%02d:%02d:%02d out of range" % (year, doy, hour, minute, second))
+
+    try:
+        days = _year_days[year]
+
+    except KeyError:
+        days = datetime.date(year, 1, 1).toordinal() - _EPOCH_ORDINAL
+
+    return (days + doy - 1) * _NS_PER_DAY + \
+        ((hour * 60 + minute) * 60 + second) * 10**9 + micros * 1000
+
+
+def ns2datetime(ns: int) -> datetime.datetime:
+    """Naive UTC datetime of nanoseconds since the epoch, to the nearest microsecond."""
+    return _EPOCH + datetime.timedelta(microseconds=(ns + 500) // 1000)
+
+
+def _datetime2ns(dt: datetime.datetime) -> int:
+    """Nanoseconds since the epoch of a naive UTC datetime."""
+    return (dt - _EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+def _skip(fd, n: int):
+    """Move the file position n bytes forward, reading if fd is a pipe."""
+    try:
+        if fd.seekable():
+            fd.seek(n, 1)
+            return
+
+    except AttributeError:
+        pass
+
+    fd.read(n)
+
+
 class EndOfData(Exception):
     """."""
 
@@ -85,20 +162,44 @@ class MSeedNoData(MSeedError):
 
 
 class Record(object):
-    """Mini-SEED record."""
+    """Mini-SEED record.
+
+    Begin and end times are kept as integer nanoseconds since the epoch in
+    begin_ns and end_ns; begin_time and end_time give them as datetime.
+    """
+
+    __slots__ = ('rectype', 'nsamp', 'sr_factor', 'sr_mult', 'aflgs', 'cflgs',
+                 'qflgs', 'time_correction', 'header', 'data', 'encoding',
+                 'byteorder', 'time_quality', 'recno', 'net', 'sta', 'loc',
+                 'cha', 'samprate_num', 'samprate_denom', 'fsamp', 'leap',
+                 'begin_ns', 'end_ns', 'size', '__order', '__num_blk', '__pdata',
+                 '__pblk', '__rec_len_exp_idx', '__micros_idx',
+                 '__nframes_idx', '__raw', '__X0', '__Xn', '__X_minus1',
+                 '__first_frame', '__nframes', '__merge_buf')
+
+    def __init__(self, src, offset=0, headers_only=False):
+        """Create a Mini-SEED record from a file handle, bytes or a buffer.
+
+        If src is a buffer (bytes, bytearray, memoryview or mmap), the
+        record is parsed at offset without copying; header and data are
+        then memoryview slices of src.
+
+        If headers_only is set and src is a file handle, the data section
+        is skipped and data is None. X0, Xn, X_minus1 and (without
+        blockette 1001) nframes are then not available.
+        """
+        if isinstance(src, _BUFFER_TYPES):
+            fd = None
+            buf = memoryview(src)[offset:offset + _MAX_RECLEN]
+            fixhead = buf[:_FIXHEAD_LEN]
 
-    def __init__(self, src):
-        """Create a Mini-SEED record from a file handle or a bitstream."""
-        if type(src) == bytes:
-            fd = BytesIO(src)
         elif hasattr(src, "read"):
             fd = src
-        else:
-            raise TypeError("argument is neither bytes nor a file object")
+            buf = None
+            fixhead = fd.read(_FIXHEAD_LEN)
 
-        # self.header = ""
-        self.header = bytes()
-        fixhead = fd.read(_FIXHEAD_LEN)
+        else:
+            raise TypeError("argument is neither a buffer nor a file object")
 
         if len(fixhead) == 0:
             # FIXME Check if there is no better option, but NOT StopIteration!
@@ -107,11 +208,43 @@ class Record(object):
         if len(fixhead) < _FIXHEAD_LEN:
             raise MSeedError("unexpected end of header")
 
+        head = fixhead if fd is not None else buf
+
+        while True:
+            try:
+                frame = msframe.parse(head)
+                break
+
+            except msframe.NonDataRecord as e:
+                if fd is not None:
+                    fd.read(_DEFAULT_RECLEN - _FIXHEAD_LEN)
+
+                raise MSeedNoData(str(e))
+
+            except msframe.Truncated as e:
+                if fd is None:
+                    raise MSeedError("unexpected end of data")
+
+                more = fd.read(e.needed - len(head))
+                if len(head) + len(more) < e.needed:
+                    raise MSeedError("unexpected end of data")
+
+                head += more
+
+            except msframe.FrameError as e:
+                raise MSeedError(str(e))
+
+        if frame.pdata == 0:
+            raise MSeedError("invalid pointers")
+
+        self.__order = frame.order
+        self.__pdata = frame.pdata
+
         (recno_str, self.rectype, sta, loc, cha, net, bt_year, bt_doy, bt_hour,
             bt_minute, bt_second, bt_tms, self.nsamp, self.sr_factor,
             self.sr_mult, self.aflgs, self.cflgs, self.qflgs, self.__num_blk,
             self.time_correction, self.__pdata, self.__pblk) = \
-            struct.unpack(">6scx5s2s3s2s2H3Bx2H2h4Bl2H", fixhead)
+            _FIXHEAD_IN[frame.order].unpack_from(head)
 
         if sys.version_info[0] > 2:
             recno_str = recno_str.decode('utf-8')
@@ -121,28 +254,11 @@ class Record(object):
             cha = cha.decode('utf-8')
             net = net.decode('utf-8')
 
-        self.header += fixhead
-
-        if ((self.rectype != 'D') and (self.rectype != 'R') and
-                (self.rectype != 'Q') and (self.rectype != 'M')):
-            fd.read(_MAX_RECLEN - _FIXHEAD_LEN)
-            raise MSeedNoData("non-data record")
+        if fd is not None:
+            self.header = head
 
-        if ((self.__pdata < _FIXHEAD_LEN) or (self.__pdata >= _MAX_RECLEN) or
-                ((self.__pblk != 0) and ((self.__pblk < _FIXHEAD_LEN) or
-                 (self.__pblk >= self.__pdata)))):
-            raise MSeedError("invalid pointers")
-
-        if self.__pblk == 0:
-            blklen = 0
         else:
-            blklen = self.__pdata - self.__pblk
-            gaplen = self.__pblk - _FIXHEAD_LEN
-            gap = fd.read(gaplen)
-            if len(gap) < gaplen:
-                raise MSeedError("unexpected end of data")
-
-            self.header += gap
+            self.header = buf[:self.__pdata]
 
         # defaults
         self.encoding = 11
@@ -155,68 +271,18 @@ class Record(object):
         self.__micros_idx = None
         self.__nframes_idx = None
 
-        pos = 0
-        while pos < blklen:
-            blkhead = fd.read(_BLKHEAD_LEN)
-            if len(blkhead) < _BLKHEAD_LEN:
-                raise MSeedError("unexpected end of blockettes at %s" %
-                                 pos + len(blkhead))
-
-            (blktype, nextblk) = struct.unpack(">2H", blkhead)
-            self.header += blkhead
-            pos += _BLKHEAD_LEN
-
-            if blktype == 1000:
-                blk1000 = fd.read(_BLK1000_LEN)
-                if len(blk1000) < _BLK1000_LEN:
-                    raise MSeedError("unexpected end of blockettes at %s" %
-                                     pos + len(blk1000))
-
-                (self.encoding, self.byteorder, rec_len_exp) = \
-                    struct.unpack(">3Bx", blk1000)
-
-                self.__rec_len_exp_idx = self.__pblk + pos + 2
-                self.header += blk1000
-                pos += _BLK1000_LEN
-
-            elif blktype == 1001:
-                blk1001 = fd.read(_BLK1001_LEN)
-                if len(blk1001) < _BLK1001_LEN:
-                    raise MSeedError("unexpected end of blockettes at %s" %
-                                     pos + len(blk1001))
-
-                (self.time_quality, micros, self.nframes) = \
-                    struct.unpack(">BbxB", blk1001)
-
-                self.__micros_idx = self.__pblk + pos + 1
-                self.__nframes_idx = self.__pblk + pos + 3
-                self.header += blk1001
-                pos += _BLK1001_LEN
-
-            if nextblk == 0:
-                break
-
-            if nextblk < self.__pblk + pos or nextblk >= self.__pdata:
-                raise MSeedError("invalid pointers")
-
-            gaplen = nextblk - (self.__pblk + pos)
-            gap = fd.read(gaplen)
-            if len(gap) < gaplen:
-                raise MSeedError("unexpected end of data")
-
-            self.header += gap
-            pos += gaplen
+        if frame.blk1000 is not None:
+            (self.encoding, self.byteorder, rec_len_exp) = \
+                struct.unpack_from(">3Bx", self.header, frame.blk1000)
 
-        if pos > blklen:
-            raise MSeedError("corrupt record")
+            self.__rec_len_exp_idx = frame.blk1000 + 2
 
-        gaplen = self.__pdata - len(self.header)
-        gap = fd.read(gaplen)
-        if len(gap) < gaplen:
-            raise MSeedError("unexpected end of data")
+        if frame.blk1001 is not None:
+            (self.time_quality, micros, self.nframes) = \
+                struct.unpack_from(">BbxB", self.header, frame.blk1001)
 
-        self.header += gap
-        pos += gaplen
+            self.__micros_idx = frame.blk1001 + 1
+            self.__nframes_idx = frame.blk1001 + 3
 
         self.recno = int(recno_str)
         self.net = net.strip()
@@ -250,39 +316,61 @@ class Record(object):
             self.leap = 0
 
         try:
-            (month, day) = _dy2mdy(bt_doy, bt_year)
-            self.begin_time = datetime.datetime(bt_year, month, day, bt_hour,
-                                                bt_minute, bt_second)
-
-            self.begin_time += \
-                datetime.timedelta(microseconds=bt_tms*100+micros)
-
-            if (self.nsamp != 0) and (self.fsamp != 0):
-                msAux = 1000000 * self.nsamp / self.fsamp
-                self.end_time = self.begin_time + \
-                    datetime.timedelta(microseconds=msAux)
-            else:
-                self.end_time = self.begin_time
+            self.begin_ns = _btime2ns(bt_year, bt_doy, bt_hour, bt_minute,
+                                      bt_second, bt_tms*100+micros)
 
         except ValueError as e:
             raise MSeedError("invalid time: %s" % str(e))
 
+        if (self.nsamp != 0) and (self.samprate_num != 0):
+            self.end_ns = self.begin_ns + self.nsamp * self.samprate_denom * \
+                10**9 // self.samprate_num
+        else:
+            self.end_ns = self.begin_ns
+
         self.size = 1 << rec_len_exp
         if (self.size < len(self.header)) or (self.size > _MAX_RECLEN):
             raise MSeedError("invalid record size")
 
         datalen = self.size - self.__pdata
-        self.data = fd.read(datalen)
-        if len(self.data) < datalen:
-            raise MSeedError("unexpected end of data")
 
-        if len(self.header) + len(self.data) != self.size:
-            raise MSeedError("internal error")
+        if fd is None:
+            self.data = buf[self.__pdata:self.size]
+            self.__raw = buf[:self.size]
+
+        elif headers_only:
+            _skip(fd, datalen)
+            self.data = None
+            self.__raw = None
+
+        else:
+            self.data = fd.read(datalen)
+            self.__raw = None
+
+        if self.data is not None:
+            if len(self.data) < datalen:
+                raise MSeedError("unexpected end of data")
+
+            if len(self.header) + len(self.data) != self.size:
+                raise MSeedError("internal error")
+
+        # the fields below are decoded from the data section on demand
+        self.__X0 = None
+        self.__Xn = None
+        self.__X_minus1 = None
+        self.__first_frame = False
+        self.__merge_buf = None
+
+    def __decode_first_frame(self):
+        """Decode X0, Xn and X-1 from the first frame of the data section."""
+        data = self.data
+        if data is None:
+            raise MSeedError("data section was not read")
 
-        (self.X0, self.Xn) = struct.unpack(">ll", self.data[4:12])
+        (X0, Xn) = struct.unpack_from(">ll", data, 4)
 
-        (w0,) = struct.unpack(">L", self.data[:4])
-        (w3,) = struct.unpack(">L", self.data[12:16])
+        (w0,) = struct.unpack(">L", data[:4])
+        (w3,) = struct.unpack(">L", data[12:16])
         c3 = (w0 >> 24) & 0x3
         d0 = None
 
@@ -338,108 +426,713 @@ class Record(object):
                         d0 -= 0x10
 
         if d0 is not None:
-            self.X_minus1 = self.X0 - d0
+            X_minus1 = X0 - d0
         else:
-            self.X_minus1 = None
+            X_minus1 = None
+
+        if self.__X0 is None:
+            self.__X0 = X0
+
+        if self.__Xn is None:
+            self.__Xn = Xn
+
+        self.__X_minus1 = X_minus1
+        self.__first_frame = True
+
+    @property
+    def X0(self):
+        """The first sample of the record."""
+        if self.__X0 is None:
+            self.__decode_first_frame()
+
+        return self.__X0
+
+    @X0.setter
+    def X0(self, value):
+        self.__X0 = value
+
+    @property
+    def Xn(self):
+        """The last sample of the record."""
+        if self.__Xn is None:
+            self.__decode_first_frame()
+
+        return self.__Xn
+
+    @Xn.setter
+    def Xn(self, value):
+        self.__Xn = value
+
+    @property
+    def X_minus1(self):
+        """The last sample of the previous record, if it can be derived."""
+        if not self.__first_frame:
+            self.__decode_first_frame()
+
+        return self.__X_minus1
+
+    @property
+    def nframes(self):
+        """The number of used data frames."""
+        if not self.__nframes:
+            data = self.data
+            if data is None:
+                raise MSeedError("data section was not read")
 
-        if (self.nframes is None) or (self.nframes == 0):
             i = 0
-            self.nframes = 0
-            while i < len(self.data):
-                if self.data[i] == "\0":
+            self.__nframes = 0
+            while i < len(data):
+                if data[i] == 0:
                     break
 
                 i += 64
-                self.nframes += 1
+                self.__nframes += 1
+
+        return self.__nframes
 
-    def merge(self, rec):
+    @nframes.setter
+    def nframes(self, value):
+        self.__nframes = value
+
+    @property
+    def begin_time(self):
+        """The time of the first sample."""
+        return ns2datetime(self.begin_ns)
+
+    @begin_time.setter
+    def begin_time(self, value):
+        self.begin_ns = _datetime2ns(value)
+
+    @property
+    def end_time(self):
+        """The time after the last sample."""
+        return ns2datetime(self.end_ns)
+
+    @end_time.setter
+    def end_time(self, value):
+        self.end_ns = _datetime2ns(value)
+
+    @property
+    def raw(self):
+        """The record as it was read, without copying if possible."""
+        if self.data is None:
+            raise MSeedError("data section was not read")
+
+        if self.__raw is None:
+            return bytes(self.header) + self.data
+
+        return self.__raw
+
+    def samples(self):
+        """Decode the samples of the record.
+
+        Returns a NumPy array if NumPy is available and an array.array
+        otherwise.
+        """
+        if self.data is None:
+            raise MSeedError("data section was not read")
+
+        if self.encoding in (steim.STEIM1, steim.STEIM2):
+            nframes = self.nframes
+        else:
+            nframes = None
+
+        try:
+            return steim.decode(self.data, self.encoding, self.nsamp, nframes, self.byteorder != 0)
+
+        except steim.SteimError as e:
+            raise MSeedError("%s.%s.%s.%s %s: %s" % (self.net, self.sta, self.loc, self.cha,
+                                                     self.begin_time.isoformat(), str(e)))
+
+    def _can_repack(self):
+        """True if the record can be re-encoded by repack."""
+        return self.encoding in (steim.STEIM1, steim.STEIM2) and self.byteorder == 1 and \
+            self.__rec_len_exp_idx is not None and self.samprate_num > 0 and \
+            self.data is not None
+
+    def _repacked(self, data, nsamp, begin_ns, encoding):
+        """Copy of the record with a new Steim-encoded data section."""
+        rec = copy.copy(self)
+        rec.data = data
+        rec.encoding = encoding
+        rec.nsamp = nsamp
+        rec.begin_ns = begin_ns
+        rec.end_ns = begin_ns + nsamp * self.samprate_denom * 10**9 // self.samprate_num
+        rec.size = len(self.header) + len(data)
+        rec.nframes = len(data) // steim.FRAME_LEN
+        rec.__raw = None
+        rec.__X0 = None
+        rec.__Xn = None
+        rec.__first_frame = False
+        rec.__merge_buf = None
+
+        if begin_ns != self.begin_ns:
+            rec.leap = 0
+
+        return rec
+
+    def merge(self, rec, rec_len_exp):
         """Caller is expected to check for contiguity of data.
 
-        Check if rec.nframes * 64 <= len(data)?
+        On the first merge, the data section is copied to a buffer sized
+        for a record of 2**rec_len_exp bytes; the frames of rec and of
+        the following records are written to it at the end of the data
+        merged so far, so that each frame is copied once.
         """
-        (self.Xn,) = struct.unpack(">l", rec.data[8:12])
-        self.data += rec.data[:rec.nframes * 64]
+        nbytes = rec.nframes * 64
+        datalen = len(self.data)
+        end = datalen + nbytes
+        buf = self.__merge_buf
+
+        if buf is None:
+            buf = self.__merge_buf = memoryview(bytearray((1 << rec_len_exp) - len(self.header)))
+            buf[:datalen] = self.data
+
+        if end > len(buf):
+            raise MSeedError("merged record is larger than requested write size: %d > %d" %
+                             (len(self.header) + end, len(self.header) + len(buf)))
+
+        src = rec.data
+        buf[datalen:end] = src[:nbytes]
+        buf[8:12] = src[8:12]
+        self.Xn = rec.Xn
+        self.data = buf[:end]
+        self.__raw = None
         self.nframes += rec.nframes
         self.nsamp += rec.nsamp
-        self.size = len(self.header) + len(self.data)
-        self.end_time = rec.end_time
+        self.size = len(self.header) + end
+        self.end_ns = rec.end_ns
 
     def write(self, fd, rec_len_exp):
         """Write the record to an already opened file."""
-        if self.size > (1 << rec_len_exp):
-            raise MSeedError("record is larger than requested write size: %d > %d" % (self.size, 1 << rec_len_exp))
-
-        recno_str = bytes(("%06d" % (self.recno,)).encode('utf-8'))
-        sta = bytes(("%-5.5s" % (self.sta,)).encode('utf-8'))
-        loc = bytes(("%-2.2s" % (self.loc,)).encode('utf-8'))
-        cha = bytes(("%-3.3s" % (self.cha,)).encode('utf-8'))
-        net = bytes(("%-2.2s" % (self.net,)).encode('utf-8'))
-        bt_year = self.begin_time.year
-        bt_doy = _mdy2dy(self.begin_time.month, self.begin_time.day,
-                         self.begin_time.year)
-        bt_hour = self.begin_time.hour
-        bt_minute = self.begin_time.minute
-        bt_second = self.begin_time.second + self.leap
-        bt_tms = self.begin_time.microsecond // 100
-        micros = self.begin_time.microsecond % 100
-
-        # This is just to make it Python 2 AND 3 compatible (str vs. bytes)
-        rectype = self.rectype.encode('utf-8') if sys.version_info[0] > 2 \
-            else self.rectype
-
-        buf = struct.pack(">6s2c5s2s3s2s2H3Bx2H2h4Bl2H", recno_str,
-                          rectype, b' ', sta, loc, cha, net, bt_year,
-                          bt_doy, bt_hour, bt_minute, bt_second, bt_tms,
-                          self.nsamp, self.sr_factor, self.sr_mult, self.aflgs,
-                          self.cflgs, self.qflgs, self.__num_blk,
-                          self.time_correction, self.__pdata, self.__pblk)
-        fd.write(buf)
-
-        buf = list(self.header[_FIXHEAD_LEN:])
+        reclen = 1 << rec_len_exp
+        if self.size > reclen:
+            raise MSeedError("record is larger than requested write size: %d > %d" % (self.size, reclen))
+
+        begin_time = self.begin_time
+        bt_doy = _mdy2dy(begin_time.month, begin_time.day, begin_time.year)
+        micros = begin_time.microsecond % 100
+
+        buf = getattr(_write_buf, 'buf', None)
+        if buf is None or len(buf) < reclen:
+            buf = _write_buf.buf = memoryview(bytearray(max(reclen, _DEFAULT_RECLEN)))
+
+        _FIXHEAD[self.__order].pack_into(buf, 0, b"%06d" % (self.recno,),
+                           self.rectype.encode('utf-8'), b' ',
+                           ("%-5.5s%-2.2s%-3.3s%-2.2s" % (self.sta, self.loc, self.cha,
+                                                          self.net)).encode('utf-8'),
+                           begin_time.year, bt_doy, begin_time.hour, begin_time.minute,
+                           begin_time.second + self.leap, begin_time.microsecond // 100,
+                           self.nsamp, self.sr_factor, self.sr_mult, self.aflgs,
+                           self.cflgs, self.qflgs, self.__num_blk,
+                           self.time_correction, self.__pdata, self.__pblk)
+
+        pdata = self.__pdata
+        buf[_FIXHEAD_LEN:pdata] = self.header[_FIXHEAD_LEN:]
 
         if self.__rec_len_exp_idx is not None:
-            buf[self.__rec_len_exp_idx - _FIXHEAD_LEN] = \
-                struct.pack(">B", rec_len_exp)
+            buf[self.__rec_len_exp_idx] = rec_len_exp
+            buf[self.__rec_len_exp_idx - 2] = self.encoding
 
         if self.__micros_idx is not None:
-            buf[self.__micros_idx - _FIXHEAD_LEN] = struct.pack(">b", micros)
+            buf[self.__micros_idx] = micros
 
         if self.__nframes_idx is not None:
-            buf[self.__nframes_idx - _FIXHEAD_LEN] = \
-                struct.pack(">B", self.nframes)
-
-        ba = bytearray()
-        for b in buf:
-            try:
-                ba.append(b)
-            except Exception:
-                ba.append(int.from_bytes(b, byteorder='big'))
-        fd.write(ba)
+            buf[self.__nframes_idx] = self.nframes
 
-        buf = self.data[:4] + struct.pack(">ll", self.X0, self.Xn) + \
-            self.data[12:] + ((1 << rec_len_exp) - self.size) * b'\0'
+        buf[pdata:pdata + 4] = self.data[:4]
+        _X0_XN.pack_into(buf, pdata + 4, self.X0, self.Xn)
+        buf[pdata + 12:self.size] = self.data[12:]
+        buf[self.size:reclen] = _ZEROS[:reclen - self.size]
 
-        fd.write(buf)
+        fd.write(buf[:reclen])
 
 
 class Input(object):
     """Iterate over the available Mini-SEED records."""
 
-    def __init__(self, fd):
-        """Create the iterable from the file handle passed as parameter."""
-        self.__fd = fd
+    def __init__(self, src, headers_only=False):
+        """Create the iterable from a file handle, a buffer or a path.
+
+        A path is memory-mapped and the records are memoryview slices of
+        the mapping, so no data is copied while scanning. With
+        headers_only, the data section of records read from a file handle
+        is skipped (see Record).
+        """
+        self.__src = src
+        self.__headers_only = headers_only
 
     def __iter__(self) -> Iterable[Record]:
         """Define the iterator."""
+        if isinstance(self.__src, (str, os.PathLike)):
+            with open(self.__src, 'rb') as fd:
+                if os.fstat(fd.fileno()).st_size == 0:
+                    return
+
+                buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                for rec in self.__iter_buffer(buf):
+                    yield rec
+
+            finally:
+                try:
+                    buf.close()
+
+                except BufferError:
+                    # records still referenced by the caller keep the
+                    # mapping alive; it is released with the last of them
+                    pass
+
+        elif isinstance(self.__src, _BUFFER_TYPES):
+            for rec in self.__iter_buffer(self.__src):
+                yield rec
+
+        else:
+            while True:
+                try:
+                    yield Record(self.__src, headers_only=self.__headers_only)
+
+                except EndOfData:
+                    # This change follows new PEP-479, where it is explicitly forbidden to use StopIteration
+                    # raise StopIteration
+                    return
+
+                except MSeedNoData:
+                    pass
+
+    @staticmethod
+    def __iter_buffer(buf):
+        offset = 0
         while True:
             try:
-                yield Record(self.__fd)
+                rec = Record(buf, offset)
 
             except EndOfData:
-                # This change follows new PEP-479, where it is explicitly forbidden to use StopIteration
-                # raise StopIteration
                 return
 
             except MSeedNoData:
+                offset += _DEFAULT_RECLEN
+                continue
+
+            offset += rec.size
+            yield rec
+
+
+class Header(namedtuple('Header', ['net', 'sta', 'loc', 'cha', 'rectype', 'fsamp', 'nsamp',
+                                   'begin_ns', 'end_ns', 'size'])):
+    """Header fields of a Mini-SEED record, as returned by read_headers."""
+    __slots__ = ()
+
+    @property
+    def begin_time(self):
+        """The time of the first sample."""
+        return ns2datetime(self.begin_ns)
+
+    @property
+    def end_time(self):
+        """The time after the last sample."""
+        return ns2datetime(self.end_ns)
+
+
+def _header(rec: Record) -> Header:
+    return Header(rec.net, rec.sta, rec.loc, rec.cha, rec.rectype, rec.fsamp, rec.nsamp,
+                  rec.begin_ns, rec.end_ns, rec.size)
+
+
+def _read_headers_numpy(buf) -> List[Header]:
+    """Decode the headers of a file with a single record length at once.
+
+    Returns None if the records are not uniform enough to be decoded this
+    way; the caller then uses the scalar parser.
+    """
+    try:
+        first = Record(buf, headers_only=True)
+
+    except MSeedError:
+        return None
+
+    reclen = first.size
+    nrec = len(buf) // reclen
+    if nrec * reclen != len(buf):
+        return None
+
+    raw = numpy.frombuffer(buf, dtype=numpy.uint8, count=nrec * reclen).reshape(nrec, reclen)
+
+    # walk the blockette chain of the first record; all records must have
+    # the same chain, so blockettes 1000 and 1001 are at the same offsets
+    frame = msframe.parse(buf[:reclen])
+    if frame.order != '>':
+        return None
+
+    (pblk,) = struct.unpack_from(">H", buf, 46)
+    chain = []
+    blk1000 = frame.blk1000
+    blk1001 = frame.blk1001
+    pos = pblk
+    while pos != 0:
+        (blktype, nextblk) = struct.unpack_from(">2H", buf, pos)
+        chain.append(pos)
+        pos = nextblk
+
+    if blk1000 is None:
+        return None
+
+    for pos in [44] + chain:
+        # pdata/pblk and the (type, next) of every blockette
+        if (raw[:, pos:pos + 4] != raw[0, pos:pos + 4]).any():
+            return None
+
+    if (raw[:, blk1000 + 2] != raw[0, blk1000 + 2]).any():
+        return None
+
+    fixed = numpy.dtype({'names': ['rectype', 'year', 'doy', 'hour', 'minute', 'second', 'tms',
+                                   'nsamp', 'sr_factor', 'sr_mult'],
+                         'formats': ['S1', '>u2', '>u2', 'u1', 'u1', 'u1', '>u2', '>u2', '>i2', '>i2'],
+                         'offsets': [6, 20, 22, 24, 25, 26, 28, 30, 32, 34],
+                         'itemsize': reclen})
+
+    hdr = numpy.frombuffer(buf, dtype=fixed, count=nrec)
+
+    if not numpy.isin(hdr['rectype'], [b'D', b'R', b'Q', b'M']).all():
+        return None
+
+    year = hdr['year'].astype(numpy.int64)
+    doy = hdr['doy'].astype(numpy.int64)
+    hour = hdr['hour'].astype(numpy.int64)
+    minute = hdr['minute'].astype(numpy.int64)
+    second = numpy.minimum(hdr['second'], 59).astype(numpy.int64)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+    if ((year < 1) | (year > 9999) | (doy < 1) | (doy > 365 + leap) | (hour > 23) |
+            (minute > 59)).any():
+        return None
+
+    micros = hdr['tms'].astype(numpy.int64) * 100
+    if blk1001 is not None:
+        micros += raw[:, blk1001 + 1].view(numpy.int8)
+
+    days = (year - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(numpy.int64)
+    begin_ns = (days + doy - 1) * _NS_PER_DAY + \
+        ((hour * 60 + minute) * 60 + second) * 10**9 + micros * 1000
+
+    # same rules as in Record
+    factor = hdr['sr_factor'].astype(numpy.int64)
+    mult = hdr['sr_mult'].astype(numpy.int64)
+    num = numpy.select([(factor > 0) & (mult > 0), (factor > 0) & (mult < 0),
+                        (factor < 0) & (mult > 0), (factor < 0) & (mult < 0)],
+                       [factor * mult, factor, mult, 1], 0)
+    denom = numpy.select([(factor > 0) & (mult > 0), (factor > 0) & (mult < 0),
+                          (factor < 0) & (mult > 0), (factor < 0) & (mult < 0)],
+                         [1, -mult, -factor, factor * mult], 1)
+
+    nsamp = hdr['nsamp'].astype(numpy.int64)
+    if (nsamp * denom > (2**63 - 1) // 10**9).any():
+        return None
+
+    valid = (nsamp != 0) & (num != 0)
+    end_ns = begin_ns + numpy.where(valid, nsamp * denom * 10**9 // numpy.where(valid, num, 1), 0)
+    fsamp = num / denom
+
+    # NSLC and record type rarely change within a file, so only the
+    # distinct values are decoded
+    (keys, inverse) = numpy.unique(numpy.ascontiguousarray(raw[:, 6:20]).view('V14').ravel(),
+                                   return_inverse=True)
+    ids = []
+    for key in keys.tolist():
+        (rt, sta, loc, cha, net) = struct.unpack(">cx5s2s3s2s", key)
+        ids.append((net.decode('utf-8').strip(), sta.decode('utf-8').strip(),
+                    loc.decode('utf-8').strip(), cha.decode('utf-8').strip(), rt.decode('utf-8')))
+
+    return [Header(*(ids[i] + h)) for (i, h) in zip(inverse.ravel().tolist(),
+                                                    zip(fsamp.tolist(), nsamp.tolist(),
+                                                        begin_ns.tolist(), end_ns.tolist(),
+                                                        [reclen] * nrec))]
+
+
+class FileSummary(namedtuple('FileSummary', ['path', 'streams'])):
+    """Data records of a file, as returned by scan_files.
+
+    streams maps (net, sta, loc, cha, rectype, fsamp) to a sorted list of
+    (begin_ns, end_ns) segments; records that are less than one sample
+    period apart belong to the same segment.
+    """
+    __slots__ = ()
+
+
+def summarize(path) -> FileSummary:
+    """Summarize the data records of a file."""
+    spans = {}
+
+    for h in read_headers(path):
+        spans.setdefault((h.net, h.sta, h.loc, h.cha, h.rectype, h.fsamp), []).append(
+            (h.begin_ns, h.end_ns))
+
+    streams = {}
+
+    for (key, s) in spans.items():
+        tol = int(10**9 / key[5]) if key[5] > 0 else 0
+        segments = []
+
+        for (begin, end) in sorted(s):
+            if segments and begin <= segments[-1][1] + tol:
+                if end > segments[-1][1]:
+                    segments[-1] = (segments[-1][0], end)
+
+            else:
+                segments.append((begin, end))
+
+        streams[key] = segments
+
+    return FileSummary(path, streams)
+
+
+def _summarize_chunk(paths):
+    return [summarize(path) for path in paths]
+
+
+def scan_files(paths, jobs=1, chunksize=8) -> List[FileSummary]:
+    """Summarize the data records of many files.
+
+    With jobs > 1, the headers are decoded in a pool of jobs processes,
+    chunksize files at a time, and only the summaries are sent back. The
+    summaries are returned in the order of paths; an error reading any of
+    the files is raised in the caller.
+    """
+    paths = list(paths)
+
+    if jobs <= 1 or len(paths) <= 1:
+        return _summarize_chunk(paths)
+
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+
+    with ProcessPoolExecutor(min(jobs, len(chunks))) as executor:
+        return [summary for result in executor.map(_summarize_chunk, chunks) for summary in result]
+
+
+class Trace(namedtuple('Trace', ['net', 'sta', 'loc', 'cha', 'fsamp', 'begin_ns', 'end_ns',
+                                 'samples'])):
+    """Samples of contiguous records of a channel, as returned by traces."""
+    __slots__ = ()
+
+    @property
+    def begin_time(self):
+        """The time of the first sample."""
+        return ns2datetime(self.begin_ns)
+
+    @property
+    def end_time(self):
+        """The time after the last sample."""
+        return ns2datetime(self.end_ns)
+
+
+def traces(records: Iterable[Record]) -> Iterable[Trace]:
+    """Concatenate the samples of contiguous records of each channel.
+
+    Records are contiguous if they have the same sample rate and the next
+    one starts within half a sample period of the end of the previous
+    one. A Trace is yielded as soon as the records of its channel are
+    interrupted by a gap, an overlap or a change of sample rate, and the
+    remaining ones at the end.
+    """
+    current = {}
+
+    for rec in records:
+        nslc = (rec.net, rec.sta, rec.loc, rec.cha)
+        samples = rec.samples()
+        cur = current.get(nslc)
+
+        if cur is not None and cur[0] == rec.fsamp and rec.fsamp > 0 and \
+                abs(rec.begin_ns - cur[2]) * rec.fsamp <= 500000000:
+            cur[2] = rec.end_ns
+            cur[3].append(samples)
+            continue
+
+        if cur is not None:
+            yield Trace(*(nslc + (cur[0], cur[1], cur[2], steim.concatenate(cur[3]))))
+
+        current[nslc] = [rec.fsamp, rec.begin_ns, rec.end_ns, [samples]]
+
+    for (nslc, cur) in sorted(current.items()):
+        yield Trace(*(nslc + (cur[0], cur[1], cur[2], steim.concatenate(cur[3]))))
+
+
+def _repack_run(run, rec_len_exp, encoding):
+    if not run:
+        return
+
+    first = run[0]
+    samples = steim.concatenate([rec.samples() for rec in run])
+    encoding = encoding or first.encoding
+    nframes = ((1 << rec_len_exp) - len(first.header)) // steim.FRAME_LEN
+    limit = nframes * 15 * (7 if encoding == steim.STEIM2 else 4)
+    prev = first.X_minus1
+    pos = 0
+
+    while pos < len(samples):
+        try:
+            (data, count) = steim.encode(samples[pos:pos + limit], encoding, nframes, prev)
+
+        except steim.SteimError as e:
+            raise MSeedError("%s.%s.%s.%s %s: %s" % (first.net, first.sta, first.loc, first.cha,
+                                                     first.begin_time.isoformat(), str(e)))
+
+        begin_ns = first.begin_ns + pos * first.samprate_denom * 10**9 // first.samprate_num
+        yield first._repacked(data, count, begin_ns, encoding)
+        pos += count
+        prev = samples[pos - 1]
+
+
+def repack(records: Iterable[Record], rec_len_exp: int, encoding: int = None) -> Iterable[Record]:
+    """Re-encode runs of contiguous Steim records into full records.
+
+    records must be sorted by channel and time. The samples of each run of
+    contiguous, big-endian Steim records with blockette 1000 are encoded
+    with encoding (by default the encoding of the first record of the
+    run) into records of 2**rec_len_exp bytes, all but the last of which
+    are full. Other records are passed through. The re-encoded records
+    are meant to be written with write(fd, rec_len_exp), the records
+    passed through unchanged (raw).
+    """
+    run = []
+
+    for rec in records:
+        if run and rec._can_repack():
+            prev = run[-1]
+
+            # same tolerance as used by fseed
+            if (prev.net, prev.sta, prev.loc, prev.cha) == (rec.net, rec.sta, rec.loc, rec.cha) and \
+                    prev.fsamp == rec.fsamp and abs(rec.begin_ns - prev.end_ns) * rec.fsamp <= 100000000:
+                run.append(rec)
+                continue
+
+        for r in _repack_run(run, rec_len_exp, encoding):
+            yield r
+
+        if rec._can_repack():
+            run = [rec]
+
+        else:
+            run = []
+            yield rec
+
+    for r in _repack_run(run, rec_len_exp, encoding):
+        yield r
+
+
+def _sort_key(rec: Record):
+    return (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_ns)
+
+
+def _spill(run: List[Record]):
+    """Write a sorted run of records to a temporary file."""
+    fd = tempfile.TemporaryFile()
+
+    try:
+        for rec in run:
+            fd.write(rec.raw)
+
+        fd.seek(0)
+        return fd
+
+    except BaseException:
+        fd.close()
+        raise
+
+
+def sort_records(records: Iterable[Record], unique: bool = False,
+                 run_size: int = _SORT_RUN_SIZE) -> Iterable[Record]:
+    """Sort records by channel and begin time.
+
+    The records are sorted in runs of up to run_size bytes. If there is
+    more than one run, the runs are written to temporary files and merged,
+    so that memory use is bounded by run_size. Records with the same
+    channel and begin time keep their input order. If unique is set,
+    exact duplicates of a record are dropped. The data section of the
+    records must have been read.
+    """
+    runs = []
+
+    try:
+        run = []
+        size = 0
+
+        for rec in records:
+            run.append(rec)
+            size += rec.size
+
+            if size >= run_size:
+                run.sort(key=_sort_key)
+                runs.append(_spill(run))
+                run = []
+                size = 0
+
+        run.sort(key=_sort_key)
+
+        if runs:
+            if run:
+                runs.append(_spill(run))
+                run = []
+
+            merged = heapq.merge(*[Input(fd) for fd in runs], key=_sort_key)
+
+        else:
+            merged = iter(run)
+
+        last_key = None
+        seen = set()
+
+        for rec in merged:
+            if unique:
+                key = _sort_key(rec)
+                raw = bytes(rec.raw)
+
+                if key != last_key:
+                    last_key = key
+                    seen = set()
+
+                if raw in seen:
+                    continue
+
+                seen.add(raw)
+
+            yield rec
+
+    finally:
+        for fd in runs:
+            fd.close()
+
+
+def read_headers(src) -> List[Header]:
+    """Read the headers of all data records of a file or buffer.
+
+    If NumPy is available and all records of src have the same length and
+    blockette layout, the headers are decoded for all records at once.
+    Otherwise the records are parsed one by one in header-only mode.
+    """
+    if isinstance(src, (str, os.PathLike)):
+        with open(src, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return []
+
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return read_headers(buf)
+
+        finally:
+            try:
+                buf.close()
+
+            except BufferError:
                 pass
 
+    headers = None
+
+    if numpy is not None and len(src) > 0:
+        headers = _read_headers_numpy(src)
+
+    if headers is None:
+        headers = [_header(rec) for rec in Input(src, headers_only=True)]
+
+    return headers
@@ -0,0 +1,220 @@
+"""Framing of Mini-SEED records.
+
+Finds the byte order, the data section and the length of a record and
+the position of blockettes 1000 and 1001 without decoding the rest of the
+header. Record lengths from 128 bytes to 64 KiB and both byte orders of
+the header are supported. Used by mseedlite for the full header decode
+and by fdsnws_fetch to split the data received into records.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import struct
+from collections import namedtuple
+
+FIXHEAD_LEN = 48
+MIN_RECLEN = 1 << 7
+MAX_RECLEN = 1 << 16
+
+DATA_TYPES = frozenset("DRQM")
+
+_BLKHEAD_LEN = 4
+_BLK1000_LEN = 4
+_BLK1001_LEN = 4
+
+# year and day of the year, data and blockette pointers, blockette type
+# and next blockette pointer, by byte order
+_2H = {'>': struct.Struct(">2H"), '<': struct.Struct("<2H")}
+
+
+class FrameError(Exception):
+    """Record cannot be framed."""
+
+    pass
+
+
+class NonDataRecord(FrameError):
+    """Record is not a data record."""
+
+    pass
+
+
+class Truncated(FrameError):
+    """Not enough bytes; needed is the length required to frame the record."""
+
+    def __init__(self, needed):
+        FrameError.__init__(self, "unexpected end of data")
+        self.needed = needed
+
+
+class Frame(namedtuple('Frame', ['rectype', 'order', 'pdata', 'size', 'blk1000', 'blk1001'])):
+    """Framing of a data record.
+
+    order is the byte order of the header ('>' or '<'), pdata the offset
+    of the data section (0 if there is none) and size the record length
+    given by blockette 1000, or None if there is no blockette 1000.
+    blk1000 and blk1001 are the offsets of the bodies of these blockettes
+    or None.
+    """
+    __slots__ = ()
+
+
+def byte_order(head):
+    """Byte order of the header, judging by the year and day of the year.
+
+    Big-endian is assumed unless only the little-endian values are valid.
+    """
+    for order in '><':
+        (year, doy) = _2H[order].unpack_from(head, 20)
+        if 0 < year < 10000 and 0 < doy <= 366:
+            return order
+
+    return '>'
+
+
+def parse(head):
+    """Frame the record at the start of head.
+
+    head must include the header up to the data section or, if there is
+    none, up to the end of the last blockette. Raises Truncated if it
+    does not, NonDataRecord if the record type is not D, R, Q or M and
+    FrameError if the pointers are corrupt.
+    """
+    if len(head) < FIXHEAD_LEN:
+        raise Truncated(FIXHEAD_LEN)
+
+    rectype = chr(head[6])
+
+    if rectype not in DATA_TYPES:
+        raise NonDataRecord("non-data record")
+
+    order = byte_order(head)
+    (pdata, pblk) = _2H[order].unpack_from(head, 44)
+
+    if pdata != 0 and (pdata < FIXHEAD_LEN or pdata >= MAX_RECLEN):
+        raise FrameError("invalid pointers")
+
+    end = pdata or MAX_RECLEN
+
+    if pblk != 0 and (pblk < FIXHEAD_LEN or pblk >= end):
+        raise FrameError("invalid pointers")
+
+    if len(head) < pdata:
+        raise Truncated(pdata)
+
+    blk1000 = None
+    blk1001 = None
+    size = None
+    pos = pblk
+
+    while pos != 0:
+        if pos + _BLKHEAD_LEN > end:
+            raise FrameError("unexpected end of blockettes at %d" % pos)
+
+        if pos + _BLKHEAD_LEN > len(head):
+            raise Truncated(pos + _BLKHEAD_LEN)
+
+        (blktype, nextblk) = _2H[order].unpack_from(head, pos)
+
+        if blktype in (1000, 1001):
+            blkend = pos + _BLKHEAD_LEN + (_BLK1000_LEN if blktype == 1000 else _BLK1001_LEN)
+
+            if blkend > end:
+                raise FrameError("unexpected end of blockettes at %d" % pos)
+
+            if blkend > len(head):
+                raise Truncated(blkend)
+
+            if blktype == 1000:
+                blk1000 = pos + _BLKHEAD_LEN
+                size = 1 << head[blk1000 + 2]
+
+                if size < MIN_RECLEN or size > MAX_RECLEN or size < pdata:
+                    raise FrameError("invalid record size")
+
+            else:
+                blk1001 = pos + _BLKHEAD_LEN
+
+        if nextblk == 0:
+            break
+
+        if nextblk < pos + _BLKHEAD_LEN or nextblk >= end:
+            raise FrameError("invalid pointers")
+
+        pos = nextblk
+
+    return Frame(rectype, order, pdata, size, blk1000, blk1001)
+
+
+def read(fd):
+    """Read one data record from a file or stream.
+
+    Only the bytes of the record are read. Returns (frame, record) or
+    None at the end of data. Raises FrameError if the record cannot be
+    framed, including records without blockette 1000.
+    """
+    head = fd.read(FIXHEAD_LEN)
+
+    if not head:
+        return None
+
+    while True:
+        try:
+            frame = parse(head)
+            break
+
+        except Truncated as e:
+            if len(head) < FIXHEAD_LEN:
+                raise
+
+            more = fd.read(e.needed - len(head))
+
+            if not more:
+                raise
+
+            head += more
+
+    if frame.size is None:
+        raise FrameError("blockette 1000 not found")
+
+    rest = frame.size - len(head)
+    record = head + fd.read(rest) if rest > 0 else head
+
+    if len(record) != frame.size:
+        raise Truncated(frame.size)
+
+    return (frame, record)
+
+
+def frames(buf, offset=0):
+    """Iterate over the (offset, frame) of the data records in a buffer.
+
+    Stops at the end of the buffer; raises FrameError at a record that
+    cannot be framed, including records without blockette 1000.
+    """
+    buf = memoryview(buf)
+
+    while offset < len(buf):
+        frame = parse(buf[offset:offset + MAX_RECLEN])
+
+        if frame.size is None:
+            raise FrameError("blockette 1000 not found")
+
+        if offset + frame.size > len(buf):
+            raise Truncated(frame.size)
+
+        yield (offset, frame)
+        offset += frame.size
@@ -0,0 +1,228 @@
+"""Sidecar index files for Mini-SEED files.
+
+The index of a file lists the NSLC code, begin and end time (in
+nanoseconds since the epoch), byte offset and length of each record. It is
+stored next to the file, with SUFFIX appended to the file name, together
+with the size and modification time of the file; an index that does not
+match the file anymore is ignored.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from fdsnwsscripts.seiscomp import mseedlite
+
+SUFFIX = ".idx"
+
+_MAGIC = b"MSIDX\0\0\1"
+
+# magic, size and mtime (ns) of the indexed file, number of entries
+_HEAD = struct.Struct("<8sQqI")
+
+# net, sta, loc, cha, begin (ns), end (ns), offset, length
+_ENTRY = struct.Struct("<2s5s2s3sqqQI")
+
+
+class _Channel(object):
+    """Records of one channel, sorted by begin time."""
+
+    def __init__(self, entries):
+        entries.sort()
+        self.begin = [e[0] for e in entries]
+        self.end = [e[1] for e in entries]
+        self.offset = [e[2] for e in entries]
+        self.length = [e[3] for e in entries]
+
+        # running maximum of the end times, for the lower bound of a window
+        self.maxend = []
+        m = None
+        for end in self.end:
+            if m is None or end > m:
+                m = end
+
+            self.maxend.append(m)
+
+    def select(self, start, end):
+        lo = 0 if start is None else bisect.bisect_right(self.maxend, start)
+        hi = len(self.begin) if end is None else bisect.bisect_left(self.begin, end)
+        return [(self.offset[i], self.length[i]) for i in range(lo, hi)
+                if start is None or self.end[i] > start]
+
+
+class Index(object):
+    """Record index of a Mini-SEED file.
+
+    entries is a list of ((net, sta, loc, cha), begin_ns, end_ns, offset,
+    length) tuples in file order.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        channels = {}
+
+        for (nslc, begin, end, offset, length) in entries:
+            channels.setdefault(nslc, []).append((begin, end, offset, length))
+
+        self.__channels = {nslc: _Channel(e) for (nslc, e) in channels.items()}
+
+    def channels(self):
+        """The (net, sta, loc, cha) tuples found in the file, sorted."""
+        return sorted(self.__channels)
+
+    def select(self, nslc, start_ns=None, end_ns=None):
+        """(offset, length) of the records of nslc overlapping a time window.
+
+        The records are sorted by begin time; start_ns or end_ns set to
+        None leaves the window open on that side.
+        """
+        try:
+            return self.__channels[nslc].select(start_ns, end_ns)
+
+        except KeyError:
+            return []
+
+
+def index_path(path):
+    """Path of the index file of path."""
+    return path + SUFFIX
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _scan(buf):
+    """Entries of the data records in a buffer."""
+    entries = []
+    offset = 0
+
+    while True:
+        try:
+            rec = mseedlite.Record(buf, offset, headers_only=True)
+
+        except mseedlite.EndOfData:
+            return entries
+
+        except mseedlite.MSeedNoData:
+            offset += mseedlite._DEFAULT_RECLEN
+            continue
+
+        entries.append(((rec.net, rec.sta, rec.loc, rec.cha), rec.begin_ns, rec.end_ns,
+                        offset, rec.size))
+
+        offset += rec.size
+
+
+def build(path):
+    """Index a Mini-SEED file by reading all of its records."""
+    with open(path, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return Index([])
+
+        buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        return Index(_scan(buf))
+
+    finally:
+        try:
+            buf.close()
+
+        except BufferError:
+            pass
+
+
+def save(path, index, stamp=None):
+    """Write the index file of path.
+
+    stamp is the (size, mtime_ns) of path when it was indexed; by default
+    the current values are used.
+    """
+    if stamp is None:
+        stamp = _stamp(path)
+
+    ipath = index_path(path)
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(ipath) or '.',
+                                 prefix='.' + os.path.basename(ipath) + '.')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEAD.pack(_MAGIC, stamp[0], stamp[1], len(index.entries)))
+
+            for ((net, sta, loc, cha), begin, end, offset, length) in index.entries:
+                f.write(_ENTRY.pack(net.encode('utf-8'), sta.encode('utf-8'),
+                                    loc.encode('utf-8'), cha.encode('utf-8'),
+                                    begin, end, offset, length))
+
+        os.replace(tmp, ipath)
+
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load(path):
+    """Read the index file of path.
+
+    Returns None if there is no index file, or if it is corrupt or does
+    not match the size and modification time of path.
+    """
+    try:
+        with open(index_path(path), 'rb') as fd:
+            data = fd.read()
+
+        stamp = _stamp(path)
+
+    except (IOError, OSError):
+        return None
+
+    if len(data) < _HEAD.size:
+        return None
+
+    (magic, size, mtime, count) = _HEAD.unpack_from(data)
+
+    if magic != _MAGIC or (size, mtime) != stamp or \
+            len(data) != _HEAD.size + count * _ENTRY.size:
+        return None
+
+    entries = []
+
+    for (net, sta, loc, cha, begin, end, offset, length) in \
+            _ENTRY.iter_unpack(memoryview(data)[_HEAD.size:]):
+        entries.append(((net.rstrip(b'\0').decode('utf-8'), sta.rstrip(b'\0').decode('utf-8'),
+                         loc.rstrip(b'\0').decode('utf-8'), cha.rstrip(b'\0').decode('utf-8')),
+                        begin, end, offset, length))
+
+    return Index(entries)
+
+
+def update(path):
+    """Load the index of path, rebuilding it if it is missing or stale."""
+    index = load(path)
+
+    if index is None:
+        stamp = _stamp(path)
+        index = build(path)
+
+        if _stamp(path) == stamp:
+            save(path, index, stamp)
+
+    return index
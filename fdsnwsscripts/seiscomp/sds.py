@@ -0,0 +1,623 @@
+"""Helpers for SDS (SeisComP Data Structure) archives.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import io
+import fnmatch
+import datetime
+import json
+import shutil
+import sqlite3
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fdsnwsscripts.seiscomp import mseedlite, msindex, logs
+from fdsnwsscripts.seiscomp.isotime import parse_time
+
+STATE_FILE = ".fdsnws2sds.sqlite"
+
+_STATE_VERSION = "1"
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# records in a day file may extend into the following day
+_MAX_RECORD_SPAN = datetime.timedelta(days=1)
+
+# size of records produced by merging
+_MERGE_RECLEN_EXP = 12
+
+# uncovered intervals not longer than this are not requested by extract()
+_EXTRACT_MIN_GAP = datetime.timedelta(seconds=1)
+
+
+class DayFile(namedtuple('DayFile', ['net', 'sta', 'loc', 'cha', 'year', 'doy', 'path'])):
+    """Day file of an SDS archive."""
+    __slots__ = ()
+
+    def starttime(self):
+        """Start of the day covered by the file."""
+        return datetime.datetime(self.year, 1, 1) + datetime.timedelta(days=self.doy - 1)
+
+
+def _overlaps(start, length, starttime, endtime):
+    """True if data starting in [start, start + length) may overlap the window."""
+    if endtime is not None and start >= endtime:
+        return False
+
+    if starttime is not None and start + length + _MAX_RECORD_SPAN <= starttime:
+        return False
+
+    return True
+
+
+def pattern_filter(networks=None, stations=None):
+    """Return a select function for scan() matching comma-separated patterns."""
+    net_patterns = networks.split(',') if networks else None
+    sta_patterns = stations.split(',') if stations else None
+
+    def select(net, sta):
+        if net_patterns is not None and \
+                not any(fnmatch.fnmatchcase(net, p) for p in net_patterns):
+            return False
+
+        if sta is not None and sta_patterns is not None and \
+                not any(fnmatch.fnmatchcase(sta, p) for p in sta_patterns):
+            return False
+
+        return True
+
+    return select
+
+
+def list_station(path, year, net, sta, starttime=None, endtime=None):
+    """List the day files of one station directory, sorted.
+
+    Day files outside of the time window and files whose name does not
+    match the directory structure are skipped.
+    """
+    files = []
+
+    for cha in os.scandir(path):
+        if not cha.name.endswith('.D') or not cha.is_dir():
+            continue
+
+        for f in os.scandir(cha.path):
+            if f.name.endswith(msindex.SUFFIX) or f.name.startswith('.'):
+                continue
+
+            try:
+                (n, s, l, c, ext, y, doy) = f.name.split('.')
+                d = DayFile(n, s, l, c, int(y), int(doy), f.path)
+
+                if d.year != year or d.net != net or d.sta != sta or c + '.D' != cha.name:
+                    raise ValueError
+
+            except ValueError:
+                logs.error("invalid SDS file: " + f.path)
+                continue
+
+            if _overlaps(d.starttime(), datetime.timedelta(days=1), starttime, endtime):
+                files.append(d)
+
+    files.sort()
+    return files
+
+
+def scan(root, func, starttime=None, endtime=None, select=None, jobs=1):
+    """Apply func to the day files of each station directory of an archive.
+
+    Year directories and day files outside of [starttime, endtime] are not
+    visited, neither are networks and stations for which select(net, None)
+    or select(net, sta) returns False. func is called with the sorted list
+    of DayFile objects of one station and year, possibly in a pool of jobs
+    threads. The results are returned in the order of (year, net, sta).
+    """
+    tasks = []
+
+    for year in sorted(os.scandir(root), key=lambda e: e.name):
+        if not year.name.isdigit() or not year.is_dir():
+            continue
+
+        y = int(year.name)
+        year_start = datetime.datetime(y, 1, 1)
+        year_length = datetime.datetime(y + 1, 1, 1) - year_start
+
+        if not _overlaps(year_start, year_length, starttime, endtime):
+            continue
+
+        for net in sorted(os.scandir(year.path), key=lambda e: e.name):
+            if not net.is_dir() or (select is not None and not select(net.name, None)):
+                continue
+
+            for sta in sorted(os.scandir(net.path), key=lambda e: e.name):
+                if not sta.is_dir() or (select is not None and not select(net.name, sta.name)):
+                    continue
+
+                tasks.append((sta.path, y, net.name, sta.name))
+
+    def work(task):
+        return func(list_station(*task, starttime=starttime, endtime=endtime))
+
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as executor:
+            return list(executor.map(work, tasks))
+
+    return [work(task) for task in tasks]
+
+
+def coverage(path):
+    """Time segments covered by the records of a day file.
+
+    Returns (period, segments), where period is the largest sample period
+    in seconds found in the file and segments is a sorted list of
+    (start, end) tuples. Records that are less than one sample period
+    apart belong to the same segment.
+    """
+    return summary_coverage(mseedlite.summarize(path))
+
+
+def summary_coverage(summary):
+    """Result of coverage() for a mseedlite.FileSummary of the day file."""
+    period = 0.0
+    spans = []
+
+    for (key, segments) in summary.streams.items():
+        if key[5] > 0:
+            period = max(period, 1.0 / key[5])
+
+        spans.extend((mseedlite.ns2datetime(start), mseedlite.ns2datetime(end))
+                     for (start, end) in segments)
+
+    tolerance = datetime.timedelta(seconds=period)
+    segments = []
+
+    for (start, end) in sorted(spans):
+        if segments and start <= segments[-1][1] + tolerance:
+            if end > segments[-1][1]:
+                segments[-1] = (segments[-1][0], end)
+
+        else:
+            segments.append((start, end))
+
+    return (period, segments)
+
+
+def missing(windows, covered, min_gap=datetime.timedelta(0)):
+    """Parts of the windows that are not covered by any of the segments.
+
+    Both windows and covered are lists of (start, end) tuples, which may
+    overlap. Uncovered intervals not longer than min_gap are ignored.
+    """
+    merged = []
+
+    for (start, end) in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+
+        else:
+            merged.append((start, end))
+
+    gaps = []
+    covered = sorted(covered)
+
+    for (start, end) in merged:
+        t = start
+
+        for (cs, ce) in covered:
+            if ce <= t:
+                continue
+
+            if cs >= end:
+                break
+
+            if cs - t > min_gap:
+                gaps.append((t, cs))
+
+            t = max(t, ce)
+
+            if t >= end:
+                break
+
+        if end - t > min_gap:
+            gaps.append((t, end))
+
+    return gaps
+
+
+def _post_line(nslc, start, end):
+    (net, sta, loc, cha) = nslc
+    return "%s %s %s %s %sZ %sZ" % (net, sta, loc or '--', cha,
+                                    start.isoformat(), end.isoformat())
+
+
+def extract(root, postdata, dest, nets=None, min_gap=_EXTRACT_MIN_GAP):
+    """Copy the records requested by FDSNWS POST lines from an archive.
+
+    postdata contains "NET STA LOC CHA STARTTIME ENDTIME" lines, as
+    accepted by fdsnws_fetch. Records of the channels named explicitly
+    that overlap a time window are copied unchanged from the day files to
+    dest, using the record index of a file if it is up to date and
+    reading the record headers otherwise. (net, year) of the data found is
+    added to nets.
+
+    Returns the POST lines that must still be requested: the uncovered
+    parts of the windows of each channel found, the lines that do not
+    match any channel, lines with wildcards (which may match channels that
+    are not in the archive) and lines containing parameters, without
+    duplicates. Uncovered intervals not longer than min_gap are ignored.
+    """
+    remaining = []
+    requests = []
+    windows = {}
+    covered = {}
+    indexes = {}
+    copied = set()
+
+    for line in postdata.splitlines():
+        items = line.split()
+
+        if not items:
+            continue
+
+        if '=' in line or len(items) != 6 or \
+                any(c in ' '.join(items[:4]) for c in '*?['):
+            remaining.append(line)
+            continue
+
+        (net, sta, loc, cha, start, end) = items
+
+        if loc == '--':
+            loc = ''
+
+        try:
+            starttime = parse_time(start)
+            endtime = parse_time(end)
+
+        except ValueError:
+            remaining.append(line)
+            continue
+
+        nslc = (net, sta, loc, cha)
+        requests.append((nslc, starttime, endtime))
+        windows.setdefault(nslc, []).append((starttime, endtime, line))
+        covered.setdefault(nslc, [])
+
+    # the archive is scanned once for all requested channels; the day
+    # files are then selected by the time window of each line
+    day_files = {}
+
+    sta_files = []
+
+    if requests:
+        networks = ','.join(sorted(set(nslc[0] for nslc in windows)))
+        stations = ','.join(sorted(set(nslc[1] for nslc in windows)))
+        sta_files = scan(root, lambda files: files,
+                         min(r[1] for r in requests), max(r[2] for r in requests),
+                         pattern_filter(networks, stations))
+
+    for files in sta_files:
+        for f in files:
+            nslc = (f.net, f.sta, f.loc, f.cha)
+
+            if nslc in windows:
+                day_files.setdefault(nslc, []).append(f)
+
+    for (nslc, starttime, endtime) in requests:
+        start_ns = mseedlite._datetime2ns(starttime)
+        end_ns = mseedlite._datetime2ns(endtime)
+        segments = covered[nslc]
+
+        for f in day_files.get(nslc, []):
+            if not _overlaps(f.starttime(), datetime.timedelta(days=1), starttime, endtime):
+                continue
+
+            if f.path not in indexes:
+                index = msindex.load(f.path) or msindex.build(f.path)
+                spans = {e[3]: (e[1], e[2]) for e in index.entries}
+                indexes[f.path] = (index, spans)
+
+            (index, spans) = indexes[f.path]
+            selected = []
+
+            for (offset, length) in index.select(nslc, start_ns, end_ns):
+                (rec_begin, rec_end) = spans[offset]
+                segments.append((mseedlite.ns2datetime(rec_begin),
+                                 mseedlite.ns2datetime(rec_end)))
+                selected.append((offset, length))
+
+            if not selected:
+                continue
+
+            if nets is not None:
+                nets.add((f.net, f.year))
+
+            with open(f.path, 'rb') as fd:
+                for (offset, length) in sorted(selected):
+                    if (f.path, offset) in copied:
+                        continue
+
+                    copied.add((f.path, offset))
+                    fd.seek(offset)
+                    dest.write(fd.read(length))
+
+    for (nslc, nslc_windows) in windows.items():
+        if not covered[nslc]:
+            remaining.extend(line for (_, _, line) in nslc_windows)
+            continue
+
+        for (gap_start, gap_end) in missing([w[:2] for w in nslc_windows],
+                                            covered[nslc], min_gap):
+            remaining.append(_post_line(nslc, gap_start, gap_end))
+
+    unique = []
+    seen = set()
+
+    for line in remaining:
+        if line not in seen:
+            seen.add(line)
+            unique.append(line)
+
+    return ''.join(line + '\n' for line in unique)
+
+
+def _mergeable(rec1, rec2):
+    """True if the Steim frames of rec2 can be appended to rec1."""
+    if (rec1.net, rec1.sta, rec1.loc, rec1.cha) != (rec2.net, rec2.sta, rec2.loc, rec2.cha):
+        return False
+
+    if rec2.encoding not in (10, 11) or rec1.encoding != rec2.encoding or \
+            rec1.fsamp != rec2.fsamp or rec2.fsamp <= 0 or rec2.X_minus1 is None:
+        return False
+
+    # same tolerance as used by fseed
+    if abs(rec2.begin_time - rec1.end_time) > datetime.timedelta(seconds=0.1 / rec2.fsamp):
+        return False
+
+    return rec1.Xn == rec2.X_minus1 and \
+        rec1.size + rec2.nframes * 64 <= (1 << _MERGE_RECLEN_EXP)
+
+
+def _write_atomic(path, data):
+    """Replace the content of path without exposing a partial file."""
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                 prefix='.' + os.path.basename(path) + '.')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def compact(path, merge=False):
+    """Sort the records of a day file by time and remove exact duplicates.
+
+    If merge is True, contiguous Steim records are also merged into
+    records of 4096 bytes. The file is replaced atomically and only if its
+    content changes. Returns True if the file was rewritten.
+    """
+    with open(path, 'rb') as fd:
+        orig = fd.read()
+
+    recs = list(mseedlite.Input(orig))
+
+    if sum(rec.size for rec in recs) != len(orig):
+        raise mseedlite.MSeedError("%s: file contains non-data records" % path)
+
+    out = io.BytesIO()
+    cur = None
+    merged = False
+
+    for rec in mseedlite.sort_records(recs, unique=True):
+        if not merge:
+            out.write(rec.raw)
+
+        elif cur is not None and _mergeable(cur, rec):
+            cur.merge(rec, _MERGE_RECLEN_EXP)
+            merged = True
+
+        else:
+            if merged:
+                cur.write(out, _MERGE_RECLEN_EXP)
+
+            elif cur is not None:
+                out.write(cur.raw)
+
+            cur = rec
+            merged = False
+
+    if merged:
+        cur.write(out, _MERGE_RECLEN_EXP)
+
+    elif cur is not None:
+        out.write(cur.raw)
+
+    data = out.getvalue()
+
+    if data == orig:
+        return False
+
+    _write_atomic(path, data)
+    return True
+
+
+def repack(path, rec_len_exp=_MERGE_RECLEN_EXP, encoding=None):
+    """Re-encode the contiguous Steim records of a day file into full records.
+
+    The records are sorted by time and re-encoded with
+    mseedlite.repack, using records of 2**rec_len_exp bytes and encoding
+    (by default the encoding of the original records). The file is
+    replaced atomically and only if its content changes. Returns True if
+    the file was rewritten.
+    """
+    with open(path, 'rb') as fd:
+        orig = fd.read()
+
+    recs = list(mseedlite.Input(orig))
+
+    if sum(rec.size for rec in recs) != len(orig):
+        raise mseedlite.MSeedError("%s: file contains non-data records" % path)
+
+    out = io.BytesIO()
+
+    for rec in mseedlite.repack(mseedlite.sort_records(recs), rec_len_exp, encoding):
+        # records that are passed through by mseedlite.repack are kept as they are
+        if rec._can_repack():
+            rec.write(out, rec_len_exp)
+
+        else:
+            out.write(rec.raw)
+
+    data = out.getvalue()
+
+    if data == orig:
+        return False
+
+    _write_atomic(path, data)
+    return True
+
+
+class State(object):
+    """Persistent index of an SDS archive.
+
+    Keeps the set of day files and the end time of the last record of
+    each stream, so that the archive does not have to be scanned at
+    startup. The index is marked as dirty while it is being updated; an
+    index that was not closed properly must be rebuilt.
+    """
+
+    def __init__(self, path):
+        self.__db = sqlite3.connect(path)
+        self.__endtime = {}
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT);
+            CREATE TABLE IF NOT EXISTS stream (
+                net TEXT, sta TEXT, loc TEXT, cha TEXT,
+                endtime TEXT,
+                PRIMARY KEY (net, sta, loc, cha));
+            CREATE TABLE IF NOT EXISTS dayfile (
+                net TEXT, sta TEXT, loc TEXT, cha TEXT,
+                year INTEGER, doy INTEGER,
+                PRIMARY KEY (net, sta, loc, cha, year, doy));
+            CREATE TABLE IF NOT EXISTS coverage (
+                path TEXT PRIMARY KEY,
+                size INTEGER, mtime INTEGER,
+                period REAL, segments TEXT);
+        """)
+
+    def __get_meta(self, key):
+        row = self.__db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __set_meta(self, key, value):
+        self.__db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def is_valid(self):
+        """True if the index is complete and was closed properly."""
+        return self.__get_meta('version') == _STATE_VERSION and \
+            self.__get_meta('clean') == '1'
+
+    def clear(self):
+        """Remove all entries before rebuilding the index."""
+        self.__endtime = {}
+        self.__db.execute("DELETE FROM stream")
+        self.__db.execute("DELETE FROM dayfile")
+        self.__set_meta('version', _STATE_VERSION)
+        self.__set_meta('clean', '0')
+        self.__db.commit()
+
+    def begin(self):
+        """Mark the index as being updated."""
+        self.__set_meta('clean', '0')
+        self.__db.commit()
+
+    def finish(self):
+        """Write pending updates and mark the index as complete."""
+        self.commit()
+        self.__set_meta('clean', '1')
+        self.__db.commit()
+
+    def close(self):
+        self.__db.close()
+
+    def add_file(self, net, sta, loc, cha, year, doy):
+        self.__db.execute("INSERT OR IGNORE INTO dayfile VALUES (?, ?, ?, ?, ?, ?)",
+                          (net, sta, loc, cha, year, doy))
+
+    def set_endtime(self, nslc, endtime):
+        """Record the end time of data written to stream nslc."""
+        t = self.__endtime.get(nslc)
+
+        if t is None or endtime > t:
+            self.__endtime[nslc] = endtime
+
+    def commit(self):
+        """Write pending end times to the database."""
+        for (nslc, endtime) in self.__endtime.items():
+            t = self.endtime(nslc)
+
+            if t is None or endtime > t:
+                self.__db.execute("INSERT OR REPLACE INTO stream VALUES (?, ?, ?, ?, ?)",
+                                  nslc + (endtime.strftime(_TIME_FORMAT),))
+
+        self.__endtime = {}
+        self.__db.commit()
+
+    def endtime(self, nslc):
+        """End time of the last record of stream nslc, or None."""
+        row = self.__db.execute("SELECT endtime FROM stream "
+                                "WHERE net = ? AND sta = ? AND loc = ? AND cha = ?",
+                                nslc).fetchone()
+
+        if row is None:
+            return None
+
+        return datetime.datetime.strptime(row[0], _TIME_FORMAT)
+
+    def coverage(self, path, size, mtime):
+        """Cached result of coverage(path), or None if the file has changed."""
+        row = self.__db.execute("SELECT period, segments FROM coverage "
+                                "WHERE path = ? AND size = ? AND mtime = ?",
+                                (path, size, mtime)).fetchone()
+
+        if row is None:
+            return None
+
+        segments = [(datetime.datetime.strptime(start, _TIME_FORMAT),
+                     datetime.datetime.strptime(end, _TIME_FORMAT))
+                    for (start, end) in json.loads(row[1])]
+
+        return (row[0], segments)
+
+    def set_coverage(self, path, size, mtime, period, segments):
+        """Cache the coverage of a day file with the given size and mtime."""
+        segments = json.dumps([(start.strftime(_TIME_FORMAT), end.strftime(_TIME_FORMAT))
+                               for (start, end) in segments])
+
+        self.__db.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?)",
+                          (path, size, mtime, period, segments))
+
+    def networks(self):
+        """Set of (network code, year) present in the archive."""
+        return set(self.__db.execute("SELECT DISTINCT net, year FROM dayfile"))
@@ -0,0 +1,345 @@
+"""Decoding and encoding of Mini-SEED data sections.
+
+Supports Steim-1 and Steim-2 compression and the uncompressed INT16,
+INT32, FLOAT32 and FLOAT64 encodings. The samples are decoded with NumPy
+if it is available and with the pure-Python reference decoder otherwise.
+Samples can be encoded with Steim-1 and Steim-2.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import array
+import struct
+
+try:
+    import numpy
+
+except ImportError:
+    numpy = None
+
+INT16 = 1
+INT32 = 3
+FLOAT32 = 4
+FLOAT64 = 5
+STEIM1 = 10
+STEIM2 = 11
+
+FRAME_LEN = 64
+
+# (dtype, array typecode) of the uncompressed encodings
+_UNCOMPRESSED = {
+    INT16: ('i2', 'h'),
+    INT32: ('i4', 'i'),
+    FLOAT32: ('f4', 'f'),
+    FLOAT64: ('f8', 'd'),
+}
+
+# (number of differences, bits per difference) of the Steim-1 words,
+# by control nibble
+_STEIM1_WORDS = {
+    1: (4, 8),
+    2: (2, 16),
+    3: (1, 32),
+}
+
+# (number of differences, bits per difference) of the Steim-2 words,
+# by control nibble and decode nibble
+_STEIM2_WORDS = {
+    (1, 0): (4, 8), (1, 1): (4, 8), (1, 2): (4, 8), (1, 3): (4, 8),
+    (2, 1): (1, 30),
+    (2, 2): (2, 15),
+    (2, 3): (3, 10),
+    (3, 0): (5, 6),
+    (3, 1): (6, 5),
+    (3, 2): (7, 4),
+}
+
+
+# word layouts in the order tried by the encoder: (control nibble, decode
+# nibble, number of differences, bits per difference)
+_STEIM1_ENCODE = [(1, None, 4, 8), (2, None, 2, 16), (3, None, 1, 32)]
+_STEIM2_ENCODE = [(3, 2, 7, 4), (3, 1, 6, 5), (3, 0, 5, 6), (1, None, 4, 8),
+                  (2, 3, 3, 10), (2, 2, 2, 15), (2, 1, 1, 30)]
+
+
+class SteimError(Exception):
+    """Data section cannot be decoded."""
+
+    pass
+
+
+def _words(encoding):
+    if encoding == STEIM1:
+        return _STEIM1_WORDS
+
+    if encoding == STEIM2:
+        return _STEIM2_WORDS
+
+    raise SteimError("unsupported encoding %d" % encoding)
+
+
+def _word_layout(words, c, w):
+    """(count, bits) of a data word with control nibble c."""
+    if words is _STEIM1_WORDS:
+        return words[c]
+
+    try:
+        return words[(c, w >> 30)]
+
+    except KeyError:
+        raise SteimError("invalid Steim-2 decode nibble %d" % (w >> 30))
+
+
+def _integrate(X0, Xn, diffs, nsamp):
+    if len(diffs) < nsamp:
+        raise SteimError("%d samples expected, %d found" % (nsamp, len(diffs)))
+
+    if nsamp == 0:
+        return []
+
+    samples = [X0]
+    x = X0
+    for d in diffs[1:nsamp]:
+        x += d
+        samples.append(x)
+
+    if x != Xn:
+        raise SteimError("last sample %d does not match Xn %d" % (x, Xn))
+
+    return samples
+
+
+def decode_python(data, encoding, nsamp, nframes=None, big_endian=True):
+    """Pure-Python reference decoder, returns an array.array.
+
+    nframes is the number of frames used by Steim-compressed data; if it
+    is not known, all frames in data are decoded.
+    """
+    order = '>' if big_endian else '<'
+
+    if encoding in _UNCOMPRESSED:
+        (dtype, typecode) = _UNCOMPRESSED[encoding]
+        size = struct.calcsize(typecode)
+        if len(data) < nsamp * size:
+            raise SteimError("%d samples expected, %d found" % (nsamp, len(data) // size))
+
+        return array.array(typecode, struct.unpack_from("%s%d%s" % (order, nsamp, typecode), data))
+
+    words = _words(encoding)
+
+    if nframes is None or nframes == 0:
+        nframes = len(data) // FRAME_LEN
+
+    if nframes * FRAME_LEN > len(data):
+        raise SteimError("%d frames expected, %d found" % (nframes, len(data) // FRAME_LEN))
+
+    if nsamp == 0:
+        return array.array('i')
+
+    diffs = []
+    X0 = Xn = 0
+
+    for f in range(nframes):
+        frame = struct.unpack_from(order + "16L", data, f * FRAME_LEN)
+        ctrl = frame[0]
+
+        if f == 0:
+            (X0, Xn) = struct.unpack_from(order + "2l", data, 4)
+
+        for i in range(1, 16):
+            c = (ctrl >> (30 - 2 * i)) & 0x3
+            if c == 0:
+                continue
+
+            w = frame[i]
+            (count, bits) = _word_layout(words, c, w)
+            mask = (1 << bits) - 1
+            sign = 1 << (bits - 1)
+
+            for k in range(count - 1, -1, -1):
+                d = (w >> (k * bits)) & mask
+                if d & sign:
+                    d -= 1 << bits
+
+                diffs.append(d)
+
+    return array.array('i', _integrate(X0, Xn, diffs, nsamp))
+
+
+def _decode_numpy(data, encoding, nsamp, nframes, big_endian):
+    order = '>' if big_endian else '<'
+
+    if encoding in _UNCOMPRESSED:
+        dtype = numpy.dtype(order + _UNCOMPRESSED[encoding][0])
+        if len(data) < nsamp * dtype.itemsize:
+            raise SteimError("%d samples expected, %d found" % (nsamp, len(data) // dtype.itemsize))
+
+        return numpy.frombuffer(data, dtype=dtype, count=nsamp).astype(dtype.newbyteorder('='))
+
+    words = _words(encoding)
+
+    if nframes is None or nframes == 0:
+        nframes = len(data) // FRAME_LEN
+
+    if nframes * FRAME_LEN > len(data):
+        raise SteimError("%d frames expected, %d found" % (nframes, len(data) // FRAME_LEN))
+
+    if nsamp == 0:
+        return numpy.zeros(0, dtype=numpy.int32)
+
+    frames = numpy.frombuffer(data, dtype=order + 'u4', count=nframes * 16).reshape(nframes, 16)
+    frames = frames.astype(numpy.int64)
+    (X0, Xn) = struct.unpack_from(order + "2l", data, 4)
+
+    # control nibble of every word; the first word of each frame and the
+    # X0 and Xn words of the first frame have nibble 0
+    shifts = numpy.arange(30, -1, -2, dtype=numpy.int64)
+    ctrl = ((frames[:, :1] >> shifts) & 0x3).ravel()
+    w = frames.ravel()
+    ctrl[0::16] = 0
+
+    dnib = w >> 30
+
+    # differences of each word in a row, padded to 7 columns
+    diffs = numpy.zeros((len(w), 7), dtype=numpy.int64)
+    count = numpy.zeros(len(w), dtype=numpy.int64)
+
+    for (key, (n, bits)) in words.items():
+        if words is _STEIM1_WORDS:
+            sel = numpy.nonzero(ctrl == key)[0]
+        else:
+            sel = numpy.nonzero((ctrl == key[0]) & (dnib == key[1]))[0]
+
+        if len(sel) == 0:
+            continue
+
+        d = (w[sel, None] >> (numpy.arange(n - 1, -1, -1, dtype=numpy.int64) * bits)) & ((1 << bits) - 1)
+        d -= (d >> (bits - 1)) << bits
+        diffs[sel, :n] = d
+        count[sel] = n
+
+    invalid = (ctrl != 0) & (count == 0)
+    if invalid.any():
+        raise SteimError("invalid Steim-2 decode nibble %d" % dnib[invalid][0])
+
+    diffs = diffs[numpy.arange(7) < count[:, None]]
+
+    if len(diffs) < nsamp:
+        raise SteimError("%d samples expected, %d found" % (nsamp, len(diffs)))
+
+    diffs[0] = X0
+    samples = numpy.cumsum(diffs[:nsamp]).astype(numpy.int32)
+
+    if samples[-1] != Xn:
+        raise SteimError("last sample %d does not match Xn %d" % (samples[-1], Xn))
+
+    return samples
+
+
+def decode(data, encoding, nsamp, nframes=None, big_endian=True):
+    """Decode nsamp samples from the data section of a record.
+
+    Returns a NumPy array if NumPy is available and an array.array
+    otherwise. Raises SteimError if the data is corrupt or the encoding is
+    not supported.
+    """
+    if numpy is None:
+        return decode_python(data, encoding, nsamp, nframes, big_endian)
+
+    return _decode_numpy(data, encoding, nsamp, nframes, big_endian)
+
+
+def concatenate(chunks):
+    """Concatenate arrays returned by decode()."""
+    if numpy is not None:
+        return numpy.concatenate(chunks)
+
+    result = array.array(chunks[0].typecode)
+    for c in chunks:
+        result.extend(c)
+
+    return result
+
+
+def encode(samples, encoding, nframes, X_minus1=None, big_endian=True):
+    """Encode as many samples as fit into nframes Steim frames.
+
+    X_minus1 is the last sample of the previous record; if it is None, the
+    first difference is 0. Returns (data, count), where data contains the
+    frames used and count is the number of samples encoded.
+    """
+    if encoding == STEIM1:
+        layouts = _STEIM1_ENCODE
+
+    elif encoding == STEIM2:
+        layouts = _STEIM2_ENCODE
+
+    else:
+        raise SteimError("cannot encode with encoding %d" % encoding)
+
+    samples = [int(x) for x in samples]
+
+    if not samples or nframes < 1:
+        return (b'', 0)
+
+    diffs = [samples[0] - (samples[0] if X_minus1 is None else int(X_minus1))]
+    diffs.extend(samples[i] - samples[i - 1] for i in range(1, len(samples)))
+
+    order = '>' if big_endian else '<'
+    frames = []
+    pos = 0
+
+    while pos < len(diffs) and len(frames) < nframes:
+        ctrl = 0
+        words = []
+        first = 3 if not frames else 1
+
+        for i in range(first, 16):
+            if pos == len(diffs):
+                break
+
+            for (c, dnib, n, bits) in layouts:
+                chunk = diffs[pos:pos + n]
+                lim = 1 << (bits - 1)
+                if len(chunk) == n and all(-lim <= d < lim for d in chunk):
+                    break
+
+            else:
+                raise SteimError("difference %d cannot be encoded" % diffs[pos])
+
+            w = 0 if dnib is None else dnib << 30
+            for (k, d) in enumerate(chunk):
+                w |= (d & ((1 << bits) - 1)) << ((n - 1 - k) * bits)
+
+            ctrl |= c << (30 - 2 * i)
+            words.append(w)
+            pos += n
+
+        frames.append((ctrl, words))
+
+    count = pos
+    data = bytearray()
+
+    for (f, (ctrl, words)) in enumerate(frames):
+        if f == 0:
+            data += struct.pack(order + "L2l", ctrl, samples[0], samples[count - 1])
+        else:
+            data += struct.pack(order + "L", ctrl)
+
+        data += struct.pack(order + "%dL" % len(words), *words)
+        data += (FRAME_LEN - len(data) % FRAME_LEN) % FRAME_LEN * b'\0'
+
+    return (bytes(data), count)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+"""Tests to check that fdsnws2sds is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+from datetime import timedelta
+from fdsnwsscripts.fdsnws2sds import Timespan
+from fdsnwsscripts.fdsnws2sds import Planner
+from fdsnwsscripts.fdsnws2sds import EpochCache
+from fdsnwsscripts.fdsnws2sds import SDSWriter
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.sds import State
+from fdsnwsscripts.seiscomp.sds import STATE_FILE
+from fdsnwsscripts import fdsnws2sds
+
+"""Test the functionality of fdsnws2sds.py"""
+
+
+def new_stream(cha, node, rate, window=timedelta(days=1)):
+    ts = Timespan(datetime(2001, 1, 1), datetime(2001, 1, 2))
+    ts.node = node
+    ts.rate = rate
+    ts.window = window
+    return (('GE', 'APE', '', cha), ts)
+
+
+def test_planner():
+    # Batches are node-local, of similar sample rate and limited in size
+    idle = [new_stream('BHZ', 'a', 20.0), new_stream('BHN', 'a', 20.0),
+            new_stream('BHE', 'a', 20.0), new_stream('LHZ', 'a', 1.0),
+            new_stream('HHZ', 'b', 100.0)]
+
+    planner = Planner(1000, 1e9)
+    batches = [[nslc[3] for (nslc, ts) in planner.next_batch(idle, 10)] for i in range(4)]
+    assert batches == [['LHZ'], ['HHZ'], ['BHE', 'BHN', 'BHZ'], ['HHZ']]
+
+    # 20 Hz * 1 hour * 1.5 bytes per sample = 108000 bytes per stream
+    idle = [new_stream(cha, 'a', 20.0, timedelta(hours=1)) for cha in ('BHZ', 'BHN', 'BHE')]
+    planner = Planner(1000, 250000)
+    batches = [[nslc[3] for (nslc, ts) in planner.next_batch(idle, 10)] for i in range(3)]
+    assert batches == [['BHE', 'BHN'], ['BHZ', 'BHE'], ['BHN', 'BHZ']]
+
+    planner = Planner(1, 1e9)
+    assert len(planner.next_batch(idle, 10)) == 1
+    assert planner.next_batch([], 10) == []
+
+
+def test_adaptive_window():
+    # The window follows the data rate and grows while there is no data
+    (nslc, ts) = new_stream('BHZ', 'a', 20.0)
+    max_window = timedelta(days=1)
+    ts.adapt_window(108000, max_window)
+    assert ts.window == timedelta(hours=1)
+
+    ts.current = ts.start + timedelta(minutes=10)
+    ts.observe(120000)
+    assert ts.bytes_per_second() == 200
+    ts.adapt_window(120000, max_window)
+    assert ts.window == timedelta(minutes=10)
+
+    ts.grow_window(max_window)
+    assert ts.window == timedelta(minutes=20)
+    ts.window = timedelta(hours=16)
+    ts.grow_window(max_window)
+    assert ts.window == max_window
+
+    ts.adapt_window(1, max_window)
+    assert ts.window == timedelta(minutes=1)
+
+
+def test_epoch_cache(tmp_path, monkeypatch):
+    # An expired cache is updated with the epochs changed since it was fetched
+    line1 = 'GE|APE||BHZ|' + '|' * 10 + '20|2000-01-01T00:00:00|2001-01-01T00:00:00'
+    line2 = 'GE|APE||BHZ|' + '|' * 10 + '20|2001-01-01T00:00:00|'
+    line2b = 'GE|APE||BHZ|' + '|' * 10 + '20|2001-01-01T00:00:00|2002-01-01T00:00:00'
+    calls = []
+
+    def fetch_channels(param, verbose, no_check):
+        calls.append(param)
+        return [line2b] if len(calls) > 1 else [line1, line2]
+
+    monkeypatch.setattr(fdsnws2sds, 'fetch_channels', fetch_channels)
+    cache = EpochCache(str(tmp_path / 'epochs.sqlite'))
+    assert fdsnws2sds.get_channels([], cache, 'q', timedelta(hours=1), False, False) == [line1, line2]
+    assert fdsnws2sds.get_channels([], cache, 'q', timedelta(hours=1), False, False) == [line1, line2]
+    assert len(calls) == 1
+
+    assert fdsnws2sds.get_channels([], cache, 'q', timedelta(0), False, False) == [line1, line2b]
+    assert calls[1][0] == '-q' and calls[1][1].startswith('updatedafter=')
+    assert cache.get('q')[1] == [line1, line2b]
+    assert cache.get('other') is None
+
+
+class FakeProc(object):
+    """Stands in for fdsnws_fetch, writing records to a pipe from a thread."""
+
+    def __init__(self, records, returncode=0, hold=False):
+        (r, self.__w) = os.pipe()
+        self.stdout = os.fdopen(r, 'rb')
+        self.returncode = None
+        self.killed = threading.Event()
+        self.__returncode = returncode
+        self.__thr = threading.Thread(target=self.__run, args=(records, hold))
+        self.__thr.daemon = True
+        self.__thr.start()
+
+    def __run(self, records, hold):
+        try:
+            for raw in records:
+                os.write(self.__w, raw)
+
+            if hold:
+                # still running until killed
+                self.killed.wait(10)
+
+        finally:
+            os.close(self.__w)
+
+    def kill(self):
+        self.killed.set()
+        self.returncode = -9
+
+    def wait(self):
+        self.__thr.join(10)
+
+        if self.returncode is None:
+            self.returncode = self.__returncode
+
+        return self.returncode
+
+
+def run_main(tmp_path, monkeypatch, exec_fetch, written):
+    # Run fdsnws2sds on GE.APE with stubbed channel list, routes and fdsnws_fetch
+    lines = ['GE|APE||%s|' % cha + '|' * 10 + '20|2001-01-01T00:00:00|2001-01-02T00:00:00'
+             for cha in ('BHE', 'BHN', 'BHZ')]
+
+    class CountingWriter(SDSWriter):
+        def write(self, rec):
+            SDSWriter.write(self, rec)
+            written(rec)
+
+    monkeypatch.setattr(fdsnws2sds, 'get_channels', lambda *args: lines)
+    monkeypatch.setattr(fdsnws2sds, 'get_routes', lambda *args: {})
+    monkeypatch.setattr(fdsnws2sds, 'exec_fetch', exec_fetch)
+    monkeypatch.setattr(fdsnws2sds, 'SDSWriter', CountingWriter)
+    monkeypatch.setattr(sys, 'argv', ['fdsnws2sds', '-o', str(tmp_path), '-b', '2', '-j', '1',
+                                      '--cache-ttl', '0', '-z'])
+    return fdsnws2sds.main()
+
+
+def source_records(n):
+    # The first n records of each channel of the test archive
+    records = {}
+
+    for cha in ('BHE', 'BHN', 'BHZ'):
+        path = 'tests/sds/2001/GE/APE/%s.D/GE.APE..%s.D.2001.001' % (cha, cha)
+        records[('GE', 'APE', '', cha)] = [rec for rec in Input(path)][:n]
+
+    return records
+
+
+def postdata_streams(postdata):
+    return [tuple(line.split()[:4]) for line in postdata.decode('utf-8').splitlines()]
+
+
+def day_file(root, cha):
+    with open(str(root / ('2001/GE/APE/%s.D/GE.APE..%s.D.2001.001' % (cha, cha))), 'rb') as fd:
+        return fd.read()
+
+
+def test_interleaved_batches(tmp_path, monkeypatch):
+    # Records of two concurrent batches are written to their day files in order
+    records = source_records(10)
+    streams = {}
+    procs = []
+    turn = threading.Condition()
+    state = {'turn': 0, 'pending': False, 'done': [False, False]}
+    order = []
+
+    def feed(i, nslcs):
+        # hand the turn to the other batch after each record is written
+        for nslc in nslcs:
+            for rec in records[nslc]:
+                with turn:
+                    assert turn.wait_for(lambda: not state['pending'] and
+                                         (state['turn'] == i or state['done'][1 - i]), 10)
+                    state['pending'] = True
+
+                yield bytes(rec.raw)
+
+        with turn:
+            state['done'][i] = True
+            turn.notify_all()
+
+    def exec_fetch(param, data, verbose, no_check):
+        nslcs = [(net, sta, '' if loc == '--' else loc, cha)
+                 for (net, sta, loc, cha) in postdata_streams(data)]
+
+        if len(procs) < 2:
+            for nslc in nslcs:
+                streams[nslc] = len(procs)
+
+            proc = FakeProc(feed(len(procs), nslcs))
+
+        else:
+            # the remaining windows have no data
+            proc = FakeProc([])
+
+        procs.append(proc)
+        return proc
+
+    def written(rec):
+        i = streams[(rec.net, rec.sta, rec.loc, rec.cha)]
+        order.append(i)
+
+        with turn:
+            state['pending'] = False
+            state['turn'] = 1 - i
+            turn.notify_all()
+
+    assert run_main(tmp_path, monkeypatch, exec_fetch, written) == 0
+    assert sorted(streams.values()) == [0, 0, 1]
+    assert order[:20] == [0, 1] * 10
+    assert order[20:] == [0] * 10
+
+    for ((net, sta, loc, cha), recs) in records.items():
+        assert day_file(tmp_path, cha) == b''.join(bytes(rec.raw) for rec in recs)
+
+    state = State(str(tmp_path / STATE_FILE))
+    assert state.is_valid()
+    assert state.networks() == {('GE', 2001)}
+
+    for (nslc, recs) in records.items():
+        assert state.endtime(nslc) == recs[-1].end_time
+
+    state.close()
+
+
+def test_failed_batch(tmp_path, monkeypatch):
+    # A failing batch stops the download; the running batch is killed
+    records = source_records(10)
+    procs = {}
+    first = threading.Event()
+
+    def feed(nslcs, wait):
+        if wait:
+            # fail only after the other batch has delivered its records
+            assert first.wait(10)
+
+            for nslc in nslcs:
+                for rec in records[nslc][:2]:
+                    yield bytes(rec.raw)
+
+        else:
+            for nslc in nslcs:
+                for rec in records[nslc]:
+                    yield bytes(rec.raw)
+
+    def exec_fetch(param, data, verbose, no_check):
+        nslcs = [(net, sta, '' if loc == '--' else loc, cha)
+                 for (net, sta, loc, cha) in postdata_streams(data)]
+
+        if not procs:
+            proc = FakeProc(feed(nslcs, True), returncode=1)
+
+        else:
+            proc = FakeProc(feed(nslcs, False), hold=True)
+
+        for nslc in nslcs:
+            procs[nslc] = proc
+
+        return proc
+
+    written = []
+
+    def count(rec):
+        written.append(rec)
+
+        if len(written) == 10:
+            first.set()
+
+    assert run_main(tmp_path, monkeypatch, exec_fetch, count) == 1
+    assert len(written) == 14
+
+    (running,) = set(proc for proc in procs.values() if proc.returncode != 1)
+    assert running.killed.is_set() and running.returncode == -9
+
+    state = State(str(tmp_path / STATE_FILE))
+    assert state.is_valid()
+
+    for (nslc, proc) in procs.items():
+        recs = records[nslc] if proc is running else records[nslc][:2]
+        assert day_file(tmp_path, nslc[3]) == b''.join(bytes(rec.raw) for rec in recs)
+        assert state.endtime(nslc) == recs[-1].end_time
+
+    state.close()
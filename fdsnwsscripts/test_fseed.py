@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the SEED builder is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import copy
+import os
+import random
+import re
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+from io import BytesIO
+from fdsnwsscripts.seiscomp import fdsnxml
+from fdsnwsscripts.seiscomp import fseed
+from fdsnwsscripts.seiscomp import logs
+from fdsnwsscripts.seiscomp.fseed import SEEDVolume
+from fdsnwsscripts.seiscomp.isotime import parse_time
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import traces
+
+"""Test the functionality of seiscomp/fseed.py"""
+
+PATHS = ['tests/sds/2001/GE/APE/%s.D/GE.APE..%s.D.2001.001' % (cha, cha) for cha in ('BHE', 'BHN', 'BHZ')]
+
+# 512-byte records of the day files above and the volume written from them
+# before the data records were copied without decoding them
+RECORDS = 'tests/fseed/GE.APE.mseed'
+VOLUME = 'tests/fseed/GE.APE.seed'
+
+# adjacent (BHZ), overlapping (BHN) and separate (BHE) epochs and the volume written from
+# span_records() with a 1 minute _min_ts_gap, when the timespans and epochs
+# were still found by a linear scan
+INVENTORY = 'tests/fseed/GE.APE.xml'
+SPANS = 'tests/fseed/spans.seed'
+
+
+def volume(fd, paths=PATHS):
+    # the channels are not in the (empty) inventory
+    warning = logs.warning
+    logs.warning = lambda s: None
+
+    try:
+        vol = SEEDVolume(fdsnxml.Inventory(), "GFZ", "test", False)
+
+        for path in paths:
+            for rec in Input(path):
+                vol.add_data(rec)
+
+        vol.output(fd)
+
+    finally:
+        logs.warning = warning
+
+
+def masked(data):
+    # the volume creation time (the third time of blockette 10) changes with every run
+    vol_time = list(re.finditer(br'\d{4},\d{3},\d{2}:\d{2}:\d{2}\.\d{4}~', data[:4096]))[2]
+    return data[:vol_time.start()] + b'1970,001,00:00:00.0000~' + data[vol_time.end():]
+
+
+def pipe_reader():
+    # returns the write end of a pipe and a function returning all data written to it
+    (rfd, wfd) = os.pipe()
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.extend(iter(os.fdopen(rfd, 'rb').read1, b'')))
+    reader.start()
+
+    def result():
+        reader.join()
+        return b''.join(chunks)
+
+    return (os.fdopen(wfd, 'wb'), result)
+
+
+def check(data):
+    reclen = 4096
+    types = [data[i + 6:i + 7] for i in range(0, len(data), reclen)]
+    recnos = [int(data[i:i + 6]) for i in range(0, len(data), reclen)]
+    data_start = types.index(b'D')
+
+    assert set(types[data_start:]) == {b'D'}
+    assert types[data_start - 1] == b'T'
+    assert recnos[data_start:] == list(range(data_start + 1, len(types) + 1))
+
+    recs = list(Input(data))
+    assert [rec.recno for rec in recs] == recnos[data_start:]
+
+    expected = [(t.net, t.sta, t.cha, t.begin_ns, t.samples.tolist())
+                for path in PATHS for t in traces(Input(path))]
+    assert sorted((t.net, t.sta, t.cha, t.begin_ns, t.samples.tolist()) for t in traces(recs)) == \
+        sorted(expected)
+
+
+def test_waveform_section(tmp_path):
+    # Data records are numbered after the index, in memory and in a file
+    buf = BytesIO()
+    volume(buf)
+    check(buf.getvalue())
+
+    path = tmp_path / 'test.seed'
+    with open(str(path), 'w+b') as fd:
+        volume(fd)
+
+    # the first record contains the creation time of the volume
+    data = path.read_bytes()
+    assert data[4096:] == buf.getvalue()[4096:]
+    check(data)
+
+
+def test_output_unchanged(tmp_path):
+    # The volume is the same as the one written when the records were decoded again
+    with open(VOLUME, 'rb') as fd:
+        expected = masked(fd.read())
+
+    buf = BytesIO()
+    volume(buf, [RECORDS])
+    assert masked(buf.getvalue()) == expected
+
+    path = tmp_path / 'test.seed'
+    with open(str(path), 'w+b') as fd:
+        volume(fd, [RECORDS])
+
+    assert masked(path.read_bytes()) == expected
+
+
+def test_output_data(tmp_path, monkeypatch):
+    # The data records are the same whether they are copied in the kernel or by copyfileobj
+    with open(VOLUME, 'rb') as fd:
+        expected = fd.read()
+
+    data_start = [expected[i + 6:i + 7] for i in range(0, len(expected), 4096)].index(b'D') + 1
+    expected = expected[(data_start - 1) * 4096:]
+
+    def output_data(fd):
+        data = fseed._WaveformData()
+
+        for rec in Input(RECORDS):
+            data.add_data(rec)
+
+        data.output_data(fd, data_start)
+
+    # copy_file_range() or sendfile()
+    path = tmp_path / 'data'
+    with open(str(path), 'wb') as fd:
+        output_data(fd)
+
+    assert path.read_bytes() == expected
+
+    # no file descriptor
+    buf = BytesIO()
+    output_data(buf)
+    assert buf.getvalue() == expected
+
+    # not seekable
+    (fd, result) = pipe_reader()
+
+    with fd:
+        output_data(fd)
+
+    assert result() == expected
+
+    # no kernel copy available
+    monkeypatch.delattr(os, 'copy_file_range', raising=False)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+
+    with open(str(path), 'wb') as fd:
+        fd.write(b'head')
+        output_data(fd)
+
+    assert path.read_bytes() == b'head' + expected
+
+
+def span_records():
+    # records that start or end exactly _min_ts_gap (1 minute) from a timespan or epoch boundary
+    layout = [('BHZ', '07:50:00', '08:00:00'),
+              ('BHN', '08:01:00', '08:05:00'),         # 1 minute after the first timespan
+              ('BHE', '08:20:00', '08:25:00'),         # new timespan
+              ('BHZ', '08:26:00.000001', '08:30:00'),  # 1 us too late for the second timespan
+              ('BHN', '07:40:00', '07:49:00'),         # 1 minute before the first timespan
+              ('BHE', '08:25:30', '08:26:00.5'),       # overlaps the second and third timespans
+              ('BHZ', '08:31:00', '08:32:00'),         # 1 minute after the third timespan
+              ('BHN', '09:00:00', '09:01:00'),         # new timespan
+              ('BHE', '08:06:00', '08:19:00'),         # touches two timespans and the end of an epoch
+              ('BHZ', '08:19:30', '08:19:45')]         # overlaps the first and second timespans
+    templates = {}
+
+    for rec in Input(RECORDS):
+        templates.setdefault(rec.cha, rec)
+
+    for (cha, begin, end) in layout:
+        rec = copy.copy(templates[cha])
+        rec.begin_time = parse_time('2001-01-01T' + begin)
+        rec.end_time = parse_time('2001-01-01T' + end)
+        yield rec
+
+
+def span_volume(fd):
+    inv = fdsnxml.Inventory()
+    inv.load_fdsnxml(INVENTORY)
+
+    # BHE data between its epochs is not in the inventory
+    warning = logs.warning
+    logs.warning = lambda s: None
+
+    try:
+        vol = SEEDVolume(inv, "GFZ", "test", False)
+
+        for rec in span_records():
+            vol.add_data(rec)
+
+        vol.output(fd)
+
+    finally:
+        logs.warning = warning
+
+
+def test_copy_file(tmp_path):
+    # Data is copied to real files, file objects and pipes
+    data = bytes(bytearray(random.Random(3).randrange(256) for _ in range(100000)))
+    src = tempfile.TemporaryFile()
+    src.write(data)
+    src.flush()
+
+    buf = BytesIO(b'head')
+    buf.seek(0, 2)
+    fseed._copy_file(src, buf, len(data))
+    assert buf.getvalue() == b'head' + data
+
+    with open(str(tmp_path / 'copy'), 'w+b') as fd:
+        fd.write(b'head')
+        fseed._copy_file(src, fd, len(data))
+        assert fd.tell() == 4 + len(data)
+
+    assert (tmp_path / 'copy').read_bytes() == b'head' + data
+
+    (fd, result) = pipe_reader()
+
+    with fd:
+        fseed._copy_file(src, fd, len(data))
+
+    assert result() == data
+
+
+def test_span_index(monkeypatch):
+    # The timespan found for a record is the first one that overlaps it
+    monkeypatch.setattr(fseed, '_min_ts_gap', timedelta(minutes=1))
+    rnd = random.Random(1)
+    t0 = datetime(2001, 1, 1)
+    index = fseed._SpanIndex()
+    spans = []
+
+    for n in range(2000):
+        begin = t0 + timedelta(seconds=rnd.randrange(86400))
+        end = begin + timedelta(seconds=rnd.randrange(600))
+        expected = next((s for s in spans if s.overlap(begin, end)), None)
+        assert index.find(begin, end) is expected
+
+        if expected is None:
+            span = fseed._Timespan(index)
+            span.new_time_series('GE', 'APE', '', 'BHZ', begin, end, n)
+            spans.append(span)
+
+        else:
+            expected.extend(begin, end)
+
+    assert list(index) == spans
+    assert 1 < len(spans) < 2000
+
+
+def test_epoch_index():
+    # The epochs overlapping a window are found in the order of the inventory
+    Stream = namedtuple('Stream', ['start', 'end'])
+    rnd = random.Random(2)
+    t0 = datetime(2001, 1, 1)
+    strm_tp = {}
+
+    for n in range(200):
+        start = t0 + timedelta(days=rnd.randrange(3650))
+        end = None if n % 10 == 0 else start + timedelta(days=rnd.randrange(1000))
+        strm_tp[start] = Stream(start, end)
+
+    index = fseed._EpochIndex(strm_tp)
+
+    for n in range(500):
+        start = t0 + timedelta(days=rnd.randrange(-100, 3750))
+        end = None if n % 20 == 0 else start + timedelta(days=rnd.randrange(100))
+        expected = [s for s in strm_tp.values()
+                    if fseed._cmptime(start, s.end) <= 0 and fseed._cmptime(end, s.start) >= 0]
+        assert index.select(start, end) == expected
+
+
+def test_spans_unchanged(monkeypatch):
+    # Blockettes 70 and 74 and the channel epochs are the same as found by a linear scan
+    monkeypatch.setattr(fseed, '_min_ts_gap', timedelta(minutes=1))
+
+    with open(SPANS, 'rb') as fd:
+        expected = masked(fd.read())
+
+    buf = BytesIO()
+    span_volume(buf)
+    assert masked(buf.getvalue()) == expected
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the time parser is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+from datetime import datetime
+from fdsnwsscripts.seiscomp.isotime import parse_time
+from fdsnwsscripts.fdsnavail import str2date
+from fdsnwsscripts.seiscomp.db.xmlio.xmlwrap import _datetime_fromxml
+import pytest
+
+"""Test the functionality of seiscomp/isotime.py"""
+
+
+def test_parse_time():
+    assert parse_time('2001-01-01T08:04:31') == datetime(2001, 1, 1, 8, 4, 31)
+    assert parse_time('2001-01-01T08:04:31.2158Z') == datetime(2001, 1, 1, 8, 4, 31, 215800)
+    assert parse_time('2001-01-01T08:04:31.215867') == datetime(2001, 1, 1, 8, 4, 31, 215867)
+    assert parse_time('2001-01-01T08:04:31.215867891Z') == datetime(2001, 1, 1, 8, 4, 31, 215867)
+    assert parse_time('2001-01-01') == datetime(2001, 1, 1)
+    assert parse_time('2001-01-01T10:04:31+02:00') == datetime(2001, 1, 1, 8, 4, 31)
+    assert parse_time('1 Jan 2001 08:04') == datetime(2001, 1, 1, 8, 4)
+    assert parse_time('2001-01-01T08:04:31Z') is parse_time('2001-01-01T08:04:31Z')
+
+    with pytest.raises(ValueError):
+        parse_time('')
+
+    with pytest.raises(ValueError):
+        parse_time('2001-13-01T00:00:00')
+
+
+def test_callers():
+    assert str2date('2001-02-01T10:00:00.5Z') == datetime(2001, 2, 1, 10, 0, 0, 500000)
+    assert str2date('') is None
+    assert _datetime_fromxml('2001-02-01T10:00:00.0000Z') == datetime(2001, 2, 1, 10)
+    assert _datetime_fromxml('') is None
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the Mini-SEED reader is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import copy
+import mmap
+import random
+from io import BytesIO
+from datetime import datetime
+from datetime import timedelta
+import pytest
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import MSeedError
+from fdsnwsscripts.seiscomp.mseedlite import read_headers
+from fdsnwsscripts.seiscomp.mseedlite import repack
+from fdsnwsscripts.seiscomp.mseedlite import scan_files
+from fdsnwsscripts.seiscomp.mseedlite import sort_records
+from fdsnwsscripts.seiscomp import steim
+
+"""Test the functionality of seiscomp/mseedlite.py"""
+
+FILES = ['tests/GE.APE.mseed', 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001']
+
+
+def summary(recs):
+    return [(rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time, rec.size, rec.nframes,
+             rec.X0, rec.Xn, rec.X_minus1, bytes(rec.raw)) for rec in recs]
+
+
+def test_input_sources(tmp_path):
+    # Paths, buffers and file handles give the same records
+    for path in FILES:
+        with open(path, 'rb') as fd:
+            expected = summary(Input(fd))
+            fd.seek(0)
+            data = fd.read()
+            fd.seek(0)
+            buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        assert len(expected) > 0
+        assert b''.join(r[-1] for r in expected) == data
+        assert summary(Input(path)) == expected
+        assert summary(Input(data)) == expected
+        assert summary(Input(buf)) == expected
+
+    empty = tmp_path / 'empty.mseed'
+    empty.write_bytes(b'')
+    assert list(Input(str(empty))) == []
+
+
+def test_input_zero_copy():
+    # Records read from a path are views of the mapped file
+    recs = list(Input(FILES[0]))
+    assert all(isinstance(rec.raw, memoryview) for rec in recs)
+    assert all(isinstance(rec.data, memoryview) for rec in recs)
+    assert bytes(recs[0].raw) == bytes(recs[0].header) + bytes(recs[0].data)
+
+
+def test_input_headers_only():
+    # Header fields are the same, data-dependent fields need the data section
+    with open(FILES[0], 'rb') as fd:
+        recs = list(Input(fd, headers_only=True))
+
+    expected = list(Input(FILES[0]))
+    assert [(rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time, rec.fsamp, rec.size)
+            for rec in recs] == \
+        [(rec.net, rec.sta, rec.loc, rec.cha, rec.begin_time, rec.end_time, rec.fsamp, rec.size)
+         for rec in expected]
+
+    assert all(rec.data is None for rec in recs)
+
+    with pytest.raises(MSeedError):
+        recs[0].X0
+
+    with pytest.raises(MSeedError):
+        recs[0].raw
+
+
+def test_record_times():
+    # Integer nanosecond times agree with the datetime properties
+    for rec in Input(FILES[0]):
+        assert rec.begin_time == datetime(1970, 1, 1) + timedelta(microseconds=rec.begin_ns // 1000)
+        assert rec.end_ns - rec.begin_ns == rec.nsamp * 10**9 // rec.fsamp
+        assert not hasattr(rec, '__dict__')
+
+    rec.end_time = datetime(2001, 1, 1, 0, 0, 1, 500)
+    assert rec.end_ns == 978307201000500000
+    assert rec.end_time == datetime(2001, 1, 1, 0, 0, 1, 500)
+
+
+def test_read_headers():
+    # Batch decoding gives the same headers as the scalar parser
+    for path in FILES:
+        expected = [(rec.net, rec.sta, rec.loc, rec.cha, rec.rectype, rec.fsamp, rec.nsamp,
+                     rec.begin_ns, rec.end_ns, rec.size) for rec in Input(path)]
+
+        assert read_headers(path) == expected
+
+        with open(path, 'rb') as fd:
+            data = fd.read()
+
+        # a truncated file is decoded record by record
+        with pytest.raises(MSeedError):
+            read_headers(data[:-1])
+
+        # as is a file with a non-data record
+        assert read_headers(data + b'000000V' + b' ' * 4089) == expected
+
+
+def test_write():
+    # Writing the records unchanged reproduces the file
+    for path in FILES:
+        with open(path, 'rb') as fd:
+            data = fd.read()
+
+        out = BytesIO()
+        for rec in Input(data):
+            rec.write(out, 12)
+
+        assert out.getvalue() == data
+
+    # Records written into larger records are padded
+    out = BytesIO()
+    recs = list(Input(FILES[0]))[:3]
+    for rec in recs:
+        rec.write(out, 13)
+
+    data = out.getvalue()
+    assert len(data) == 3 * 8192
+    assert all(data[i * 8192 + 4096:(i + 1) * 8192] == bytes(4096) for i in range(3))
+
+
+def test_scan_files():
+    # Summaries are the same with and without worker processes and in the order of the paths
+    paths = FILES + ['tests/sds/2001/GE/APE/BHN.D/GE.APE..BHN.D.2001.001'] * 3
+    summaries = scan_files(paths)
+    assert [s.path for s in summaries] == paths
+    assert scan_files(paths, jobs=3, chunksize=2) == summaries
+
+    for s in summaries:
+        ends = {}
+        for h in read_headers(s.path):
+            key = (h.net, h.sta, h.loc, h.cha, h.rectype, h.fsamp)
+            ends[key] = max(ends.get(key, h.end_ns), h.end_ns)
+            assert any(begin <= h.begin_ns and h.end_ns <= end for (begin, end) in s.streams[key])
+
+        assert {key: segments[-1][1] for (key, segments) in s.streams.items()} == ends
+
+
+def test_sort_records():
+    # Shuffled records from several files are sorted, in memory or in spilled runs
+    recs = [rec for path in FILES for rec in Input(path)]
+    expected = []
+
+    # the files have records in common
+    for rec in sorted(recs, key=lambda rec: (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_ns)):
+        if bytes(rec.raw) not in [bytes(r.raw) for r in expected[-10:]]:
+            expected.append(rec)
+
+    assert len(expected) < len(recs)
+    messy = recs + recs[10:40]
+    random.Random(2).shuffle(messy)
+
+    for run_size in (1 << 30, 10000):
+        result = list(sort_records(messy, unique=True, run_size=run_size))
+        assert [bytes(rec.raw) for rec in result] == [bytes(rec.raw) for rec in expected]
+
+        result = list(sort_records(messy, run_size=run_size))
+        assert len(result) == len(messy)
+        assert [(rec.net, rec.sta, rec.loc, rec.cha, rec.begin_ns) for rec in result] == \
+            sorted((rec.net, rec.sta, rec.loc, rec.cha, rec.begin_ns) for rec in messy)
+
+
+def test_merge():
+    # Merged records keep the frames of the records and write out as one record
+    recs = list(Input(FILES[1]))[:3]
+    merged = list(Input(FILES[1]))[0]
+
+    for rec in recs[1:]:
+        merged.merge(rec, 14)
+
+    assert merged.nsamp == sum(rec.nsamp for rec in recs)
+    assert merged.nframes == sum(rec.nframes for rec in recs)
+    assert (merged.begin_ns, merged.end_ns) == (recs[0].begin_ns, recs[-1].end_ns)
+    frames = b''.join(bytes(rec.data[:rec.nframes * 64]) for rec in recs)
+    assert bytes(merged.data[12:]) == frames[12:]
+    assert bytes(merged.data[:12]) == frames[:8] + bytes(recs[-1].data[8:12])
+
+    out = BytesIO()
+    merged.write(out, 14)
+    (rec,) = list(Input(out.getvalue()))
+    assert (rec.nsamp, rec.nframes, rec.Xn) == (merged.nsamp, merged.nframes, recs[-1].Xn)
+    assert rec.begin_ns == recs[0].begin_ns
+
+
+def test_merge_many():
+    # Merging into the preallocated buffer gives the same data as concatenating the frames
+    out = BytesIO()
+
+    for rec in repack(Input(FILES[1]), 8):
+        rec.write(out, 8)
+
+    recs = [rec for rec in Input(out.getvalue()) if rec.nframes == 3][:20]
+    assert len(recs) == 20
+
+    first = recs[0]
+    merged = copy.copy(first)
+    data = bytearray(first.data[:first.nframes * 64])
+
+    for rec in recs[1:]:
+        merged.merge(rec, 12)
+        data += rec.data[:rec.nframes * 64]
+        data[8:12] = rec.data[8:12]
+        assert bytes(merged.data) == bytes(data)
+        assert merged.Xn == rec.Xn
+        assert merged.size == len(first.header) + len(data)
+
+    # the frames of the first record are copied, not modified
+    assert bytes(first.data[8:12]) != bytes(merged.data[8:12])
+    assert merged.samples().tolist() == steim.concatenate([rec.samples() for rec in recs]).tolist()
+
+    out = BytesIO()
+    merged.write(out, 12)
+    (rec,) = list(Input(out.getvalue()))
+    assert len(out.getvalue()) == 4096
+    assert bytes(rec.data[:rec.nframes * 64]) == bytes(data)
+
+    # the merged record must fit into the requested record length
+    merged = copy.copy(first)
+
+    with pytest.raises(MSeedError):
+        for rec in recs[1:]:
+            merged.merge(rec, 9)
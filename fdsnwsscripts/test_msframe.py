@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the Mini-SEED framing is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import struct
+from io import BytesIO
+import pytest
+from fdsnwsscripts.seiscomp import msframe
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import Record
+
+"""Test the functionality of seiscomp/msframe.py"""
+
+FILE = 'tests/GE.APE.mseed'
+
+FIXHEAD = "6s2c12s2H3Bx2H2h4Bl2H"
+
+
+def records():
+    with open(FILE, 'rb') as fd:
+        return [bytes(rec.raw) for rec in Input(fd)]
+
+
+def little_endian(raw):
+    """The record with the header converted to little-endian."""
+    out = bytearray(raw)
+    fields = struct.unpack_from(">" + FIXHEAD, raw)
+    struct.pack_into("<" + FIXHEAD, out, 0, *fields)
+    pos = fields[-1]
+
+    while pos != 0:
+        (blktype, nextblk) = struct.unpack_from(">2H", raw, pos)
+        struct.pack_into("<2H", out, pos, blktype, nextblk)
+        pos = nextblk
+
+    return bytes(out)
+
+
+def resized(raw, rec_len_exp):
+    """The record with its length changed, keeping the header."""
+    frame = msframe.parse(raw)
+    out = bytearray(raw[:frame.pdata])
+    out[frame.blk1000 + 2] = rec_len_exp
+    out += raw[frame.pdata:1 << rec_len_exp]
+    out += bytes((1 << rec_len_exp) - len(out))
+    return bytes(out)
+
+
+def test_frames():
+    # Frames of a file agree with the parsed records
+    with open(FILE, 'rb') as fd:
+        data = fd.read()
+
+    expected = [(rec.size, rec.encoding) for rec in Input(data)]
+    frames = list(msframe.frames(data))
+    assert [f.size for (offset, f) in frames] == [e[0] for e in expected]
+    assert [offset for (offset, f) in frames] == \
+        [sum(e[0] for e in expected[:i]) for i in range(len(expected))]
+    assert all(f.order == '>' and f.rectype in msframe.DATA_TYPES for (offset, f) in frames)
+    assert [data[offset + f.blk1000] for (offset, f) in frames] == [e[1] for e in expected]
+
+    with pytest.raises(msframe.Truncated):
+        list(msframe.frames(data[:-1]))
+
+
+def test_read_stream():
+    # Records from 128 bytes to 64 KiB are split correctly from a stream
+    raw = records()[0]
+    recs = [resized(raw, 7), resized(raw, 16), raw, resized(raw, 7), little_endian(raw)]
+    fd = BytesIO(b''.join(recs))
+    result = []
+
+    while True:
+        rec = msframe.read(fd)
+        if rec is None:
+            break
+
+        result.append(rec)
+
+    assert [r for (f, r) in result] == recs
+    assert [f.size for (f, r) in result] == [128, 65536, len(raw), 128, len(raw)]
+    assert [f.order for (f, r) in result] == ['>', '>', '>', '>', '<']
+
+    with pytest.raises(msframe.Truncated):
+        msframe.read(BytesIO(raw[:-1]))
+
+    with pytest.raises(msframe.NonDataRecord):
+        msframe.parse(b'000001V ' + raw[8:])
+
+
+def test_record_sizes():
+    # mseedlite reads the records the framing accepts
+    raw = records()[0]
+    big = resized(raw, 16)
+    small = resized(raw, 7)
+    recs = list(Input(big + small + raw))
+    assert [rec.size for rec in recs] == [65536, 128, len(raw)]
+    assert recs[0].begin_time == recs[1].begin_time == recs[2].begin_time
+
+
+def test_little_endian():
+    # Little-endian headers are decoded and written back in the same order
+    for raw in records()[:20]:
+        le = little_endian(raw)
+        rec = Record(le)
+        expected = Record(raw)
+        assert (rec.net, rec.sta, rec.loc, rec.cha, rec.begin_ns, rec.end_ns, rec.nsamp, rec.size) == \
+            (expected.net, expected.sta, expected.loc, expected.cha, expected.begin_ns,
+             expected.end_ns, expected.nsamp, expected.size)
+        assert rec.samples().tolist() == expected.samples().tolist()
+
+        out = BytesIO()
+        rec.write(out, (rec.size - 1).bit_length())
+        assert out.getvalue() == le
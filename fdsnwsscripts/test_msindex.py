@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the Mini-SEED record index is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import os
+import shutil
+from fdsnwsscripts.seiscomp import msindex
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import Record
+from fdsnwsscripts.fdsnws2sds import SDSWriter
+
+"""Test the functionality of seiscomp/msindex.py"""
+
+
+def window(recs, nslc, start, end):
+    # records of nslc overlapping [start, end), found by checking all records
+    return sorted((rec.begin_ns, bytes(rec.raw)) for rec in recs
+                  if (rec.net, rec.sta, rec.loc, rec.cha) == nslc and
+                  (start is None or rec.end_ns > start) and (end is None or rec.begin_ns < end))
+
+
+def test_select(tmp_path):
+    # Lookups agree with a full scan, and the index survives a round trip
+    path = str(tmp_path / 'GE.APE.mseed')
+    shutil.copy('tests/GE.APE.mseed', path)
+
+    with open(path, 'rb') as fd:
+        data = fd.read()
+
+    assert msindex.load(path) is None
+    index = msindex.update(path)
+    assert os.path.exists(path + msindex.SUFFIX)
+    loaded = msindex.load(path)
+    assert loaded is not None and loaded.entries == index.entries
+    assert loaded.channels() == [('GE', 'APE', '', 'BHE'), ('GE', 'APE', '', 'BHN'), ('GE', 'APE', '', 'BHZ')]
+
+    recs = list(Input(data))
+    times = [None] + [rec.begin_ns for rec in recs[::37]] + [rec.end_ns + 1 for rec in recs[::53]]
+
+    for nslc in loaded.channels():
+        for start in times:
+            for end in times:
+                expected = window(recs, nslc, start, end)
+                found = [(Record(data[o:o + n]).begin_ns, data[o:o + n])
+                         for (o, n) in loaded.select(nslc, start, end)]
+                assert found == expected
+
+    assert loaded.select(('GE', 'XXX', '', 'BHZ')) == []
+
+
+def test_stale(tmp_path):
+    # An index no longer matching the file is ignored and rebuilt
+    path = str(tmp_path / 'GE.APE.mseed')
+    shutil.copy('tests/GE.APE.mseed', path)
+    msindex.update(path)
+
+    with open(path, 'ab') as fd:
+        fd.write(recs_of('tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001')[0])
+
+    assert msindex.load(path) is None
+    assert len(msindex.update(path).entries) == 507
+    assert msindex.load(path) is not None
+
+    with open(path + msindex.SUFFIX, 'r+b') as fd:
+        fd.truncate(100)
+
+    assert msindex.load(path) is None
+
+
+def recs_of(path):
+    with open(path, 'rb') as fd:
+        return [bytes(rec.raw) for rec in Input(fd.read())]
+
+
+def test_writer(tmp_path):
+    # The SDS writer keeps the index of the day files up to date
+    orig = 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001'
+    writer = SDSWriter(str(tmp_path), index=True)
+
+    for (i, rec) in enumerate(Input(orig)):
+        writer.write(rec)
+
+        if i == 50:
+            writer.close()
+
+    writer.close()
+
+    path = str(tmp_path / '2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001')
+    index = msindex.load(path)
+    assert index is not None
+    assert index.entries == msindex.build(path).entries
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the SDS helpers are working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import io
+import os
+import random
+import shutil
+from datetime import datetime
+from datetime import timedelta
+from fdsnwsscripts.seiscomp.sds import State
+from fdsnwsscripts.seiscomp.sds import scan
+from fdsnwsscripts.seiscomp.sds import pattern_filter
+from fdsnwsscripts.seiscomp.sds import coverage
+from fdsnwsscripts.seiscomp.sds import missing
+from fdsnwsscripts.seiscomp.sds import compact
+from fdsnwsscripts.seiscomp.sds import repack
+from fdsnwsscripts.seiscomp.sds import extract
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import traces
+from fdsnwsscripts.seiscomp import steim
+from fdsnwsscripts.seiscomp import sds
+from fdsnwsscripts.seiscomp import msindex
+from fdsnwsscripts.fdsnws2sds import Timespan
+from fdsnwsscripts.fdsnws2sds import scan_sds
+from fdsnwsscripts.fdsnws2sds import load_state
+from fdsnwsscripts.fdsnws2sds import fill_gaps
+
+"""Test the functionality of seiscomp/sds.py"""
+
+
+def new_timespan() -> dict:
+    return {('GE', 'APE', '', cha): Timespan(datetime(2001, 1, 1), datetime(2001, 1, 2))
+            for cha in ('BHE', 'BHN', 'BHZ')}
+
+
+def test_state_rebuild(tmp_path):
+    # The index built while scanning must give the same result as the scan
+    state = State(str(tmp_path / 'state.sqlite'))
+    assert not state.is_valid()
+    scanned = new_timespan()
+    nets = set()
+    scan_sds('tests/sds', scanned, nets, state)
+    assert state.is_valid()
+    assert nets == {('GE', 2001)}
+    state.close()
+
+    state = State(str(tmp_path / 'state.sqlite'))
+    loaded = new_timespan()
+    nets = set()
+    load_state(state, loaded, nets)
+    assert nets == {('GE', 2001)}
+    assert scanned.keys() == loaded.keys()
+    for nslc in scanned:
+        assert scanned[nslc].start == loaded[nslc].start
+    assert loaded[('GE', 'APE', '', 'BHZ')].start == datetime(2001, 1, 1, 18, 51, 29, 355580)
+
+
+def test_state_dirty(tmp_path):
+    # An index that was not finished must not be trusted
+    state = State(str(tmp_path / 'state.sqlite'))
+    state.clear()
+    state.finish()
+    assert state.is_valid()
+    state.begin()
+    state.set_endtime(('GE', 'APE', '', 'BHZ'), datetime(2001, 1, 1))
+    state.set_endtime(('GE', 'APE', '', 'BHZ'), datetime(2000, 1, 1))
+    state.commit()
+    assert not state.is_valid()
+    assert state.endtime(('GE', 'APE', '', 'BHZ')) == datetime(2001, 1, 1)
+    assert state.endtime(('GE', 'APE', '', 'BHN')) is None
+
+
+def test_scan_pruned():
+    # Day files outside of the time window or of other networks are not visited
+    def names(files):
+        return [os.path.basename(f.path) for f in files]
+
+    allfiles = sum(scan('tests/sds', names), [])
+    assert allfiles == ['GE.APE..BHE.D.2001.001', 'GE.APE..BHN.D.2001.001', 'GE.APE..BHZ.D.2001.001']
+    assert scan('tests/sds', names, jobs=2) == scan('tests/sds', names)
+    assert sum(scan('tests/sds', names, datetime(2001, 1, 3), datetime(2001, 2, 1)), []) == []
+    assert scan('tests/sds', names, datetime(2000, 1, 1), datetime(2001, 1, 1)) == []
+    assert sum(scan('tests/sds', names, datetime(2000, 12, 1), datetime(2001, 1, 2)), []) == allfiles
+    assert scan('tests/sds', names, select=pattern_filter('CX')) == []
+    assert scan('tests/sds', names, select=pattern_filter('G?', 'X*,APE')) == [allfiles]
+
+
+def test_missing():
+    def t(h):
+        return datetime(2001, 1, 1) + timedelta(hours=h)
+
+    assert missing([(t(0), t(10))], []) == [(t(0), t(10))]
+    assert missing([(t(0), t(10))], [(t(2), t(3)), (t(1), t(4)), (t(8), t(12))]) == \
+        [(t(0), t(1)), (t(4), t(8))]
+    assert missing([(t(0), t(5)), (t(3), t(10))], [(t(4), t(6))]) == [(t(0), t(4)), (t(6), t(10))]
+    assert missing([(t(0), t(10))], [(t(0), t(5)), (t(6), t(10))], timedelta(hours=1)) == []
+
+
+def test_fill_gaps(tmp_path):
+    # Holes inside a day file are found; the coverage is cached in the index
+    path = 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001'
+    (period, segments) = coverage(path)
+    assert period == 0.05
+    assert segments[0][0] == datetime(2001, 1, 1, 8, 4, 31, 215867)
+    assert segments[-1][1] == datetime(2001, 1, 1, 18, 51, 29, 355580)
+
+    state = State(str(tmp_path / 'state.sqlite'))
+    timespan = new_timespan()
+    nets = set()
+    fill_gaps('tests/sds', timespan, nets, state)
+    assert nets == {('GE', 2001)}
+    assert state.coverage(path, os.path.getsize(path), os.stat(path).st_mtime_ns) == (period, segments)
+    assert state.coverage(path, 0, 0) is None
+
+    ts = timespan[('GE', 'APE', '', 'BHZ')]
+    gaps = [(ts.start, ts.end)]
+
+    while ts.next_segment():
+        gaps.append((ts.start, ts.end))
+
+    assert gaps == missing([(datetime(2001, 1, 1), datetime(2001, 1, 2))], segments,
+                           timedelta(seconds=period))
+    assert gaps[0] == (datetime(2001, 1, 1), segments[0][0])
+    assert gaps[-1] == (segments[-1][1], datetime(2001, 1, 2))
+
+
+def test_compact(tmp_path):
+    # Shuffled and duplicated records are sorted and removed; sorted files are not touched
+    orig = 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001'
+
+    with open(orig, 'rb') as fd:
+        data = fd.read()
+        fd.seek(0)
+        recs = [rec.header + rec.data for rec in Input(fd)]
+
+    messy = recs + recs[5:30]
+    random.Random(1).shuffle(messy)
+    path = tmp_path / 'GE.APE..BHZ.D.2001.001'
+    path.write_bytes(b''.join(messy))
+
+    assert compact(str(path))
+    assert path.read_bytes() == data
+    mtime = os.stat(str(path)).st_mtime_ns
+    assert not compact(str(path))
+    assert not compact(str(path), merge=True)
+    assert os.stat(str(path)).st_mtime_ns == mtime
+    assert os.listdir(str(tmp_path)) == ['GE.APE..BHZ.D.2001.001']
+
+
+def test_repack(tmp_path):
+    # Records are re-encoded into full records with the same samples
+    orig = 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001'
+    path = tmp_path / 'GE.APE..BHZ.D.2001.001'
+
+    with open(orig, 'rb') as fd:
+        path.write_bytes(fd.read())
+
+    expected = [(t.begin_ns, t.samples.tolist()) for t in traces(Input(orig))]
+
+    for (rec_len_exp, encoding) in [(9, steim.STEIM2), (12, steim.STEIM1), (12, steim.STEIM2)]:
+        assert repack(str(path), rec_len_exp, encoding)
+        recs = list(Input(str(path)))
+        assert all(rec.size == 1 << rec_len_exp and rec.encoding == encoding for rec in recs)
+        assert [(t.begin_ns, t.samples.tolist()) for t in traces(recs)] == expected
+
+        # all records of a trace but the last are full
+        for (rec, nxt) in zip(recs, recs[1:]):
+            if abs(nxt.begin_ns - rec.end_ns) * rec.fsamp <= 100000000:
+                assert rec.nframes == (rec.size - len(rec.header)) // 64
+
+    assert not repack(str(path), 12, steim.STEIM2)
+    assert path.stat().st_size < os.stat(orig).st_size
+
+
+def test_repack_other_encoding(tmp_path):
+    # Records that cannot be re-encoded are kept as they are, even if larger than the target
+    orig = 'tests/sds/2001/GE/APE/BHZ.D/GE.APE..BHZ.D.2001.001'
+    path = tmp_path / 'GE.APE..BHZ.D.2001.001'
+
+    with open(orig, 'rb') as fd:
+        data = bytearray(fd.read())
+
+    # change the encoding of the last 4096-byte record to INT32
+    other = len(data) - 4096
+    assert data[other + 48:other + 50] == b'\x03\xe8'
+    data[other + 52] = steim.INT32
+    path.write_bytes(bytes(data))
+
+    assert repack(str(path), 9, steim.STEIM2)
+    recs = list(Input(str(path)))
+    assert [rec.raw for rec in recs if rec.encoding == steim.INT32] == [bytes(data[other:])]
+    assert all(rec.size == 512 for rec in recs if rec.encoding != steim.INT32)
+
+
+def test_extract(tmp_path, monkeypatch):
+    # Records overlapping the windows are copied once; the rest is left for route()
+    root = tmp_path / 'sds'
+    shutil.copytree('tests/sds', str(root))
+
+    # the archive is scanned once for all lines
+    scanned = []
+
+    def counting_scan(root, func, starttime=None, endtime=None, select=None, jobs=1):
+        scanned.append((starttime, endtime))
+        return scan(root, func, starttime, endtime, select, jobs)
+
+    monkeypatch.setattr(sds, 'scan', counting_scan)
+    postdata = ("quality=B\n"
+                "GE APE -- BHE 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE APE -- BHN 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE APE -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE APE -- BHZ 2001-01-01T09:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE XYZ -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE XYZ -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n")
+    start = datetime(2001, 1, 1, 8)
+    end = datetime(2001, 1, 1, 9, 15)
+
+    expected = []
+
+    for cha in ('BHE', 'BHN', 'BHZ'):
+        path = 'tests/sds/2001/GE/APE/%s.D/GE.APE..%s.D.2001.001' % (cha, cha)
+        expected += [rec.raw for rec in Input(path) if rec.begin_time < end and rec.end_time > start]
+
+    for indexed in (False, True):
+        if indexed:
+            for cha in ('BHE', 'BHN', 'BHZ'):
+                msindex.update(str(root / ('2001/GE/APE/%s.D/GE.APE..%s.D.2001.001' % (cha, cha))))
+
+        dest = io.BytesIO()
+        nets = set()
+        remaining = extract(str(root), postdata, dest, nets)
+        assert dest.getvalue() == b''.join(expected)
+        assert nets == {('GE', 2001)}
+        assert scanned == [(start, end)] * (indexed + 1)
+        assert remaining == (
+            "quality=B\n"
+            "GE APE -- BHE 2001-01-01T08:00:00Z 2001-01-01T08:04:31.215867Z\n"
+            "GE APE -- BHE 2001-01-01T08:07:19.615867Z 2001-01-01T09:12:28.215867Z\n"
+            "GE APE -- BHN 2001-01-01T08:00:00Z 2001-01-01T09:12:28.215867Z\n"
+            "GE APE -- BHZ 2001-01-01T08:00:00Z 2001-01-01T08:04:31.215867Z\n"
+            "GE APE -- BHZ 2001-01-01T08:07:21.115867Z 2001-01-01T09:12:28.215867Z\n"
+            "GE XYZ -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n")
+
+
+def test_extract_wildcards(tmp_path):
+    # A wildcard may match stations that are not in the archive, so the line is forwarded as is
+    root = tmp_path / 'sds'
+    shutil.copytree('tests/sds', str(root))
+    postdata = ("GE * -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE APE -- BH? 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+                "GE * -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n")
+
+    dest = io.BytesIO()
+    nets = set()
+    remaining = extract(str(root), postdata, dest, nets)
+    assert dest.getvalue() == b''
+    assert nets == set()
+    assert remaining == (
+        "GE * -- BHZ 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n"
+        "GE APE -- BH? 2001-01-01T08:00:00Z 2001-01-01T09:15:00Z\n")
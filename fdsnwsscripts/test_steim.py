@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Tests to check that the Mini-SEED data decoder is working
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   :Copyright:
+       2019-2024 Helmholtz Centre Potsdam GFZ German Research Centre for Geosciences (Andres Heinloo)
+   :License:
+       LGPLv3 GNU Lesser General Public License v. 3 (29 June 2007, or later)
+   :Platform:
+       Linux
+"""
+import random
+import struct
+import pytest
+from fdsnwsscripts.seiscomp import steim
+from fdsnwsscripts.seiscomp.mseedlite import Input
+from fdsnwsscripts.seiscomp.mseedlite import traces
+
+"""Test the functionality of seiscomp/steim.py"""
+
+# (control nibble, decode nibble, number of differences, bits) of every
+# Steim-1 and Steim-2 word layout
+STEIM1_LAYOUTS = [(1, None, 4, 8), (2, None, 2, 16), (3, None, 1, 32)]
+STEIM2_LAYOUTS = [(1, None, 4, 8), (2, 1, 1, 30), (2, 2, 2, 15), (2, 3, 3, 10),
+                  (3, 0, 5, 6), (3, 1, 6, 5), (3, 2, 7, 4)]
+
+
+def steim_frames(rng, order, X0, d0, layouts):
+    """Steim frames with one data word of each of layouts, and their samples.
+
+    The last frame is partial if the words do not fill it; its remaining
+    words are unused (control nibble 0).
+    """
+    # the first frame starts with X0 and Xn
+    slots = [(f, i) for f in range((len(layouts) + 2) // 15 + 1) for i in range(1, 16)][2:]
+    frames = [[0] * 16 for _ in range(slots[len(layouts) - 1][0] + 1)]
+    samples = [X0]
+    first = True
+
+    for ((f, i), (c, dnib, n, bits)) in zip(slots, layouts):
+        frames[f][0] |= c << (30 - 2 * i)
+        w = 0 if dnib is None else dnib << 30
+
+        for k in range(n):
+            d = rng.randint(-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+
+            # the first difference refers to the previous record
+            if first:
+                d = d0
+                first = False
+
+            else:
+                # keep the samples within 32 bits
+                if not -2**31 <= samples[-1] + d < 2**31:
+                    d = -d - 1 if d < 0 else -d
+
+                samples.append(samples[-1] + d)
+
+            w |= (d & ((1 << bits) - 1)) << ((n - 1 - k) * bits)
+
+        frames[f][i] = w
+
+    frames[0][1] = X0 & 0xffffffff
+    frames[0][2] = samples[-1] & 0xffffffff
+    return (b''.join(struct.pack(order + "16L", *words) for words in frames), len(frames), samples)
+
+
+def steim2_frame(rng, order, X0, d0):
+    """A single Steim-2 frame using every word layout, and its samples."""
+    (frame, nframes, samples) = steim_frames(rng, order, X0, d0, STEIM2_LAYOUTS)
+    return (frame, samples)
+
+
+def test_steim2():
+    # Both decoders handle every Steim-2 word layout and byte order
+    rng = random.Random(1)
+
+    for order in ('>', '<'):
+        (frame, samples) = steim2_frame(rng, order, 1000, -3)
+        big_endian = order == '>'
+
+        assert list(steim.decode_python(frame, steim.STEIM2, len(samples), 1, big_endian)) == samples
+        assert list(steim.decode(frame, steim.STEIM2, len(samples), 1, big_endian)) == samples
+
+        with pytest.raises(steim.SteimError):
+            steim.decode(frame, steim.STEIM2, len(samples) + 1, 1, big_endian)
+
+        with pytest.raises(steim.SteimError):
+            steim.decode_python(frame, steim.STEIM2, len(samples) + 1, 1, big_endian)
+
+        # corrupt Xn
+        bad = frame[:8] + struct.pack(order + "l", samples[-1] + 1) + frame[12:]
+
+        with pytest.raises(steim.SteimError):
+            steim.decode(bad, steim.STEIM2, len(samples), 1, big_endian)
+
+        with pytest.raises(steim.SteimError):
+            steim.decode_python(bad, steim.STEIM2, len(samples), 1, big_endian)
+
+
+@pytest.mark.skipif(steim.numpy is None, reason="requires NumPy")
+def test_numpy_reference():
+    # The NumPy decoder gives the same samples as the reference on every word layout and partial frames
+    rng = random.Random(2)
+
+    for (encoding, layouts) in [(steim.STEIM1, STEIM1_LAYOUTS), (steim.STEIM2, STEIM2_LAYOUTS)]:
+        for n in (1, 12, 13, 14, 28, 29, 60):
+            for order in ('>', '<'):
+                # every layout is used if there are enough words
+                words = layouts[:n] + [rng.choice(layouts) for _ in range(n - len(layouts))]
+                rng.shuffle(words)
+                (data, nframes, samples) = steim_frames(rng, order, rng.randint(-2**20, 2**20), 5, words)
+                big_endian = order == '>'
+
+                # the last frame is partial unless the words fill it
+                assert nframes == (n + 2 + 14) // 15 and len(data) == nframes * steim.FRAME_LEN
+
+                expected = list(steim.decode_python(data, encoding, len(samples), nframes, big_endian))
+                assert expected == samples
+                assert list(steim._decode_numpy(data, encoding, len(samples), nframes, big_endian)) == expected
+
+
+def test_uncompressed():
+    # Uncompressed encodings in both byte orders
+    for (encoding, typecode, values) in [(steim.INT16, 'h', [-32768, 0, 32767]),
+                                         (steim.INT32, 'l', [-2**31, 0, 2**31 - 1]),
+                                         (steim.FLOAT32, 'f', [-1.5, 0.0, 2.25]),
+                                         (steim.FLOAT64, 'd', [-1e300, 0.0, 1e-300])]:
+        for order in ('>', '<'):
+            data = struct.pack(order + "%d%s" % (len(values), typecode), *values) + b'\0' * 8
+            assert list(steim.decode(data, encoding, 3, None, order == '>')) == values
+            assert list(steim.decode_python(data, encoding, 3, None, order == '>')) == values
+
+
+def test_steim1_records():
+    # The NumPy decoder agrees with the reference and with X0 and Xn
+    for rec in Input('tests/GE.APE.mseed'):
+        samples = rec.samples()
+        assert list(samples) == list(steim.decode_python(rec.data, rec.encoding, rec.nsamp, rec.nframes))
+        assert len(samples) == rec.nsamp
+        assert samples[0] == rec.X0 and samples[-1] == rec.Xn
+
+
+def test_traces():
+    # Records of each channel are joined across contiguous records only
+    recs = list(Input('tests/GE.APE.mseed'))
+    result = list(traces(recs))
+
+    assert sum(len(t.samples) for t in result) == sum(rec.nsamp for rec in recs)
+
+    for cha in ('BHE', 'BHN', 'BHZ'):
+        segments = sorted((t.begin_ns, t.end_ns) for t in result if t.cha == cha)
+        assert all(abs(begin - end) * 20 > 500000000 for ((_, end), (begin, _)) in zip(segments, segments[1:]))
+
+    for t in result:
+        assert abs(len(t.samples) - (t.end_ns - t.begin_ns) * t.fsamp / 1e9) < 1
+
+
+def test_encode():
+    # Encoded samples decode to the same values, filling the frames
+    rng = random.Random(3)
+    samples = [0]
+    for i in range(2000):
+        x = samples[-1] + rng.choice([rng.randint(-7, 7), rng.randint(-500, 500),
+                                      rng.randint(-2**28, 2**28)])
+        samples.append(max(-2**30, min(2**30, x)))
+
+    for encoding in (steim.STEIM1, steim.STEIM2):
+        (data, count) = steim.encode(samples, encoding, 7, X_minus1=-5)
+        assert len(data) == 7 * steim.FRAME_LEN and 0 < count < len(samples)
+        assert list(steim.decode(data, encoding, count, 7)) == samples[:count]
+        assert list(steim.decode_python(data, encoding, count, 7)) == samples[:count]
+
+        (data, count) = steim.encode(samples, encoding, 1000)
+        assert count == len(samples)
+        assert list(steim.decode(data, encoding, count)) == samples
+
+    with pytest.raises(steim.SteimError):
+        steim.encode([0, 2**30], steim.STEIM2, 1)
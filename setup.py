@@ -116,5 +116,6 @@ setup(
         fdsnws2seed=fdsnwsscripts.fdsnws2seed:main
         fdsnxml2arclink=fdsnwsscripts.fdsnxml2arclink:main
         fdsnavail=fdsnwsscripts.fdsnavail:main
+        sdstool=fdsnwsscripts.sdstool:main
     '''
 )